@@ -1,16 +1,30 @@
 """
 Модуль для отправки уведомлений администратору
 """
+import asyncio
 import logging
 from typing import Dict, Any, Optional
 import aiohttp
 from config import ADMIN_BOT_TOKEN, ADMIN_CHAT_ID
+from http_client import HTTPClientManager
+from rate_limiter import TelegramRateLimiter, PRIORITY_ADMIN
 
 logger = logging.getLogger(__name__)
 
 class AdminNotifier:
-    def __init__(self):
-        """Инициализация уведомителя админа"""
+    def __init__(self, http: Optional[HTTPClientManager] = None,
+                 rate_limiter: Optional[TelegramRateLimiter] = None):
+        """
+        Инициализация уведомителя админа
+        
+        Args:
+            http (Optional[HTTPClientManager]): Общий HTTP клиент приложения
+            rate_limiter (Optional[TelegramRateLimiter]): Ограничитель частоты вызовов
+                админского бота (по умолчанию свой: у бота с другим токеном свои
+                лимиты, и основной бот не должен отдавать ему свою корзину)
+        """
+        self.http = http or HTTPClientManager()
+        self.rate_limiter = rate_limiter or TelegramRateLimiter()
         self.bot_token = ADMIN_BOT_TOKEN
         self.chat_id = ADMIN_CHAT_ID
         
@@ -57,16 +71,14 @@ class AdminNotifier:
                 'disable_web_page_preview': True
             }
 
-            timeout = aiohttp.ClientTimeout(total=10)
+            status = await self._send(payload)
             
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.post(self.api_url, json=payload) as response:
-                    if response.status == 200:
-                        logger.info(f"Уведомление о таймауте отправлено админу для сессии {session_id}")
-                        return True
-                    else:
-                        logger.error(f"Ошибка при отправке уведомления админу: {response.status}")
-                        return False
+            if status == 200:
+                logger.info(f"Уведомление о таймауте отправлено админу для сессии {session_id}")
+                return True
+            else:
+                logger.error(f"Ошибка при отправке уведомления админу: {status}")
+                return False
 
         except Exception as e:
             logger.error(f"Ошибка при отправке уведомления админу: {e}")
@@ -100,16 +112,14 @@ class AdminNotifier:
                 'disable_web_page_preview': True
             }
 
-            timeout = aiohttp.ClientTimeout(total=10)
+            status = await self._send(payload)
             
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.post(self.api_url, json=payload) as response:
-                    if response.status == 200:
-                        logger.info("Уведомление об ошибке отправлено админу")
-                        return True
-                    else:
-                        logger.error(f"Ошибка при отправке уведомления об ошибке: {response.status}")
-                        return False
+            if status == 200:
+                logger.info("Уведомление об ошибке отправлено админу")
+                return True
+            else:
+                logger.error(f"Ошибка при отправке уведомления об ошибке: {status}")
+                return False
 
         except Exception as e:
             logger.error(f"Ошибка при отправке уведомления об ошибке: {e}")
@@ -145,16 +155,42 @@ class AdminNotifier:
                 'disable_web_page_preview': True
             }
 
-            timeout = aiohttp.ClientTimeout(total=10)
+            status = await self._send(payload)
             
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.post(self.api_url, json=payload) as response:
-                    return response.status == 200
+            return status == 200
 
         except Exception as e:
             logger.error(f"Ошибка при отправке статистики: {e}")
             return False
 
+    async def _send(self, payload: Dict[str, Any]) -> int:
+        """
+        Отправка сообщения через админского бота с учетом лимитов Telegram
+        
+        Args:
+            payload (Dict): Параметры sendMessage
+            
+        Returns:
+            int: HTTP статус ответа
+        """
+        timeout = aiohttp.ClientTimeout(total=10)
+        
+        for attempt in range(2):
+            await self.rate_limiter.acquire(self.chat_id, PRIORITY_ADMIN)
+            
+            async with self.http.session.post(self.api_url, json=payload, timeout=timeout) as response:
+                if response.status != 429 or attempt:
+                    return response.status
+                
+                # У админского бота свои лимиты: ждем только здесь, не останавливая основной бот
+                result = await response.json(content_type=None)
+                retry_after = (result.get('parameters') or {}).get('retry_after', 1)
+                logger.warning(f"Админский бот превысил лимит Telegram, повтор через {retry_after} с")
+            
+            await asyncio.sleep(retry_after)
+        
+        return 429
+
     def _format_user_info(self, user_data: Dict[str, Any]) -> str:
         """
         Форматирование информации о пользователе
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Сравнение скорости очистки HTML: прежняя цепочка re.sub и telegram_html
+
+Запуск: python benchmark_telegram_html.py [--repeat N]
+Проверки без замеров: python benchmark_telegram_html.py --check [--seed N] [--cases N]
+"""
+import argparse
+import random
+import re
+import timeit
+from typing import Any, Callable, Dict
+
+from telegram_html import TELEGRAM_MESSAGE_LIMIT, sanitize_telegram_html, split_telegram_html
+
+
+def legacy_clean_html(html_text: str) -> str:
+    """Прежняя очистка из WebhookHandler._clean_html_for_telegram (без логирования)"""
+    html_text = re.sub(r'<p[^>]*>', '', html_text)
+    html_text = re.sub(r'</p>', '\n\n', html_text)
+    html_text = re.sub(r'<br\s*/?>', '\n', html_text)
+    html_text = re.sub(r'<div[^>]*>', '', html_text)
+    html_text = re.sub(r'</div>', '\n', html_text)
+    html_text = re.sub(r'<span[^>]*>', '', html_text)
+    html_text = re.sub(r'</span>', '', html_text)
+    html_text = re.sub(r'<h[1-6][^>]*>', '<b>', html_text)
+    html_text = re.sub(r'</h[1-6]>', '</b>\n\n', html_text)
+    unsupported_tags = ['ul', 'ol', 'li', 'table', 'tr', 'td', 'th', 'thead', 'tbody']
+    for tag in unsupported_tags:
+        html_text = re.sub(f'<{tag}[^>]*>', '', html_text)
+        html_text = re.sub(f'</{tag}>', '\n', html_text)
+    html_text = re.sub(r'\n{3,}', '\n\n', html_text)
+    return html_text.strip()
+
+
+SENTENCES = [
+    "Помогаю женщинам 30+ сбросить <b>5-7 кг за месяц</b> без жестких диет 🎯",
+    "Работаю с <i>малым бизнесом</i>, стартапами и онлайн-проектами 💼",
+    "Средний рост выручки клиентов &mdash; <strong>30% за 3 месяца</strong> &amp; больше",
+    "Подробнее в статье <a href=\"https://example.com/article?id=1&utm=tg\">10 способов увеличить продажи</a>",
+    "Никаких <s>голодовок</s> и <u>изнурительных тренировок</u>, только система",
+    "Разбираем ошибки в формате <code>вопрос-ответ</code> < 15 минут",
+]
+
+
+def generate_llm_post(size: int, seed: int = 0) -> str:
+    """
+    Пост в стиле ответа LLM: заголовки, абзацы, списки, таблицы, незакрытые теги
+
+    Args:
+        size (int): Примерная длина текста в символах
+        seed (int): Зерно генератора
+
+    Returns:
+        str: HTML текст
+    """
+    rng = random.Random(seed)
+    blocks = []
+    length = 0
+    while length < size:
+        kind = rng.random()
+        if kind < 0.15:
+            block = f"<h2 class=\"title\">{rng.choice(SENTENCES)}</h2>\n\n\n"
+        elif kind < 0.35:
+            items = ''.join(f"<li>{rng.choice(SENTENCES)}</li>\n" for _ in range(rng.randint(2, 5)))
+            block = f"<ul>\n{items}</ul>\n"
+        elif kind < 0.45:
+            cells = ''.join(f"<td>{rng.choice(SENTENCES)}</td>" for _ in range(2))
+            block = f"<table><tbody><tr>{cells}</tr></tbody></table>\n"
+        elif kind < 0.55:
+            block = f"<div><span style=\"color:red\">{rng.choice(SENTENCES)}</span><br/></div>\n"
+        else:
+            text = ' '.join(rng.choice(SENTENCES) for _ in range(rng.randint(2, 4)))
+            # LLM иногда забывает закрыть тег
+            block = f"<p>{text}{' <b>важно' if rng.random() < 0.1 else ''}</p>\n\n"
+        blocks.append(block)
+        length += len(block)
+    return ''.join(blocks)
+
+
+def check_balanced(html_text: str) -> bool:
+    """Проверка, что теги закрыты в правильном порядке"""
+    stack = []
+    for match in re.finditer(r'<(/?)([a-z-]+)[^>]*>', html_text):
+        if match.group(1):
+            if not stack or stack.pop() != match.group(2):
+                return False
+        else:
+            stack.append(match.group(2))
+    return not stack
+
+
+def visible_length(chunk: str) -> int:
+    """Длина сообщения так, как ее считает Telegram: без тегов, сущность - один символ"""
+    visible = re.sub(r'&[^;]+;', '.', re.sub(r'<[^>]+>', '', chunk))
+    return len(visible.encode('utf-16-le')) // 2
+
+
+# Регрессии очистки: вход -> ожидаемый результат
+SANITIZE_CASES = [
+    # > и < внутри кавычек атрибута - часть тега
+    ('<a href="https://example.com/?q=a>b">ссылка</a>',
+     '<a href="https://example.com/?q=a&gt;b">ссылка</a>'),
+    ('<a title="x <b>y</b>" href="https://example.com">ссылка</a>',
+     '<a href="https://example.com">ссылка</a>'),
+    ('<code class="language-python">if a > b: pass</code>',
+     '<code class="language-python">if a &gt; b: pass</code>'),
+    # Кавычка в тексте или в теге без сохраняемых атрибутов не поглощает следующие теги
+    ('Если a < b, пишем x="1 <b>важно</b>: y="2" и <i>курсив</i>',
+     'Если a &lt; b, пишем x="1 <b>важно</b>: y="2" и <i>курсив</i>'),
+    ('<p class="x>y">текст</p>', 'y"&gt;текст'),
+    ('<a href="https://example.com>ссылка <b>жирный</b>', 'ссылка <b>жирный</b>'),
+    ('5 < 7 и 9 > 8', '5 &lt; 7 и 9 &gt; 8'),
+]
+
+# Фрагменты для случайных текстов: теги, кавычки, одиночные < и >, сущности, эмодзи
+FUZZ_PIECES = [
+    '<b>', '</b>', '<i>', '</i>', '<strong>', '</em>', '<u>', '</s>', '<pre>', '</pre>',
+    '<code>', '</code>', '<code class="language-py">', '<a href="https://example.com/?a=1&b=2">',
+    '<a href="x>y">', '</a>', '<blockquote expandable>', '</blockquote>', '<span class="tg-spoiler">',
+    '</span>', '<h2>', '</h2>', '<p>', '</p>', '<br/>', '<li>', '<!-- x -->',
+    '<', '>', '<>', '<<', '"', "'", '="', '&', '&amp;', '&mdash;', '&#128512;',
+    ' ', '\n', '\n\n', 'слово', 'word', '🎯', 'a' * 60,
+]
+
+
+def random_html(rng: random.Random, pieces: int) -> str:
+    """Случайная смесь фрагментов FUZZ_PIECES"""
+    return ''.join(rng.choice(FUZZ_PIECES) for _ in range(pieces))
+
+
+def run_checks(seed: int, cases: int) -> int:
+    """
+    Проверка известных регрессий и инвариантов очистки и разбиения на случайных текстах
+
+    Инварианты: результат очистки сбалансирован, каждая часть после разбиения
+    сбалансирована и не длиннее лимита, разбиение не падает и на тексте без очистки.
+
+    Args:
+        seed (int): Зерно генератора случайных текстов
+        cases (int): Количество случайных текстов
+
+    Returns:
+        int: Количество нарушений
+    """
+    failures = 0
+    for source, expected in SANITIZE_CASES:
+        result = sanitize_telegram_html(source)
+        if result != expected:
+            failures += 1
+            print(f"Очистка {source!r}: {result!r}, ожидалось {expected!r}")
+
+    rng = random.Random(seed)
+    for case in range(cases):
+        text = random_html(rng, rng.randint(1, 200))
+        limit = rng.choice([20, 50, 200, TELEGRAM_MESSAGE_LIMIT])
+        try:
+            cleaned = sanitize_telegram_html(text)
+            split_telegram_html(text, limit)
+            chunks = split_telegram_html(cleaned, limit)
+        except Exception as e:
+            failures += 1
+            print(f"Случай {case}: {e!r} на {text!r}")
+            continue
+
+        if not check_balanced(cleaned):
+            failures += 1
+            print(f"Случай {case}: теги не сбалансированы после очистки {text!r}")
+        for chunk in chunks:
+            if not check_balanced(chunk) or visible_length(chunk) > limit:
+                failures += 1
+                print(f"Случай {case}: часть {chunk!r} (лимит {limit}) из {text!r}")
+                break
+
+    print(f"Проверок: {len(SANITIZE_CASES)} регрессий и {cases} случайных текстов (seed {seed}), "
+          f"нарушений: {failures}")
+    return failures
+
+
+def best_time(functions: Dict[str, Callable[[], Any]], number: int, repeat: int) -> Dict[str, float]:
+    """
+    Лучшее время одного вызова каждой функции (замеры чередуются, чтобы
+    фоновая нагрузка одинаково влияла на все варианты)
+
+    Args:
+        functions (Dict): Имя -> функция без аргументов
+        number (int): Вызовов в одном замере
+        repeat (int): Количество замеров
+
+    Returns:
+        Dict: Имя -> секунды на вызов
+    """
+    best = {name: float('inf') for name in functions}
+    for _ in range(repeat):
+        for name, function in functions.items():
+            best[name] = min(best[name], timeit.timeit(function, number=number) / number)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк очистки HTML для Telegram")
+    parser.add_argument('--repeat', type=int, default=20, help="Количество замеров каждого варианта")
+    parser.add_argument('--check', action='store_true', help="Только проверки корректности, без замеров")
+    parser.add_argument('--seed', type=int, default=0, help="Зерно случайных текстов для --check")
+    parser.add_argument('--cases', type=int, default=5000, help="Количество случайных текстов для --check")
+    args = parser.parse_args()
+
+    if args.check:
+        raise SystemExit(1 if run_checks(args.seed, args.cases) else 0)
+
+    print(f"{'размер':>8} {'прежняя, мс':>12} {'новая, мс':>10} {'ускорение':>10} "
+          f"{'+разбиение, мс':>15} {'частей':>7} {'баланс (прежняя/новая)':>23}")
+
+    for size in [1_500, 4_000, 16_000, 64_000, 256_000]:
+        text = generate_llm_post(size)
+        number = max(1, 100_000 // size)
+
+        times = best_time({
+            'legacy': lambda: legacy_clean_html(text),
+            'new': lambda: sanitize_telegram_html(text),
+            'split': lambda: split_telegram_html(sanitize_telegram_html(text)),
+        }, number, args.repeat)
+
+        chunks = split_telegram_html(sanitize_telegram_html(text))
+        for chunk in chunks:
+            assert visible_length(chunk) <= TELEGRAM_MESSAGE_LIMIT
+        legacy_balanced = check_balanced(legacy_clean_html(text))
+        balanced = all(check_balanced(chunk) for chunk in chunks)
+
+        print(f"{len(text):>8} {times['legacy'] * 1000:>12.3f} {times['new'] * 1000:>10.3f} "
+              f"{times['legacy'] / times['new']:>9.2f}x {times['split'] * 1000:>15.3f} {len(chunks):>7} "
+              f"{str(legacy_balanced):>11}/{balanced}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,14 +3,16 @@
 """
 import logging
 import asyncio
+import signal
 from typing import Optional
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand, Chat, ChatMember
 from telegram.ext import (
     Application, 
     CommandHandler, 
     MessageHandler, 
     CallbackQueryHandler,
+    ChatMemberHandler,
     filters,
     ContextTypes
 )
@@ -20,9 +22,27 @@ from config import (
     TELEGRAM_BOT_TOKEN, 
     MESSAGES, 
     REGISTRATION_STEPS,
-    LOG_LEVEL
+    LOG_LEVEL,
+    BOT_MAX_CONCURRENT_UPDATES,
+    BOT_RUN_MODE,
+    TELEGRAM_WEBHOOK_URL,
+    TELEGRAM_WEBHOOK_PATH,
+    TELEGRAM_WEBHOOK_SECRET,
+    TELEGRAM_ALLOWED_UPDATES,
+    BOT_WEBHOOK_HOST,
+    BOT_WEBHOOK_PORT,
+    GENERATION_TIMEOUT,
+    GENERATION_SWEEP_INTERVAL,
+    GENERATION_SWEEP_CONCURRENCY,
+    ADMIN_RIGHTS_CACHE_TTL,
+    ADMIN_RIGHTS_CACHE_SIZE,
+    UPDATE_DEDUP_TTL,
+    UPDATE_DEDUP_SIZE,
+    CALLBACK_DEDUP_WINDOW,
+    TELEGRAM_GLOBAL_RATE
 )
-from database import Database
+from cache import LRUTTLCache
+from database import Database, UserLockTimeout, create_database
 from utils import (
     extract_email_from_text, 
     is_valid_email, 
@@ -40,6 +60,16 @@ from utils import (
 from n8n_client import N8NClient
 from admin_notifier import AdminNotifier
 from voice_transcriber import VoiceTranscriber
+from http_client import HTTPClientManager
+from update_processor import PerUserUpdateProcessor
+from idempotency import UpdateDeduplicator
+from telegram_transport import create_bot_request, create_updates_request
+from rate_limiter import TelegramRateLimiter, PRIORITY_SYSTEM
+from media_registry import MediaRegistry, CHANNEL_ADMIN_VIDEO, PINNED_POST_VIDEO
+from telegram_html import send_html_message
+
+# Максимум просроченных сессий, выбираемых из базы за один запрос
+GENERATION_SWEEP_BATCH_SIZE = 100
 
 # Настройка логирования
 logging.basicConfig(
@@ -49,23 +79,84 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class TelegramBot:
-    def __init__(self):
-        """Инициализация бота"""
+    def __init__(self, db: Optional[Database] = None):
+        """
+        Инициализация бота
+        
+        Args:
+            db (Optional[Database]): Хранилище (по умолчанию - по настройке DB_BACKEND)
+        """
         if not TELEGRAM_BOT_TOKEN:
             raise ValueError("TELEGRAM_BOT_TOKEN не установлен")
         
-        self.db = Database()
-        self.n8n_client = N8NClient()
-        self.admin_notifier = AdminNotifier()
-        self.voice_transcriber = VoiceTranscriber()
-        self.application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+        self.db = db or create_database()
+        
+        # Один пул HTTP соединений на все исходящие запросы
+        self.http = HTTPClientManager()
+        # Общий ограничитель частоты вызовов Bot API; у админского бота свой
+        # токен и свои лимиты, поэтому и ограничитель свой
+        self.rate_limiter = TelegramRateLimiter()
+        self.n8n_client = N8NClient(self.http)
+        self.admin_notifier = AdminNotifier(self.http)
+        self.voice_transcriber = VoiceTranscriber(self.http)
+        # Видео с инструкциями отправляются по file_id, клавиатуры строятся один раз
+        self.media = MediaRegistry()
+        
+        # Разные пользователи обрабатываются параллельно, один пользователь - по очереди;
+        # повторные доставки и двойные нажатия отбрасываются при поступлении
+        self.update_processor = PerUserUpdateProcessor(
+            BOT_MAX_CONCURRENT_UPDATES,
+            UpdateDeduplicator(UPDATE_DEDUP_SIZE, UPDATE_DEDUP_TTL, CALLBACK_DEDUP_WINDOW)
+        )
+        
+        # Исходящие вызовы Bot API и getUpdates идут через разные пулы соединений
+        self.bot_request = create_bot_request()
+        self.updates_request = create_updates_request()
+        self.application = (
+            Application.builder()
+            .token(TELEGRAM_BOT_TOKEN)
+            .request(self.bot_request)
+            .get_updates_request(self.updates_request)
+            .rate_limiter(self.rate_limiter)
+            .concurrent_updates(self.update_processor)
+            .post_init(self._post_init)
+            .post_shutdown(self._post_shutdown)
+            .build()
+        )
         self.bot_username = None
+        self._generation_timeout_task: Optional[asyncio.Task] = None
+        
+        # Права бота в каналах: username канала (в нижнем регистре) -> is_admin
+        self.admin_rights = LRUTTLCache(ADMIN_RIGHTS_CACHE_SIZE, ADMIN_RIGHTS_CACHE_TTL)
         
         # Добавляем обработчики
         self._setup_handlers()
         
         logger.info("Telegram бот инициализирован")
 
+    async def _post_init(self, application: Application):
+        """Подготовка после инициализации приложения, до приема обновлений"""
+        # initialize() уже получил данные бота через get_me
+        self.bot_username = application.bot.username
+        
+        # Загружаем активные сессии одним запросом, чтобы не читать их по одной
+        await self.db.warm_session_cache()
+        
+        # Активность пользователей пишется в базу пачками в фоне
+        self.db.start_activity_flusher()
+        
+        # Одна фоновая задача проверяет таймауты генерации всех сессий
+        self._generation_timeout_task = asyncio.create_task(self._generation_timeout_loop())
+
+    async def _post_shutdown(self, application: Application):
+        """Освобождение ресурсов после остановки приложения"""
+        if self._generation_timeout_task:
+            self._generation_timeout_task.cancel()
+            self._generation_timeout_task = None
+        
+        await self.http.close()
+        await self.db.close()
+
     def _setup_handlers(self):
         """Настройка обработчиков команд и сообщений"""
         
@@ -87,6 +178,12 @@ class TelegramBot:
             self.handle_voice_message
         ))
         
+        # Изменение прав бота в каналах
+        self.application.add_handler(ChatMemberHandler(
+            self.handle_my_chat_member,
+            ChatMemberHandler.MY_CHAT_MEMBER
+        ))
+        
         logger.info("Обработчики команд настроены")
 
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -95,11 +192,9 @@ class TelegramBot:
         
         logger.info(f"Команда /start от пользователя: {format_user_info(user)}")
         
-        # Обновляем время последней активности
-        await self.db.update_last_activity(user.id)
-        
-        # Проверяем, зарегистрирован ли пользователь
-        user_data = await self.db.get_user_by_telegram_id(user.id)
+        # Проверяем, зарегистрирован ли пользователь (заодно обновляем время активности)
+        snapshot = await self.db.get_context_snapshot(user.id)
+        user_data = snapshot['user']
         
         if user_data and user_data['registration_step'] == REGISTRATION_STEPS['COMPLETED']:
             # Получаем информацию о лимите постов
@@ -138,10 +233,15 @@ class TelegramBot:
 
     def _get_registered_user_keyboard(self):
         """Получить клавиатуру для зарегистрированного пользователя"""
-        keyboard = [
+        return self.media.keyboard('registered_user', lambda: InlineKeyboardMarkup([
             [InlineKeyboardButton("📝 Написать пост", callback_data="write_post")]
-        ]
-        return InlineKeyboardMarkup(keyboard)
+        ]))
+
+    def _get_admin_added_keyboard(self):
+        """Получить клавиатуру подтверждения прав администратора"""
+        return self.media.keyboard('admin_added', lambda: InlineKeyboardMarkup([[
+            InlineKeyboardButton("✅ Добавлено", callback_data="admin_added")
+        ]]))
 
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик текстовых сообщений"""
@@ -150,17 +250,16 @@ class TelegramBot:
         
         logger.info(f"Сообщение от {format_user_info(user)}: {message_text[:100]}...")
         
-        await self.db.update_last_activity(user.id)
-        
-        # Получаем данные пользователя
-        user_data = await self.db.get_user_by_telegram_id(user.id)
+        # Получаем данные пользователя и активную сессию одним запросом
+        snapshot = await self.db.get_context_snapshot(user.id)
+        user_data = snapshot['user']
         
         if not user_data:
             # Пользователь не найден, пытаемся обработать как email
             await self._handle_email_registration(update, message_text, user)
         else:
             # Проверяем активную сессию создания поста
-            active_session = await self.db.get_active_post_session(user.id)
+            active_session = snapshot['session']
             
             if active_session:
                 # Обрабатываем ответ в рамках сессии создания поста
@@ -230,7 +329,7 @@ class TelegramBot:
             return
         
         # Проверяем email в базе данных
-        user_data = await self.db.find_user_by_email(email)
+        user_data = await self.db.find_user_by_email(email, projection='registration')
         
         if not user_data:
             await update.message.reply_text(MESSAGES['email_not_found'])
@@ -288,26 +387,22 @@ class TelegramBot:
             self.bot_username = bot_info.username
         
         # Создаем кнопку для подтверждения
-        keyboard = InlineKeyboardMarkup([[
-            InlineKeyboardButton("✅ Добавлено", callback_data="admin_added")
-        ]])
+        keyboard = self._get_admin_added_keyboard()
         
         instructions = MESSAGES['channel_instructions'].format(
             bot_username=self.bot_username
         )
         
         # Отправляем видео с инструкциями
-        try:
-            with open('assets/channeladmin.mp4', 'rb') as video_file:
-                await update.message.reply_video(
-                    video=video_file,
-                    caption=instructions,
-                    reply_markup=keyboard,
-                    parse_mode='Markdown'
-                )
-        except FileNotFoundError:
+        sent = await self.media.send_video(
+            update.message.reply_video,
+            CHANNEL_ADMIN_VIDEO,
+            caption=instructions,
+            reply_markup=keyboard,
+            parse_mode='Markdown'
+        )
+        if not sent:
             # Если видео не найдено, отправляем только текст
-            logger.warning("Видеофайл assets/channeladmin.mp4 не найден, отправляем только текст")
             await update.message.reply_text(
                 instructions,
                 reply_markup=keyboard,
@@ -321,35 +416,36 @@ class TelegramBot:
         user = query.from_user
         
         await query.answer()
-        await self.db.update_last_activity(user.id)
+        
+        # Пользователь и активная сессия нужны почти всем обработчикам - получаем их один раз
+        snapshot = await self.db.get_context_snapshot(user.id)
+        user_data = snapshot['user']
+        active_session = snapshot['session']
         
         if query.data == "admin_added":
-            await self._check_admin_rights(query, user)
+            await self._check_admin_rights(query, user, user_data)
         elif query.data == "write_post":
-            await self._handle_write_post(query, user)
+            await self._handle_write_post(query, user, user_data)
         elif query.data == "post_approved":
-            await self._handle_post_approval(query, user)
+            await self._handle_post_approval(query, user, active_session)
         elif query.data == "post_rejected":
-            await self._handle_post_rejection(query, user)
+            await self._handle_post_rejection(query, user, active_session)
         elif query.data == "button_type_dm":
-            await self._handle_button_type_selection(query, user, "dm")
+            await self._handle_button_type_selection(query, user, "dm", user_data, active_session)
         elif query.data == "button_type_website":
-            await self._handle_button_type_selection(query, user, "website")
+            await self._handle_button_type_selection(query, user, "website", user_data, active_session)
         elif query.data.startswith("button_text_"):
-            await self._handle_button_text_selection(query, user, query.data)
+            await self._handle_button_text_selection(query, user, query.data, active_session)
         elif query.data == "final_post_approved":
-            await self._handle_final_post_approval(query, user)
+            await self._handle_final_post_approval(query, user, user_data, active_session)
         elif query.data == "final_post_rejected":
-            await self._handle_final_post_rejection(query, user)
+            await self._handle_final_post_rejection(query, user, active_session)
         elif query.data == "skip_links":
-            await self._handle_skip_links(query, user)
+            await self._handle_skip_links(query, user, user_data, active_session)
 
-    async def _check_admin_rights(self, query, user):
+    async def _check_admin_rights(self, query, user, user_data: Optional[dict]):
         """Проверка прав администратора бота в канале"""
         
-        # Получаем данные пользователя
-        user_data = await self.db.get_user_by_telegram_id(user.id)
-        
         if not user_data or not user_data.get('channel_url'):
             try:
                 await query.edit_message_text(
@@ -383,8 +479,8 @@ class TelegramBot:
         if message_deleted:
             checking_message = await query.message.chat.send_message(MESSAGES['checking_admin'])
         
-        # Используем новую функцию проверки прав
-        admin_check_result = await self._check_admin_rights_for_channel(user_data)
+        # Пользователь только что изменил права - проверяем в обход кэша
+        admin_check_result = await self._check_admin_rights_for_channel(user_data, use_cache=False)
         
         if admin_check_result['is_admin']:
             # Права есть - завершаем регистрацию
@@ -415,15 +511,13 @@ class TelegramBot:
                 query.message.chat, admin_check_result
             )
 
-    async def _handle_write_post(self, query, user):
+    async def _handle_write_post(self, query, user, user_data: Optional[dict]):
         """Обработка нажатия на кнопку 'Написать пост'"""
         
         # Показываем индикатор "печатает"
         await query.message.chat.send_action("typing")
         
         # Проверяем, что пользователь зарегистрирован
-        user_data = await self.db.get_user_by_telegram_id(user.id)
-        
         if not user_data or user_data['registration_step'] != REGISTRATION_STEPS['COMPLETED']:
             # Удаляем исходное сообщение и отправляем новое
             try:
@@ -502,12 +596,16 @@ class TelegramBot:
         
         logger.info(f"Начата сессия создания поста {session_id} для пользователя {format_user_info(user)}")
 
-    async def _check_admin_rights_for_channel(self, user_data: dict) -> dict:
+    async def _check_admin_rights_for_channel(self, user_data: dict, use_cache: bool = True) -> dict:
         """
         Проверка прав администратора бота в канале пользователя
         
+        Результат кэшируется на ADMIN_RIGHTS_CACHE_TTL секунд; изменения прав
+        приходят обновлениями my_chat_member и сразу попадают в кэш.
+        
         Args:
             user_data (dict): Данные пользователя из БД
+            use_cache (bool): Использовать закэшированный результат
             
         Returns:
             dict: Результат проверки с полями is_admin, message, reply_markup
@@ -530,20 +628,21 @@ class TelegramBot:
             
             # Проверяем права администратора
             try:
-                chat_member = await self.application.bot.get_chat_member(
-                    f"@{channel_username}", 
-                    self.application.bot.id
-                )
+                channel_key = channel_username.lower()
+                is_admin = self.admin_rights.get(channel_key) if use_cache else None
                 
-                # Проверяем статус и права
-                is_admin = (
-                    chat_member.status in ['administrator', 'creator'] and
-                    getattr(chat_member, 'can_post_messages', False)
-                )
+                if is_admin is None:
+                    chat_member = await self.application.bot.get_chat_member(
+                        f"@{channel_username}", 
+                        self.application.bot.id
+                    )
+                    is_admin = self._can_post_to_channel(chat_member)
+                    self.admin_rights.set(channel_key, is_admin)
                 
                 if is_admin:
-                    # Обновляем статус в БД
-                    await self.db.update_admin_status(user_data['telegram_id'], True)
+                    # Обновляем статус в БД (если он еще не сохранен)
+                    if not user_data.get('is_bot_admin') or not use_cache:
+                        await self.db.update_admin_status(user_data['telegram_id'], True)
                     
                     return {
                         'is_admin': True,
@@ -572,13 +671,41 @@ class TelegramBot:
                 'reply_markup': self._get_registered_user_keyboard()
             }
 
+    @staticmethod
+    def _can_post_to_channel(chat_member: ChatMember) -> bool:
+        """Бот - администратор канала с правом публикации"""
+        return (
+            chat_member.status in [ChatMember.ADMINISTRATOR, ChatMember.OWNER] and
+            getattr(chat_member, 'can_post_messages', False)
+        )
+
+    async def handle_my_chat_member(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик изменения прав бота в канале (бота назначили или сняли с администратора)"""
+        member_update = update.my_chat_member
+        chat = member_update.chat
+        
+        if chat.type != Chat.CHANNEL or not chat.username:
+            return
+        
+        is_admin = self._can_post_to_channel(member_update.new_chat_member)
+        self.admin_rights.set(chat.username.lower(), is_admin)
+        logger.info(f"Права бота в канале @{chat.username} изменены: is_admin={is_admin}")
+        
+        # Сохраняем новый статус у пользователей, указавших этот канал
+        try:
+            for user_data in await self.db.find_users_by_channel(chat.username):
+                if user_data.get('telegram_id') and user_data.get('is_bot_admin') != is_admin:
+                    await self.db.update_admin_status(user_data['telegram_id'], is_admin)
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении статуса администратора для канала @{chat.username}: {e}")
+
     def _get_not_admin_response(self, channel_username: str) -> dict:
         """Получить ответ когда бот не является администратором"""
         
         # Создаем кнопку для повторной проверки
-        keyboard = InlineKeyboardMarkup([[
+        keyboard = self.media.keyboard('admin_check_again', lambda: InlineKeyboardMarkup([[
             InlineKeyboardButton("✅ Проверить снова", callback_data="admin_added")
-        ]])
+        ]]))
         
         message = f"""
 ❌ **У меня нет прав администратора в канале `@{channel_username}`**
@@ -616,23 +743,22 @@ class TelegramBot:
         
         if send_video:
             # Отправляем видео с инструкциями
-            try:
-                with open('assets/channeladmin.mp4', 'rb') as video_file:
-                    await query.message.reply_video(
-                        video=video_file,
-                        caption=message,
-                        reply_markup=reply_markup,
-                        parse_mode='Markdown'
-                    )
+            sent = await self.media.send_video(
+                query.message.reply_video,
+                CHANNEL_ADMIN_VIDEO,
+                caption=message,
+                reply_markup=reply_markup,
+                parse_mode='Markdown'
+            )
+            if sent:
                 # Пытаемся заменить исходное сообщение
                 try:
                     await query.edit_message_text("📹 Смотрите видео-инструкцию выше ⬆️")
                 except Exception:
                     # Если не удается редактировать (например, исходное сообщение было видео), просто игнорируем
                     pass
-            except FileNotFoundError:
+            else:
                 # Если видео не найдено, отправляем только текст
-                logger.warning("Видеофайл assets/channeladmin.mp4 не найден, отправляем только текст")
                 try:
                     await query.edit_message_text(
                         message,
@@ -675,17 +801,15 @@ class TelegramBot:
         
         if send_video:
             # Отправляем видео с инструкциями
-            try:
-                with open('assets/channeladmin.mp4', 'rb') as video_file:
-                    await chat.send_video(
-                        video=video_file,
-                        caption=message,
-                        reply_markup=reply_markup,
-                        parse_mode='Markdown'
-                    )
-            except FileNotFoundError:
+            sent = await self.media.send_video(
+                chat.send_video,
+                CHANNEL_ADMIN_VIDEO,
+                caption=message,
+                reply_markup=reply_markup,
+                parse_mode='Markdown'
+            )
+            if not sent:
                 # Если видео не найдено, отправляем только текст
-                logger.warning("Видеофайл assets/channeladmin.mp4 не найден, отправляем только текст")
                 await chat.send_message(
                     message,
                     reply_markup=reply_markup,
@@ -765,8 +889,8 @@ class TelegramBot:
             # Получаем ссылки из сессии
             links = await self.db.get_session_links(session_id)
             
-            # Устанавливаем статус генерации
-            await self.db.update_session_status(session_id, 'generating')
+            # Устанавливаем статус генерации (с отметкой времени для проверки таймаута)
+            await self.db.mark_session_generating(session_id)
             
             # Отправляем запрос в n8n
             success = await self.n8n_client.send_post_generation_request(user_data, answers, links, session_id)
@@ -778,26 +902,81 @@ class TelegramBot:
             
             logger.info(f"Запрос на генерацию отправлен для сессии {session_id}")
             
-            # Запускаем таймер таймаута
-            asyncio.create_task(self._monitor_generation_timeout(session_id, user_data))
-            
         except Exception as e:
             logger.error(f"Ошибка при запуске генерации для сессии {session_id}: {e}")
             await update.message.reply_text(MESSAGES['generation_error'])
             await self.admin_notifier.notify_error(f"Ошибка генерации поста: {e}", user_data)
 
-    async def _monitor_generation_timeout(self, session_id: int, user_data: dict):
-        """Мониторинг таймаута генерации поста"""
+    async def _generation_timeout_loop(self):
+        """
+        Периодическая проверка сессий, у которых истекло время генерации
+        
+        Сессии берутся из базы по n8n_webhook_sent_at, поэтому таймауты
+        срабатывают и для генераций, начатых до перезапуска бота.
+        """
+        while True:
+            try:
+                await asyncio.sleep(GENERATION_SWEEP_INTERVAL)
+                await self._sweep_generation_timeouts()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка при проверке таймаутов генерации: {e}")
+
+    async def _sweep_generation_timeouts(self) -> int:
+        """
+        Обработка всех сессий с истекшим временем генерации
+        
+        Returns:
+            int: Количество сброшенных сессий
+        """
+        semaphore = asyncio.Semaphore(GENERATION_SWEEP_CONCURRENCY)
         
-        # Ждем 3 минуты
-        await asyncio.sleep(180)  # 3 минуты = 180 секунд
+        async def expire(session: dict) -> bool:
+            async with semaphore:
+                return await self._expire_generation(session)
         
-        # Проверяем, не завершилась ли сессия за это время
-        session = await self.db.get_active_post_session(user_data['telegram_id'])
+        expired_total = 0
+        while True:
+            sessions = await self.db.get_expired_generating_sessions(
+                GENERATION_TIMEOUT, limit=GENERATION_SWEEP_BATCH_SIZE
+            )
+            if not sessions:
+                break
+            
+            results = await asyncio.gather(*(expire(session) for session in sessions))
+            expired_total += sum(results)
+            
+            # Неполная пачка - больше просроченных сессий нет
+            if len(sessions) < GENERATION_SWEEP_BATCH_SIZE or not any(results):
+                break
         
-        if session and session['id'] == session_id and session['session_status'] == 'generating':
-            # Таймаут! Уведомляем админа и сбрасываем сессию
+        if expired_total:
+            logger.warning(f"Сброшено сессий с истекшим временем генерации: {expired_total}")
+        return expired_total
+
+    async def _expire_generation(self, session: dict) -> bool:
+        """
+        Сброс сессии с истекшим временем генерации и уведомления
+        
+        Args:
+            session (dict): Сессия (проекция 'timeout')
+            
+        Returns:
+            bool: True если сессию сбросил этот вызов
+        """
+        session_id = session['id']
+        telegram_id = session['telegram_id']
+        
+        try:
+            # Сессия сбрасывается, только если все еще в статусе generating: результат
+            # мог прийти после выборки, а сессию могла сбросить другая реплика
+            if not await self.db.expire_generating_session(session_id):
+                return False
+            
+            # Таймаут! Уведомляем админа и пользователя
             logger.warning(f"Таймаут генерации для сессии {session_id}")
+            user_data = await self.db.get_user_by_telegram_id(telegram_id) or {'telegram_id': telegram_id}
             
             # Уведомляем админа
             await self.admin_notifier.notify_timeout(user_data, session_id)
@@ -805,26 +984,22 @@ class TelegramBot:
             # Уведомляем n8n о таймауте
             await self.n8n_client.notify_timeout(user_data, session_id)
             
-            # Очищаем ответы и сбрасываем сессию
-            await self.db.clear_session_answers(session_id)
-            
             # Отправляем сообщение пользователю
-            try:
-                await self.application.bot.send_message(
-                    chat_id=user_data['telegram_id'],
-                    text=MESSAGES['generation_timeout'],
-                    reply_markup=self._get_registered_user_keyboard(),
-                    disable_web_page_preview=True
-                )
-            except Exception as e:
-                logger.error(f"Ошибка при отправке сообщения о таймауте пользователю {user_data['telegram_id']}: {e}")
+            await self.application.bot.send_message(
+                chat_id=telegram_id,
+                text=MESSAGES['generation_timeout'],
+                reply_markup=self._get_registered_user_keyboard(),
+                disable_web_page_preview=True,
+                rate_limit_args=PRIORITY_SYSTEM
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при обработке таймаута генерации сессии {session_id}: {e}")
+        
+        return True
 
-    async def _handle_post_approval(self, query, user):
+    async def _handle_post_approval(self, query, user, active_session: Optional[dict]):
         """Обработка одобрения поста пользователем"""
         
-        # Получаем активную сессию
-        active_session = await self.db.get_active_post_session(user.id)
-        
         if not active_session or active_session['session_status'] != 'reviewing':
             await query.edit_message_text(
                 "❌ Сессия не найдена или завершена.",
@@ -843,12 +1018,9 @@ class TelegramBot:
         
         logger.info(f"Пост одобрен, переход к настройке кнопки для сессии {active_session['id']}")
 
-    async def _handle_post_rejection(self, query, user):
+    async def _handle_post_rejection(self, query, user, active_session: Optional[dict]):
         """Обработка отклонения поста пользователем"""
         
-        # Получаем активную сессию
-        active_session = await self.db.get_active_post_session(user.id)
-        
         if not active_session or active_session['session_status'] != 'reviewing':
             await query.edit_message_text(
                 "❌ Сессия не найдена или завершена.",
@@ -871,13 +1043,12 @@ class TelegramBot:
 
     def _get_post_review_keyboard(self):
         """Получить клавиатуру для проверки поста"""
-        keyboard = [
+        return self.media.keyboard('post_review', lambda: InlineKeyboardMarkup([
             [
                 InlineKeyboardButton("✅ Верно", callback_data="post_approved"),
                 InlineKeyboardButton("❌ Нет", callback_data="post_rejected")
             ]
-        ]
-        return InlineKeyboardMarkup(keyboard)
+        ]))
 
 
 
@@ -890,9 +1061,7 @@ class TelegramBot:
             self.bot_username = bot_info.username
         
         # Создаем кнопку для подтверждения
-        keyboard = InlineKeyboardMarkup([[
-            InlineKeyboardButton("✅ Добавлено", callback_data="admin_added")
-        ]])
+        keyboard = self._get_admin_added_keyboard()
         
         current_channel = user_data.get('channel_url', 'не указан')
         
@@ -917,16 +1086,14 @@ class TelegramBot:
         """
         
         # Отправляем видео с напоминанием
-        try:
-            with open('assets/channeladmin.mp4', 'rb') as video_file:
-                await update.message.reply_video(
-                    video=video_file,
-                    caption=reminder_message.strip(),
-                    reply_markup=keyboard
-                )
-        except FileNotFoundError:
+        sent = await self.media.send_video(
+            update.message.reply_video,
+            CHANNEL_ADMIN_VIDEO,
+            caption=reminder_message.strip(),
+            reply_markup=keyboard
+        )
+        if not sent:
             # Если видео не найдено, отправляем только текст
-            logger.warning("Видеофайл assets/channeladmin.mp4 не найден, отправляем только текст")
             await update.message.reply_text(
                 reminder_message.strip(),
                 reply_markup=keyboard
@@ -947,19 +1114,20 @@ class TelegramBot:
             )
             return
         
-        # Получаем данные пользователя
-        user_data = await self.db.get_user_by_telegram_id(user.id)
+        # Получаем данные пользователя и активную сессию
+        snapshot = await self.db.get_context_snapshot(user.id)
+        user_data = snapshot['user']
         if not user_data:
             await update.message.reply_text(MESSAGES['welcome'])
             return
         
         # Проверяем, что пользователь находится в процессе создания поста
-        # и отвечает на один из 3 вопросов
-        is_answering_questions = await self._is_answering_post_questions(user_data)
+        # и отвечает на один из вопросов
+        active_session = snapshot['session']
+        is_answering_questions = self._is_answering_post_questions(active_session)
         
         if not is_answering_questions:
-            # Получаем информацию о сессии для диагностики
-            active_session = await self.db.get_active_post_session(user_data['telegram_id'])
+            # Информация о сессии для диагностики
             session_status = active_session.get('session_status') if active_session else 'no_session'
             
             logger.info(f"Голосовое сообщение отклонено. Session status: {session_status}")
@@ -1013,34 +1181,26 @@ class TelegramBot:
                 "Пожалуйста, попробуйте отправить текстовое сообщение."
             )
 
-    async def _is_answering_post_questions(self, user_data: dict) -> bool:
+    def _is_answering_post_questions(self, active_session: Optional[dict]) -> bool:
         """
         Проверяет, находится ли пользователь в процессе ответа на вопросы для создания поста
         
         Args:
-            user_data (dict): Данные пользователя
+            active_session (Optional[dict]): Активная сессия создания поста
             
         Returns:
             bool: True если пользователь отвечает на вопросы для поста
         """
-        try:
-            # Получаем активную сессию создания поста для пользователя
-            active_session = await self.db.get_active_post_session(user_data['telegram_id'])
-            
-            if not active_session:
-                return False
-            
-            # Проверяем статус сессии - принимаем голосовые только на вопросы
-            session_status = active_session.get('session_status')
-            
-            # Статусы, когда можно отправлять голосовые сообщения
-            question_statuses = ['question_1', 'question_2', 'question_3', 'question_4', 'question_5']
-            
-            return session_status in question_statuses
-            
-        except Exception as e:
-            logger.error(f"Ошибка при проверке состояния создания поста: {e}")
+        if not active_session:
             return False
+        
+        # Проверяем статус сессии - принимаем голосовые только на вопросы
+        session_status = active_session.get('session_status')
+        
+        # Статусы, когда можно отправлять голосовые сообщения
+        question_statuses = ['question_1', 'question_2', 'question_3', 'question_4', 'question_5']
+        
+        return session_status in question_statuses
 
     async def _show_button_type_selection(self, message, session_id: int):
         """Показать выбор типа кнопки"""
@@ -1057,12 +1217,10 @@ class TelegramBot:
             reply_markup=reply_markup
         )
 
-    async def _handle_button_type_selection(self, query, user, button_type: str):
+    async def _handle_button_type_selection(self, query, user, button_type: str,
+                                            user_data: Optional[dict], active_session: Optional[dict]):
         """Обработка выбора типа кнопки"""
         
-        # Получаем активную сессию
-        active_session = await self.db.get_active_post_session(user.id)
-        
         if not active_session or active_session['session_status'] != 'button_type_selection':
             await query.edit_message_text(
                 "❌ Сессия не найдена или завершена.",
@@ -1070,19 +1228,21 @@ class TelegramBot:
             )
             return
         
+        # Изменения сессии копим и записываем одним запросом
+        patch = self.db.session_patch(active_session['id'])
+        
         # Сохраняем тип кнопки
-        await self.db.update_button_data(active_session['id'], button_type=button_type)
+        patch.set(button_type=button_type)
         
         if button_type == "dm":
             # Автоматически используем username текущего пользователя
-            user_data = await self.db.get_user_by_telegram_id(user.id)
             if user_data and user_data.get('username'):
                 # Формируем URL для ЛС с username пользователя
                 button_url = format_telegram_dm_url(user_data['username'])
                 
                 # Сохраняем URL кнопки и переходим к выбору текста
-                await self.db.update_button_data(active_session['id'], button_url=button_url)
-                await self.db.update_session_status(active_session['id'], 'button_text_selection')
+                patch.set(button_url=button_url).set_status('button_text_selection')
+                await patch.flush()
                 
                 await query.edit_message_text(
                     f"💬 Кнопка будет вести к @{user_data['username']}\n\n"
@@ -1096,10 +1256,10 @@ class TelegramBot:
                 logger.info(f"Автоматически установлен DM URL для сессии {active_session['id']}: {button_url}")
             else:
                 # Fallback: если нет username, спрашиваем вручную
-                await self.db.update_session_status(active_session['id'], 'button_config')
+                await patch.set_status('button_config').flush()
                 await query.edit_message_text(MESSAGES['button_dm_username_request'])
         else:  # website
-            await self.db.update_session_status(active_session['id'], 'button_config')
+            await patch.set_status('button_config').flush()
             await query.edit_message_text(MESSAGES['button_website_url_request'])
         
         logger.info(f"Выбран тип кнопки {button_type} для сессии {active_session['id']}")
@@ -1142,9 +1302,10 @@ class TelegramBot:
             
             button_url = input_text
         
-        # Сохраняем URL кнопки
-        await self.db.update_button_data(session_id, button_url=button_url)
-        await self.db.update_session_status(session_id, 'button_text_selection')
+        # Сохраняем URL кнопки и переходим к выбору текста одним запросом
+        await self.db.session_patch(session_id).set(
+            button_url=button_url
+        ).set_status('button_text_selection').flush()
         
         # Показываем выбор текста кнопки
         await self._show_button_text_selection(update.message, button_type)
@@ -1170,12 +1331,10 @@ class TelegramBot:
             reply_markup=reply_markup
         )
 
-    async def _handle_button_text_selection(self, query, user, callback_data: str):
+    async def _handle_button_text_selection(self, query, user, callback_data: str,
+                                            active_session: Optional[dict]):
         """Обработка выбора готового текста кнопки"""
         
-        # Получаем активную сессию
-        active_session = await self.db.get_active_post_session(user.id)
-        
         if not active_session or active_session['session_status'] != 'button_text_selection':
             await query.edit_message_text(
                 "❌ Сессия не найдена или завершена.",
@@ -1186,7 +1345,7 @@ class TelegramBot:
         # Проверяем, это готовый вариант или кастомный
         if callback_data == "button_text_custom":
             # Перенаправляем на обработку кастомного текста
-            await self._handle_custom_button_text_request(query, user)
+            await self._handle_custom_button_text_request(query, user, active_session)
             return
         
         # Извлекаем индекс из callback_data для готовых вариантов
@@ -1215,9 +1374,10 @@ class TelegramBot:
         if text_index < len(button_texts):
             selected_text = button_texts[text_index]
             
-            # Сохраняем текст кнопки
-            await self.db.update_button_data(active_session['id'], button_text=selected_text)
-            await self.db.update_session_status(active_session['id'], 'final_review')
+            # Сохраняем текст кнопки и переходим к финальному просмотру одним запросом
+            await self.db.session_patch(active_session['id']).set(
+                button_text=selected_text
+            ).set_status('final_review').flush()
             
             await query.edit_message_text(f"✅ Выбран текст кнопки: \"{selected_text}\"")
             
@@ -1232,12 +1392,9 @@ class TelegramBot:
                 reply_markup=self._get_registered_user_keyboard()
             )
 
-    async def _handle_custom_button_text_request(self, query, user):
+    async def _handle_custom_button_text_request(self, query, user, active_session: Optional[dict]):
         """Запрос на ввод собственного текста кнопки"""
         
-        # Получаем активную сессию
-        active_session = await self.db.get_active_post_session(user.id)
-        
         if not active_session or active_session['session_status'] != 'button_text_selection':
             await query.edit_message_text(
                 "❌ Сессия не найдена или завершена.",
@@ -1271,9 +1428,10 @@ class TelegramBot:
             )
             return
         
-        # Сохраняем текст кнопки
-        await self.db.update_button_data(session_id, button_text=button_text)
-        await self.db.update_session_status(session_id, 'final_review')
+        # Сохраняем текст кнопки и переходим к финальному просмотру одним запросом
+        await self.db.session_patch(session_id).set(
+            button_text=button_text
+        ).set_status('final_review').flush()
         
         await update.message.reply_text(f"✅ Текст кнопки сохранен: \"{button_text}\"")
         
@@ -1287,8 +1445,8 @@ class TelegramBot:
         """Показать финальный предпросмотр поста с кнопкой"""
         
         try:
-            # Получаем данные сессии
-            session = await self.db.get_active_post_session_by_id(session_id)
+            # Получаем текст поста и данные кнопки одним запросом
+            session = await self.db.get_active_post_session_by_id(session_id, projection='preview')
             if not session:
                 await message.reply_text(
                     "❌ Ошибка при получении данных сессии.",
@@ -1296,9 +1454,7 @@ class TelegramBot:
                 )
                 return
             
-            # Получаем данные кнопки
-            button_data = await self.db.get_session_button_data(session_id)
-            if not button_data or not all([button_data['button_text'], button_data['button_url']]):
+            if not all([session['button_text'], session['button_url']]):
                 await message.reply_text(
                     "❌ Ошибка: данные кнопки неполные.",
                     reply_markup=self._get_registered_user_keyboard()
@@ -1310,15 +1466,15 @@ class TelegramBot:
             
             # Создаем кнопку для предпросмотра (не функциональную)
             preview_keyboard = [[
-                InlineKeyboardButton(button_data['button_text'], url=button_data['button_url'])
+                InlineKeyboardButton(session['button_text'], url=session['button_url'])
             ]]
             preview_markup = InlineKeyboardMarkup(preview_keyboard)
             
-            # Отправляем предпросмотр поста
-            await message.reply_text(
+            # Отправляем предпросмотр поста (кнопка - под последней частью)
+            await send_html_message(
+                message.reply_text,
                 post_content,
                 reply_markup=preview_markup,
-                parse_mode='HTML',
                 disable_web_page_preview=True
             )
             
@@ -1343,11 +1499,21 @@ class TelegramBot:
                 reply_markup=self._get_registered_user_keyboard()
             )
 
-    async def _handle_final_post_approval(self, query, user):
+    async def _handle_final_post_approval(self, query, user, user_data: Optional[dict],
+                                          active_session: Optional[dict]):
         """Обработка финального одобрения поста"""
         
-        # Получаем активную сессию
-        active_session = await self.db.get_active_post_session(user.id)
+        try:
+            async with self.db.user_lock(user.id):
+                # Пока ждали блокировку, другая реплика могла уже опубликовать этот пост
+                active_session = await self.db.get_active_post_session(user.id, projection='routing')
+                await self._publish_final_post(query, user, user_data, active_session)
+        except UserLockTimeout:
+            await query.message.reply_text(MESSAGES['user_busy'])
+
+    async def _publish_final_post(self, query, user, user_data: Optional[dict],
+                                  active_session: Optional[dict]):
+        """Списание лимита, публикация поста и завершение сессии (под блокировкой пользователя)"""
         
         if not active_session or active_session['session_status'] != 'final_review':
             await query.edit_message_text(
@@ -1356,25 +1522,36 @@ class TelegramBot:
             )
             return
         
+        # Списываем пост из лимита до публикации: проверка и увеличение счетчика
+        # выполняются атомарно, поэтому параллельные подтверждения не превысят лимит
+        post_limit_check = await self.db.consume_post_quota(user.id)
+        
+        if post_limit_check is None:
+            # Ошибка базы - это не исчерпанный лимит: сессия остается на проверке,
+            # и пользователь может нажать кнопку подтверждения еще раз
+            await query.message.reply_text(MESSAGES['generation_error'])
+            return
+        
+        if not post_limit_check['consumed']:
+            limit_message = MESSAGES['post_limit_reached'].format(
+                current_count=post_limit_check['current_count'],
+                max_posts=post_limit_check['max_posts']
+            )
+            await query.edit_message_text(
+                limit_message,
+                reply_markup=self._get_registered_user_keyboard()
+            )
+            return
+        
         await query.edit_message_text("🎉 Отлично! Публикую пост в вашем канале...")
         
         # Публикуем пост в канале
-        success = await self._publish_post_to_channel(active_session['id'], user.id)
+        success = await self._publish_post_to_channel(active_session['id'], user_data)
         
         if success:
-            # Увеличиваем счетчик постов пользователя
-            increment_success = await self.db.increment_user_post_count(user.id)
-            if increment_success:
-                logger.info(f"Счетчик постов увеличен для пользователя {user.id}")
-            else:
-                logger.warning(f"Не удалось увеличить счетчик постов для пользователя {user.id}")
-            
             # Завершаем сессию
             await self.db.update_session_status(active_session['id'], 'completed')
             
-            # Получаем обновленную информацию о количестве постов для сообщения
-            post_limit_check = await self.db.check_post_limit(user.id)
-            
             # Формируем сообщение с информацией об оставшихся постах
             published_message = MESSAGES['post_published']
             if post_limit_check['remaining'] > 0:
@@ -1383,16 +1560,14 @@ class TelegramBot:
                 published_message += f"\n\n🚫 Это был ваш последний доступный пост ({post_limit_check['max_posts']}/{post_limit_check['max_posts']})"
             
             # Отправляем видео с инструкциями по закреплению поста
-            try:
-                with open('assets/pinned.mp4', 'rb') as video_file:
-                    await query.message.reply_video(
-                        video=video_file,
-                        caption=published_message,
-                        reply_markup=self._get_registered_user_keyboard()
-                    )
-            except FileNotFoundError:
+            sent = await self.media.send_video(
+                query.message.reply_video,
+                PINNED_POST_VIDEO,
+                caption=published_message,
+                reply_markup=self._get_registered_user_keyboard()
+            )
+            if not sent:
                 # Если видео не найдено, отправляем только текст
-                logger.warning("Видеофайл assets/pinned.mp4 не найден, отправляем только текст")
                 await query.message.reply_text(
                     published_message,
                     reply_markup=self._get_registered_user_keyboard(),
@@ -1401,17 +1576,17 @@ class TelegramBot:
             
             logger.info(f"Пост успешно опубликован для сессии {active_session['id']}")
         else:
+            # Пост не опубликован - возвращаем его в лимит
+            await self.db.release_post_quota(user.id)
+            
             await query.message.reply_text(
                 "❌ Произошла ошибка при публикации поста. Попробуйте позже.",
                 reply_markup=self._get_registered_user_keyboard()
             )
 
-    async def _handle_final_post_rejection(self, query, user):
+    async def _handle_final_post_rejection(self, query, user, active_session: Optional[dict]):
         """Обработка отклонения финального поста"""
         
-        # Получаем активную сессию
-        active_session = await self.db.get_active_post_session(user.id)
-        
         if not active_session:
             await query.edit_message_text(
                 "❌ Сессия не найдена.",
@@ -1420,11 +1595,11 @@ class TelegramBot:
             return
         
         # Очищаем данные кнопки и возвращаемся к началу процесса создания поста
-        await self.db.update_button_data(active_session['id'], 
-                                       button_type=None, 
-                                       button_url=None, 
-                                       button_text=None)
-        await self.db.clear_session_answers(active_session['id'])
+        await self.db.session_patch(active_session['id']).set(
+            button_type=None,
+            button_url=None,
+            button_text=None
+        ).clear_answers().flush()
         
         await query.edit_message_text(MESSAGES['post_rejected'])
         
@@ -1436,43 +1611,36 @@ class TelegramBot:
         
         logger.info(f"Финальный пост отклонен, начат новый процесс для сессии {active_session['id']}")
 
-    async def _publish_post_to_channel(self, session_id: int, user_telegram_id: int) -> bool:
+    async def _publish_post_to_channel(self, session_id: int, user_data: Optional[dict]) -> bool:
         """Публикация поста в канале пользователя"""
         
         try:
-            # Получаем данные пользователя
-            user_data = await self.db.get_user_by_telegram_id(user_telegram_id)
+            # Проверяем данные пользователя
             if not user_data or not user_data.get('channel_url'):
-                logger.error(f"Данные пользователя или канала не найдены для {user_telegram_id}")
+                logger.error(f"Данные пользователя или канала не найдены для сессии {session_id}")
                 return False
             
-            # Получаем данные сессии
-            session = await self.db.get_active_post_session_by_id(session_id)
+            # Получаем текст поста и данные кнопки одним запросом
+            session = await self.db.get_active_post_session_by_id(session_id, projection='publish')
             if not session:
                 logger.error(f"Сессия {session_id} не найдена")
                 return False
             
-            # Получаем данные кнопки
-            button_data = await self.db.get_session_button_data(session_id)
-            if not button_data:
-                logger.error(f"Данные кнопки для сессии {session_id} не найдены")
-                return False
-            
             # Извлекаем username канала
             channel_username = user_data['channel_url'].split('/')[-1]
             
             # Создаем инлайн-клавиатуру
             keyboard = [[
-                InlineKeyboardButton(button_data['button_text'], url=button_data['button_url'])
+                InlineKeyboardButton(session['button_text'], url=session['button_url'])
             ]]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            # Публикуем пост
-            await self.application.bot.send_message(
-                chat_id=f"@{channel_username}",
-                text=session['generated_post'],
+            # Публикуем пост (длинный пост - несколькими сообщениями, кнопка под последним)
+            await send_html_message(
+                self.application.bot.send_message,
+                session['generated_post'],
                 reply_markup=reply_markup,
-                parse_mode='HTML',
+                chat_id=f"@{channel_username}",
                 disable_web_page_preview=True
             )
             
@@ -1480,6 +1648,9 @@ class TelegramBot:
             
         except Exception as e:
             logger.error(f"Ошибка при публикации поста в канале: {e}")
+            # Права могли измениться - следующая проверка пойдет в Telegram
+            if user_data and user_data.get('channel_url'):
+                self.admin_rights.invalidate(user_data['channel_url'].split('/')[-1].lower())
             return False
 
     async def _start_links_collection(self, update: Update, user_data: dict, session_id: int):
@@ -1504,10 +1675,9 @@ class TelegramBot:
 
     def _get_skip_keyboard(self):
         """Получить клавиатуру с кнопкой 'Пропустить'"""
-        keyboard = [[
+        return self.media.keyboard('skip_links', lambda: InlineKeyboardMarkup([[
             InlineKeyboardButton("⏭️ Пропустить", callback_data="skip_links")
-        ]]
-        return InlineKeyboardMarkup(keyboard)
+        ]]))
 
     async def _send_link_request(self, message, link_number: int):
         """Отправить запрос на ссылку с соответствующим номером"""
@@ -1523,6 +1693,23 @@ class TelegramBot:
     async def _handle_link_input(self, update: Update, message_text: str, user_data: dict, active_session: dict):
         """Обработка ввода описания + ссылки пользователем"""
         
+        telegram_id = user_data['telegram_id']
+        
+        try:
+            async with self.db.user_lock(telegram_id):
+                # Пока ждали блокировку, другая реплика могла занять слот или завершить сбор
+                active_session = await self.db.get_active_post_session(telegram_id, projection='routing')
+                if not active_session or active_session['session_status'] != 'collecting_links':
+                    logger.info(f"Сбор материалов для пользователя {telegram_id} уже завершен, сообщение пропущено")
+                    return
+                
+                await self._save_link_input(update, message_text, user_data, active_session)
+        except UserLockTimeout:
+            await update.message.reply_text(MESSAGES['user_busy'])
+
+    async def _save_link_input(self, update: Update, message_text: str, user_data: dict, active_session: dict):
+        """Сохранение материала в следующий свободный слот (под блокировкой пользователя)"""
+        
         session_id = active_session['id']
         
         # Извлекаем описание и ссылку из текста
@@ -1558,12 +1745,10 @@ class TelegramBot:
             # Собрали все 5 ссылок, завершаем
             await self._finish_links_collection(update, user_data, session_id)
 
-    async def _handle_skip_links(self, query, user):
+    async def _handle_skip_links(self, query, user, user_data: Optional[dict],
+                                 active_session: Optional[dict]):
         """Обработка нажатия кнопки 'Пропустить'"""
         
-        # Получаем активную сессию
-        active_session = await self.db.get_active_post_session(user.id)
-        
         if not active_session or active_session['session_status'] != 'collecting_links':
             await query.edit_message_text(
                 "❌ Сессия не найдена или завершена.",
@@ -1571,9 +1756,6 @@ class TelegramBot:
             )
             return
         
-        # Получаем данные пользователя
-        user_data = await self.db.get_user_by_telegram_id(user.id)
-        
         await query.edit_message_text("⏭️ Пропускаем сбор ссылок...")
         
         # Завершаем сбор ссылок и переходим к генерации
@@ -1611,16 +1793,195 @@ class TelegramBot:
 
     def run(self):
         """Запуск бота"""
-        logger.info("Запуск Telegram бота...")
+        logger.info(f"Запуск Telegram бота (режим {BOT_RUN_MODE})...")
         
         try:
-            # Используем синхронный run_polling
-            self.application.run_polling(drop_pending_updates=True)
+            if BOT_RUN_MODE == 'webhook':
+                asyncio.run(self.run_webhook())
+            elif BOT_RUN_MODE == 'polling':
+                # Используем синхронный run_polling
+                self.application.run_polling(
+                    drop_pending_updates=True,
+                    allowed_updates=TELEGRAM_ALLOWED_UPDATES
+                )
+            else:
+                raise ValueError(f"Неизвестный BOT_RUN_MODE: {BOT_RUN_MODE}")
             
         except Exception as e:
             logger.error(f"Ошибка при запуске бота: {e}")
             raise
 
+    def get_transport_stats(self) -> dict:
+        """
+        Метрики пулов соединений с Bot API и ограничителя частоты
+
+        Returns:
+            dict: Метрики пула исходящих вызовов, пула getUpdates и ограничителя
+        """
+        return {
+            'bot': self.bot_request.get_stats(),
+            'get_updates': self.updates_request.get_stats(),
+            'rate_limiter': self.rate_limiter.get_stats()
+        }
+
+    async def run_webhook(self):
+        """
+        Прием обновлений через webhook Telegram на сервере aiohttp
+        
+        Обновления кладутся в update_queue приложения и обрабатываются так же,
+        как при polling. Сервер можно запустить в нескольких репликах за
+        балансировщиком: все они регистрируют один и тот же адрес.
+        """
+        from webhook_server import run_webhook_server
+        
+        if not TELEGRAM_WEBHOOK_URL or not TELEGRAM_WEBHOOK_SECRET:
+            raise ValueError("Для BOT_RUN_MODE=webhook нужны TELEGRAM_WEBHOOK_URL и TELEGRAM_WEBHOOK_SECRET")
+        
+        stop_event = self._install_stop_signals()
+        runner = None
+        
+        try:
+            await self.application.bot.set_webhook(
+                url=TELEGRAM_WEBHOOK_URL,
+                secret_token=TELEGRAM_WEBHOOK_SECRET,
+                allowed_updates=TELEGRAM_ALLOWED_UPDATES,
+                drop_pending_updates=False
+            )
+            await self._start_application()
+            runner = await run_webhook_server(
+                BOT_WEBHOOK_HOST, BOT_WEBHOOK_PORT,
+                telegram_update_sink=self.enqueue_update, serve_n8n=False
+            )
+            logger.info(f"Webhook Telegram принимает обновления на {TELEGRAM_WEBHOOK_PATH}")
+            
+            await stop_event.wait()
+            
+        finally:
+            logger.info("Остановка бота...")
+            if runner:
+                await runner.cleanup()
+            await self._stop_application()
+
+    async def run_unified(self, host: str, port: int):
+        """
+        Бот и веб-сервер webhook (n8n, health, обновления Telegram) в одном event loop
+
+        Сервер использует то же хранилище, пулы HTTP и клиент Bot API, что и бот:
+        ответ n8n записывается в сессию через общий кэш и сразу виден обработчикам
+        бота, а второй процесс со своими соединениями не нужен.
+
+        Args:
+            host (str): Адрес веб-сервера
+            port (int): Порт веб-сервера
+        """
+        from webhook_server import run_webhook_server
+        from webhook_handler import WebhookHandler
+
+        if BOT_RUN_MODE not in ('polling', 'webhook'):
+            raise ValueError(f"Неизвестный BOT_RUN_MODE: {BOT_RUN_MODE}")
+        if BOT_RUN_MODE == 'webhook' and (not TELEGRAM_WEBHOOK_URL or not TELEGRAM_WEBHOOK_SECRET):
+            raise ValueError("Для BOT_RUN_MODE=webhook нужны TELEGRAM_WEBHOOK_URL и TELEGRAM_WEBHOOK_SECRET")
+
+        stop_event = self._install_stop_signals()
+        n8n_handler = WebhookHandler(db=self.db, bot=self.application.bot)
+        runner = None
+
+        try:
+            await self._start_application()
+
+            telegram_update_sink = None
+            if BOT_RUN_MODE == 'webhook':
+                await self.application.bot.set_webhook(
+                    url=TELEGRAM_WEBHOOK_URL,
+                    secret_token=TELEGRAM_WEBHOOK_SECRET,
+                    allowed_updates=TELEGRAM_ALLOWED_UPDATES,
+                    drop_pending_updates=False
+                )
+                telegram_update_sink = self.enqueue_update
+            else:
+                await self.application.updater.start_polling(
+                    drop_pending_updates=True,
+                    allowed_updates=TELEGRAM_ALLOWED_UPDATES
+                )
+
+            runner = await run_webhook_server(
+                host, port, telegram_update_sink=telegram_update_sink, n8n_handler=n8n_handler
+            )
+            logger.info(f"Бот и webhook сервер запущены в одном процессе (режим {BOT_RUN_MODE})")
+
+            await stop_event.wait()
+
+        finally:
+            logger.info("Остановка бота...")
+            if runner:
+                await runner.cleanup()
+            if self.application.updater and self.application.updater.running:
+                await self.application.updater.stop()
+            await self._stop_application()
+
+    async def run_worker(self, updates_queue, workers: int = 1):
+        """
+        Обработка обновлений, которые присылает процесс-распределитель
+        
+        Используется в режиме нескольких процессов (sharded_runtime.py): обновления
+        принимает один процесс и передает через очередь multiprocessing.
+        
+        Args:
+            updates_queue: Очередь multiprocessing с данными обновлений (None - остановка)
+            workers (int): Всего процессов-обработчиков (делят общий лимит бота)
+        """
+        # Лимит Telegram - на бота, а не на процесс: каждому процессу своя доля
+        self.rate_limiter.set_global_rate(TELEGRAM_GLOBAL_RATE / workers)
+        
+        loop = asyncio.get_running_loop()
+        await self._start_application()
+        
+        try:
+            while True:
+                data = await loop.run_in_executor(None, updates_queue.get)
+                if data is None:
+                    break
+                await self.enqueue_update(data)
+        finally:
+            await self._stop_application()
+
+    async def enqueue_update(self, data: dict):
+        """
+        Передача обновления Telegram в очередь приложения
+        
+        Args:
+            data (dict): Обновление в формате Bot API
+        """
+        await self.application.update_queue.put(Update.de_json(data, self.application.bot))
+
+    async def _start_application(self):
+        """Запуск приложения без встроенного polling"""
+        # run_polling сам вызывает post_init/post_shutdown, здесь это делаем вручную
+        await self.application.initialize()
+        await self._post_init(self.application)
+        await self.application.start()
+
+    async def _stop_application(self):
+        """Остановка приложения, запущенного через _start_application"""
+        if self.application.running:
+            await self.application.stop()
+        await self.application.shutdown()
+        await self._post_shutdown(self.application)
+
+    @staticmethod
+    def _install_stop_signals() -> asyncio.Event:
+        """
+        Событие остановки по SIGINT/SIGTERM
+        
+        Returns:
+            asyncio.Event: Устанавливается при получении сигнала
+        """
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+        return stop_event
+
 def main():
     """Главная функция"""
     try:
@@ -0,0 +1,101 @@
+"""
+Простой in-process кэш с вытеснением LRU и временем жизни записей
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+
+class LRUTTLCache:
+    """
+    Ограниченный по размеру кэш: при переполнении вытесняется запись,
+    к которой дольше всего не обращались, а записи старше ttl секунд
+    считаются отсутствующими.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        """
+        Инициализация кэша
+
+        Args:
+            max_size (int): Максимальное количество записей
+            ttl (float): Время жизни записи в секундах
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Получение значения из кэша
+
+        Args:
+            key: Ключ записи
+            default: Значение, возвращаемое при промахе
+
+        Returns:
+            Any: Закэшированное значение или default
+        """
+        entry = self._data.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return default
+
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        """
+        Сохранение значения в кэше
+
+        Args:
+            key: Ключ записи
+            value: Значение
+        """
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        """
+        Удаление записи из кэша
+
+        Args:
+            key: Ключ записи
+        """
+        self._data.pop(key, None)
+
+    def clear(self):
+        """Очистка кэша"""
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Статистика использования кэша
+
+        Returns:
+            Dict: Количество попаданий, промахов, текущий размер и доля попаданий
+        """
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0
+        }
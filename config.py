@@ -14,12 +14,135 @@ TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 
+# Максимум одновременных запросов к базе данных
+DB_MAX_CONCURRENT_QUERIES = int(os.getenv('DB_MAX_CONCURRENT_QUERIES', '10'))
+
+# Бэкенд базы данных: supabase (PostgREST), asyncpg (прямое подключение к Postgres),
+# sqlite (локальный файл) или memory (в памяти процесса, для тестов и замеров)
+DB_BACKEND = os.getenv('DB_BACKEND', 'supabase').lower()
+
+# Файл базы для DB_BACKEND=sqlite
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'button_bot.sqlite3')
+
+# Файл с file_id загруженных в Telegram видео (assets/*.mp4)
+MEDIA_REGISTRY_PATH = os.getenv('MEDIA_REGISTRY_PATH', 'media_registry.json')
+
+# Прямое подключение к Postgres для бэкенда asyncpg
+DATABASE_URL = os.getenv('DATABASE_URL')
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '2'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+
+# Кэш строк пользователей в памяти процесса
+USER_CACHE_MAX_SIZE = int(os.getenv('USER_CACHE_MAX_SIZE', '5000'))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '300'))  # секунды
+
+# Кэш активных сессий создания постов в памяти процесса
+SESSION_CACHE_MAX_SIZE = int(os.getenv('SESSION_CACHE_MAX_SIZE', '5000'))
+SESSION_CACHE_TTL = float(os.getenv('SESSION_CACHE_TTL', '600'))  # секунды
+
+# Период пакетной записи активности пользователей в базу
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv('ACTIVITY_FLUSH_INTERVAL', '30'))  # секунды
+
+# Максимум одновременно обрабатываемых обновлений Telegram (разных пользователей;
+# обновления одного пользователя всегда обрабатываются по очереди)
+BOT_MAX_CONCURRENT_UPDATES = int(os.getenv('BOT_MAX_CONCURRENT_UPDATES', '16'))
+
+# Количество процессов-обработчиков бота (больше 1 - обновления распределяются
+# между процессами по telegram_id, см. sharded_runtime.py)
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '1'))
+
+# Блокировка пользователя на время публикации и сохранения материалов:
+# local - в пределах процесса, advisory - advisory lock Postgres между
+# репликами бота (нужен DB_BACKEND=asyncpg)
+USER_LOCK_MODE = os.getenv('USER_LOCK_MODE', 'local').lower()
+USER_LOCK_TIMEOUT = float(os.getenv('USER_LOCK_TIMEOUT', '30'))  # секунды
+# Отдельный пул соединений для advisory lock: каждая удерживаемая блокировка
+# занимает соединение, и запросы горячего пути не должны его ждать
+USER_LOCK_POOL_SIZE = int(os.getenv('USER_LOCK_POOL_SIZE', '10'))
+
+# Таймаут генерации поста в n8n и проверка просроченных генераций
+GENERATION_TIMEOUT = float(os.getenv('GENERATION_TIMEOUT', '180'))  # секунды
+GENERATION_SWEEP_INTERVAL = float(os.getenv('GENERATION_SWEEP_INTERVAL', '30'))  # секунды
+GENERATION_SWEEP_CONCURRENCY = int(os.getenv('GENERATION_SWEEP_CONCURRENCY', '5'))
+
+# Пул исходящих HTTP соединений (n8n, загрузка файлов Telegram, админский бот)
+HTTP_POOL_LIMIT = int(os.getenv('HTTP_POOL_LIMIT', '100'))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv('HTTP_POOL_LIMIT_PER_HOST', '20'))
+HTTP_DNS_CACHE_TTL = int(os.getenv('HTTP_DNS_CACHE_TTL', '300'))  # секунды
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', '30'))  # секунды
+
+# Транспорт Bot API: пул соединений исходящих вызовов (getUpdates идет отдельным
+# пулом), таймауты в секундах и версия HTTP ('1.1' или '2')
+TELEGRAM_POOL_SIZE = int(os.getenv('TELEGRAM_POOL_SIZE', '32'))
+TELEGRAM_POOL_TIMEOUT = float(os.getenv('TELEGRAM_POOL_TIMEOUT', '5'))
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv('TELEGRAM_CONNECT_TIMEOUT', '5'))
+TELEGRAM_READ_TIMEOUT = float(os.getenv('TELEGRAM_READ_TIMEOUT', '10'))
+TELEGRAM_WRITE_TIMEOUT = float(os.getenv('TELEGRAM_WRITE_TIMEOUT', '10'))
+TELEGRAM_HTTP_VERSION = os.getenv('TELEGRAM_HTTP_VERSION', '1.1')
+
+# Ограничение частоты исходящих вызовов Bot API: запросов в секунду на бота,
+# сообщений в секунду в личный чат, сообщений в минуту в группу или канал и
+# сколько раз повторять запрос после RetryAfter
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))
+TELEGRAM_PRIVATE_CHAT_RATE = float(os.getenv('TELEGRAM_PRIVATE_CHAT_RATE', '1'))
+TELEGRAM_GROUP_CHAT_RATE = float(os.getenv('TELEGRAM_GROUP_CHAT_PER_MINUTE', '20')) / 60
+TELEGRAM_RATE_MAX_RETRIES = int(os.getenv('TELEGRAM_RATE_MAX_RETRIES', '3'))
+
+# Способ получения обновлений Telegram: polling (long polling) или webhook
+BOT_RUN_MODE = os.getenv('BOT_RUN_MODE', 'polling').lower()
+
+# Единый режим: бот и webhook сервер n8n в одном процессе с общими хранилищем,
+# пулами соединений и клиентом Bot API (иначе сервер - отдельный webhook_server.py)
+UNIFIED_RUNTIME = os.getenv('UNIFIED_RUNTIME', 'false').lower() in ('1', 'true', 'yes')
+WEBHOOK_SERVER_HOST = os.getenv('WEBHOOK_SERVER_HOST', '0.0.0.0')
+WEBHOOK_SERVER_PORT = int(os.getenv('WEBHOOK_SERVER_PORT', '8080'))
+
+# Webhook Telegram: публичный HTTPS адрес, путь на сервере aiohttp и секрет,
+# который Telegram присылает в заголовке X-Telegram-Bot-Api-Secret-Token
+TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL')
+TELEGRAM_WEBHOOK_PATH = os.getenv('TELEGRAM_WEBHOOK_PATH', '/webhook/telegram')
+TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET')
+BOT_WEBHOOK_HOST = os.getenv('BOT_WEBHOOK_HOST', '0.0.0.0')
+BOT_WEBHOOK_PORT = int(os.getenv('BOT_WEBHOOK_PORT', '8081'))
+
+# Типы обновлений, которые бот получает от Telegram (и в polling, и в webhook);
+# my_chat_member - изменения прав бота в каналах
+TELEGRAM_ALLOWED_UPDATES = [
+    update_type.strip()
+    for update_type in os.getenv('TELEGRAM_ALLOWED_UPDATES', 'message,callback_query,my_chat_member').split(',')
+    if update_type.strip()
+]
+
+# Кэш прав бота в каналах пользователей (проверка get_chat_member)
+ADMIN_RIGHTS_CACHE_TTL = float(os.getenv('ADMIN_RIGHTS_CACHE_TTL', '600'))  # секунды
+ADMIN_RIGHTS_CACHE_SIZE = int(os.getenv('ADMIN_RIGHTS_CACHE_SIZE', '10000'))
+
+# Повторные доставки обновлений Telegram: сколько секунд и сколько update_id
+# помнить, а также окно, в котором повторное нажатие той же кнопки под тем же
+# сообщением считается двойным нажатием
+UPDATE_DEDUP_TTL = float(os.getenv('UPDATE_DEDUP_TTL', '600'))  # секунды
+UPDATE_DEDUP_SIZE = int(os.getenv('UPDATE_DEDUP_SIZE', '10000'))
+CALLBACK_DEDUP_WINDOW = float(os.getenv('CALLBACK_DEDUP_WINDOW', '3'))  # секунды
+
 # Настройки бота
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
 
 # n8n настройки
 N8N_WEBHOOK_URL = os.getenv('N8N_WEBHOOK_URL')
 
+# Очередь ответов n8n на webhook сервере: максимальная длина (при переполнении
+# n8n получает 503) и количество параллельных обработчиков
+N8N_QUEUE_SIZE = int(os.getenv('N8N_QUEUE_SIZE', '1000'))
+N8N_QUEUE_WORKERS = int(os.getenv('N8N_QUEUE_WORKERS', '4'))
+# Повторы обработки ответа при временной ошибке (база, сеть до Telegram):
+# сколько раз и первая пауза (дальше удваивается)
+N8N_QUEUE_MAX_RETRIES = int(os.getenv('N8N_QUEUE_MAX_RETRIES', '5'))
+N8N_QUEUE_RETRY_DELAY = float(os.getenv('N8N_QUEUE_RETRY_DELAY', '1'))  # секунды
+
+# Повторные ответы n8n (session_id, attempt): сколько секунд и сколько ключей помнить
+N8N_DEDUP_TTL = float(os.getenv('N8N_DEDUP_TTL', '3600'))  # секунды
+N8N_DEDUP_SIZE = int(os.getenv('N8N_DEDUP_SIZE', '10000'))
+
 # Админский бот для уведомлений
 ADMIN_BOT_TOKEN = os.getenv('ADMIN_BOT_TOKEN')
 ADMIN_CHAT_ID = os.getenv('ADMIN_CHAT_ID')
@@ -324,6 +447,11 @@ MESSAGES = {
 Вы уже опубликовали {current_count} из {max_posts} доступных постов.
 
 К сожалению, больше постов создать нельзя. Обратитесь к администратору, если вам нужно больше публикаций.
+""",
+    'user_busy': """
+⏳ Предыдущее действие еще выполняется.
+
+Пожалуйста, попробуйте еще раз через несколько секунд.
 """,
     'post_limit_warning': """
 ⚠️ **Внимание!** 
@@ -1,34 +1,493 @@
 """
 Модуль для работы с базой данных Supabase
 """
+import asyncio
 import logging
-from typing import Optional, Dict, Any, List
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable, AsyncIterator
 from supabase import create_client, Client
-from config import SUPABASE_URL, SUPABASE_KEY, REGISTRATION_STEPS
+from cache import LRUTTLCache
+from config import (
+    SUPABASE_URL,
+    SUPABASE_KEY,
+    REGISTRATION_STEPS,
+    DB_MAX_CONCURRENT_QUERIES,
+    DB_BACKEND,
+    USER_CACHE_MAX_SIZE,
+    USER_CACHE_TTL,
+    SESSION_CACHE_MAX_SIZE,
+    SESSION_CACHE_TTL,
+    ACTIVITY_FLUSH_INTERVAL,
+    USER_LOCK_MODE,
+    USER_LOCK_TIMEOUT
+)
 
 logger = logging.getLogger(__name__)
 
+# Статусы сессии, в которых процесс создания поста еще не завершен
+ACTIVE_SESSION_STATUSES = [
+    'started', 'question_1', 'question_2', 'question_3', 'question_4', 'question_5',
+    'collecting_links', 'generating', 'reviewing', 'button_type_selection', 'button_config',
+    'button_text_selection', 'final_review'
+]
+
+# Статус, в который переходит сессия после ответа на вопрос с данным номером
+NEXT_STATUS_AFTER_ANSWER = {
+    1: 'question_2',
+    2: 'question_3',
+    3: 'question_4',
+    4: 'question_5',
+    5: 'collecting_links'
+}
+
+# Значения полей сессии при перезапуске процесса создания поста
+CLEARED_SESSION_FIELDS = {
+    'answer_1': None,
+    'answer_2': None,
+    'answer_3': None,
+    'answer_4': None,
+    'answer_5': None,
+
+    'link_1': None,
+    'link_2': None,
+    'link_3': None,
+    'link_4': None,
+    'link_5': None,
+    'generated_post': None,
+    'session_status': 'question_1',
+    'n8n_webhook_sent_at': None
+}
+
+# Статусы, из которых сессию переводит другой процесс (webhook сервер n8n),
+# поэтому закэшированной копии в этих статусах доверять нельзя
+EXTERNALLY_UPDATED_STATUSES = {'generating'}
+
+# Именованные наборы колонок (проекции) для чтения только нужных полей.
+# Проекция 'full' читает строку целиком ('*').
+USER_PROJECTIONS = {
+    # Проверка существования пользователя при регистрации по email
+    'registration': ['id', 'email', 'telegram_id', 'registration_step'],
+    # Данные, которые использует бот при работе с пользователем
+    'profile': [
+        'id', 'email', 'telegram_id', 'username', 'first_name', 'last_name',
+        'registration_step', 'channel_url', 'is_bot_admin', 'post_count'
+    ]
+}
+
+SESSION_PROJECTIONS = {
+    # Маршрутизация сообщений по статусу сессии - нужна на каждом сообщении
+    'routing': ['id', 'telegram_id', 'session_status', 'created_at'],
+    'answers': [
+        'id', 'telegram_id', 'session_status',
+        'answer_1', 'answer_2', 'answer_3', 'answer_4', 'answer_5'
+    ],
+    'links': ['id', 'telegram_id', 'session_status', 'link_1', 'link_2', 'link_3', 'link_4', 'link_5'],
+    'button': ['id', 'telegram_id', 'session_status', 'button_type', 'button_url', 'button_text'],
+    # Предпросмотр и публикация поста: текст поста и данные кнопки
+    'preview': [
+        'id', 'telegram_id', 'session_status', 'generated_post',
+        'button_type', 'button_url', 'button_text'
+    ],
+    'publish': [
+        'id', 'user_id', 'telegram_id', 'session_status', 'generated_post',
+        'button_type', 'button_url', 'button_text'
+    ],
+    # Поиск сессий с истекшим временем генерации
+    'timeout': ['id', 'telegram_id', 'session_status', 'n8n_webhook_sent_at']
+}
+
+
+def projection_select(projections: Dict[str, List[str]], projection: str) -> str:
+    """
+    Строка колонок для select() по имени проекции
+    
+    Args:
+        projections (Dict): Набор проекций таблицы
+        projection (str): Имя проекции ('full' - все колонки)
+        
+    Returns:
+        str: Список колонок через запятую или '*'
+    """
+    if projection == 'full':
+        return '*'
+    return ', '.join(projections[projection])
+
+
+def projection_columns(projections: Dict[str, List[str]], projection: str) -> List[str]:
+    """
+    Колонки, которые должны быть в строке, чтобы она подходила под проекцию
+    
+    Для 'full' это объединение всех проекций - все поля, которые читает бот.
+    
+    Args:
+        projections (Dict): Набор проекций таблицы
+        projection (str): Имя проекции
+        
+    Returns:
+        List[str]: Список колонок
+    """
+    if projection == 'full':
+        columns = set()
+        for names in projections.values():
+            columns.update(names)
+        return sorted(columns)
+    return projections[projection]
+
+
+def _has_columns(row: Dict[str, Any], columns: List[str]) -> bool:
+    """Проверка, что в строке есть все указанные колонки"""
+    return all(column in row for column in columns)
+
+def _can_merge(cached: Optional[Dict[str, Any]], row: Dict[str, Any], status_column: str) -> bool:
+    """
+    Можно ли дополнить неполную строку колонками закэшированной
+    
+    Колонки из кэша остаются, только если это та же строка и ее статус не
+    изменился. Смена статуса (или статус, который меняет другой процесс)
+    означает, что строку могли изменить в обход кэша, и старые колонки
+    устарели.
+    
+    Args:
+        cached (Optional[Dict]): Закэшированная строка
+        row (Dict): Прочитанная из базы строка (возможно, проекция)
+        status_column (str): Колонка статуса строки
+        
+    Returns:
+        bool: True если строки можно объединить
+    """
+    if cached is None or cached.get('id') != row.get('id'):
+        return False
+    if cached.get(status_column) in EXTERNALLY_UPDATED_STATUSES:
+        return False
+    return status_column not in row or cached.get(status_column) == row[status_column]
+
+# Лимит для увеличения счетчика постов без ограничения (максимум INTEGER в Postgres)
+UNLIMITED_POSTS = 2147483647
+
+# Маркер промаха кэша (None в кэше сессий означает "активной сессии нет")
+_MISSING = object()
+
+
+class UserLockTimeout(Exception):
+    """Блокировку пользователя не удалось получить за отведенное время"""
+
 class Database:
-    def __init__(self):
-        """Инициализация подключения к Supabase"""
-        if not SUPABASE_URL or not SUPABASE_KEY:
-            raise ValueError("SUPABASE_URL и SUPABASE_KEY должны быть установлены")
+    def __init__(self, client: Optional[Any] = None):
+        """
+        Инициализация подключения к Supabase
+        
+        Args:
+            client: Клиент с API запросов supabase (table/rpc). По умолчанию
+                создается клиент Supabase; локальные клиенты - в local_storage.py
+        """
+        if client is None:
+            if not SUPABASE_URL or not SUPABASE_KEY:
+                raise ValueError("SUPABASE_URL и SUPABASE_KEY должны быть установлены")
+            
+            client = create_client(SUPABASE_URL, SUPABASE_KEY)
+            logger.info("Подключение к Supabase установлено")
+        
+        self.supabase: Client = client
+        
+        # Клиент supabase синхронный: запросы выполняются в отдельном пуле потоков,
+        # чтобы не блокировать event loop бота. Семафор ограничивает число
+        # одновременных запросов и не дает очереди пула расти без предела.
+        self._executor = ThreadPoolExecutor(
+            max_workers=DB_MAX_CONCURRENT_QUERIES,
+            thread_name_prefix='supabase'
+        )
+        self._query_semaphore = asyncio.Semaphore(DB_MAX_CONCURRENT_QUERIES)
+        
+        # Кэш строк button_users по telegram_id. Все изменения пользователя идут
+        # через методы этого класса и сразу записываются в кэш (write-through).
+        self._user_cache = LRUTTLCache(USER_CACHE_MAX_SIZE, USER_CACHE_TTL)
+        
+        # Кэш активной сессии по telegram_id (None - активной сессии нет) и
+        # индекс session_id -> telegram_id для чтения сессии по ID из памяти.
+        # Каждое изменение сессии возвращает строку из базы и обновляет кэш,
+        # поэтому последующие чтения в рамках сценария не ходят в базу.
+        self._session_cache = LRUTTLCache(SESSION_CACHE_MAX_SIZE, SESSION_CACHE_TTL)
+        self._session_owners = LRUTTLCache(SESSION_CACHE_MAX_SIZE, SESSION_CACHE_TTL)
+        
+        # Буфер активности пользователей: (telegram_id, дата UTC) -> счетчики.
+        # Сбрасывается в базу фоновой задачей одним запросом.
+        self._activity_buffer: Dict[Tuple[int, str], Dict[str, Any]] = {}
+        self._activity_task: Optional[asyncio.Task] = None
+        self._activity_stop = asyncio.Event()
+        
+        # Блокировки пользователей в пределах процесса (telegram_id -> блокировка
+        # и число ее владельцев и ожидающих) и статистика ожидания
+        self._user_locks: Dict[int, Tuple[asyncio.Lock, int]] = {}
+        self._lock_stats = {
+            'acquired': 0,
+            'contended': 0,
+            'timeouts': 0,
+            'total_wait': 0.0,
+            'max_wait': 0.0
+        }
+
+    async def _execute(self, query):
+        """
+        Выполнение запроса supabase без блокировки event loop
         
-        self.supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-        logger.info("Подключение к Supabase установлено")
+        Args:
+            query: Построенный запрос (результат table(...).select/update/insert)
+            
+        Returns:
+            APIResponse: Результат выполнения запроса
+        """
+        async with self._query_semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, query.execute)
+
+    async def close(self):
+        """Освобождение ресурсов подключения"""
+        if self._activity_task:
+            # Не отменяем задачу: она могла уже забрать пачку из буфера и
+            # потеряла бы ее. Задача завершает текущую запись и выходит.
+            self._activity_stop.set()
+            await self._activity_task
+            self._activity_task = None
+        
+        await self.flush_activity()
+        
+        self._executor.shutdown(wait=False)
+        logger.info("Пул запросов к Supabase остановлен")
+
+    def _cache_user_row(self, user_row: Optional[Dict[str, Any]]):
+        """
+        Запись актуальной строки пользователя в кэш
+        
+        Args:
+            user_row (Optional[Dict]): Строка button_users, возвращенная базой
+        """
+        if user_row and user_row.get('telegram_id') is not None:
+            # Строка может быть неполной (проекция) - дополняем закэшированную,
+            # если шаг регистрации не менялся (иначе заменяем строку целиком)
+            cached = self._user_cache.get(user_row['telegram_id'])
+            if _can_merge(cached, user_row, 'registration_step'):
+                user_row = {**cached, **user_row}
+            self._user_cache.set(user_row['telegram_id'], user_row)
 
-    async def find_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+    def _cache_session_row(self, session_row: Optional[Dict[str, Any]]):
+        """
+        Запись актуальной строки сессии в кэш
+        
+        Активная сессия становится текущей для пользователя. Завершенная или
+        отмененная сессия удаляется из кэша: следующая проверка пойдет в базу.
+        
+        Args:
+            session_row (Optional[Dict]): Строка button_post_creation_sessions, возвращенная базой
+        """
+        if not session_row or session_row.get('telegram_id') is None:
+            return
+        
+        telegram_id = session_row['telegram_id']
+        cached = self._session_cache.get(telegram_id, _MISSING)
+        
+        if session_row.get('session_status') not in ACTIVE_SESSION_STATUSES:
+            if cached is _MISSING or cached is None or cached['id'] == session_row['id']:
+                self._session_cache.invalidate(telegram_id)
+            return
+        
+        if cached not in (_MISSING, None) and cached['id'] != session_row['id']:
+            # Изменилась не та сессия, что считалась текущей - перечитаем из базы
+            self._session_cache.invalidate(telegram_id)
+            return
+        
+        self._set_current_session(telegram_id, session_row)
+
+    def _set_current_session(self, telegram_id: int, session_row: Optional[Dict[str, Any]]):
+        """
+        Запись прочитанной из базы активной сессии пользователя в кэш
+        
+        Args:
+            telegram_id (int): Telegram ID пользователя
+            session_row (Optional[Dict]): Активная сессия или None, если ее нет
+        """
+        if session_row:
+            # Строка может быть неполной (проекция) - дополняем закэшированную,
+            # если статус не менялся. Иначе сессию мог изменить другой процесс
+            # (webhook сервер сохраняет пост и переводит ее в reviewing), и
+            # остальные колонки кэша устарели - заменяем строку целиком.
+            cached = self._session_cache.get(telegram_id)
+            if _can_merge(cached, session_row, 'session_status'):
+                session_row = {**cached, **session_row}
+            self._session_owners.set(session_row['id'], telegram_id)
+        
+        self._session_cache.set(telegram_id, session_row)
+
+    def _get_cached_session(self, telegram_id: int, projection: str = 'full') -> Any:
+        """
+        Получение активной сессии из кэша
+        
+        Args:
+            telegram_id (int): Telegram ID пользователя
+            projection (str): Проекция, колонки которой должны быть в строке
+            
+        Returns:
+            Any: Строка сессии, None (активной сессии нет) или _MISSING при промахе
+        """
+        cached = self._session_cache.get(telegram_id, _MISSING)
+        
+        if cached in (_MISSING, None):
+            return cached
+        if cached.get('session_status') in EXTERNALLY_UPDATED_STATUSES:
+            return _MISSING
+        if not _has_columns(cached, projection_columns(SESSION_PROJECTIONS, projection)):
+            return _MISSING
+        return cached
+
+    def _get_cached_session_by_id(self, session_id: int, projection: str = 'full') -> Optional[Dict[str, Any]]:
+        """
+        Получение сессии по ID из кэша
+        
+        Args:
+            session_id (int): ID сессии
+            projection (str): Проекция, колонки которой должны быть в строке
+            
+        Returns:
+            Optional[Dict]: Строка сессии или None при промахе
+        """
+        telegram_id = self._session_owners.get(session_id)
+        if telegram_id is None:
+            return None
+        
+        cached = self._get_cached_session(telegram_id, projection)
+        if cached in (_MISSING, None) or cached['id'] != session_id:
+            return None
+        return cached
+
+    def get_cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Статистика in-process кэшей
+        
+        Returns:
+            Dict: Статистика по каждому кэшу (попадания, промахи, размер)
+        """
+        return {
+            'users': self._user_cache.stats(),
+            'sessions': self._session_cache.stats()
+        }
+
+    @asynccontextmanager
+    async def user_lock(self, telegram_id: int, timeout: float = USER_LOCK_TIMEOUT) -> AsyncIterator[None]:
+        """
+        Эксклюзивная блокировка пользователя (async with db.user_lock(...))
+        
+        Пока блокировка удерживается, другие обработчики этого пользователя (в
+        режиме advisory - и в других репликах бота) ждут. Кэш сессии сбрасывается
+        после получения блокировки: предыдущий владелец мог изменить сессию.
+        
+        Args:
+            telegram_id (int): Telegram ID пользователя
+            timeout (float): Максимальное время ожидания в секундах
+            
+        Raises:
+            UserLockTimeout: Блокировку не удалось получить за timeout
+        """
+        started = time.monotonic()
+        
+        try:
+            release, contended = await self._acquire_user_lock(telegram_id, started + timeout)
+        except UserLockTimeout:
+            self._lock_stats['timeouts'] += 1
+            logger.warning(f"Не удалось получить блокировку пользователя {telegram_id} за {timeout} с")
+            raise
+        
+        waited = time.monotonic() - started
+        self._lock_stats['acquired'] += 1
+        self._lock_stats['contended'] += int(contended)
+        self._lock_stats['total_wait'] += waited
+        self._lock_stats['max_wait'] = max(self._lock_stats['max_wait'], waited)
+        
+        self._session_cache.invalidate(telegram_id)
+        
+        try:
+            yield
+        finally:
+            await release()
+
+    async def _acquire_user_lock(self, telegram_id: int,
+                                 deadline: float) -> Tuple[Callable[[], Awaitable[None]], bool]:
+        """
+        Получение блокировки пользователя в пределах процесса
+        
+        Args:
+            telegram_id (int): Telegram ID пользователя
+            deadline (float): Момент (time.monotonic), после которого ждать нельзя
+            
+        Returns:
+            Tuple: Функция освобождения блокировки и признак того, что пришлось ждать
+            
+        Raises:
+            UserLockTimeout: Блокировку не удалось получить до deadline
+        """
+        lock, holders = self._user_locks.get(telegram_id, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._user_locks[telegram_id] = (lock, holders + 1)
+        contended = holders > 0
+        
+        def forget():
+            lock_entry, count = self._user_locks[telegram_id]
+            if count > 1:
+                self._user_locks[telegram_id] = (lock_entry, count - 1)
+            else:
+                del self._user_locks[telegram_id]
+        
+        try:
+            await asyncio.wait_for(lock.acquire(), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            forget()
+            raise UserLockTimeout(telegram_id)
+        except BaseException:
+            forget()
+            raise
+        
+        async def release():
+            lock.release()
+            forget()
+        
+        return release, contended
+
+    def get_lock_stats(self) -> Dict[str, Any]:
+        """
+        Статистика ожидания блокировок пользователей
+        
+        Returns:
+            Dict: Режим, число получений, из них с ожиданием, таймауты,
+                среднее и максимальное время ожидания в миллисекундах
+        """
+        stats = self._lock_stats
+        acquired = stats['acquired']
+        return {
+            'mode': USER_LOCK_MODE,
+            'acquired': acquired,
+            'contended': stats['contended'],
+            'timeouts': stats['timeouts'],
+            'avg_wait_ms': round(stats['total_wait'] / acquired * 1000, 2) if acquired else 0.0,
+            'max_wait_ms': round(stats['max_wait'] * 1000, 2)
+        }
+
+    async def find_user_by_email(self, email: str, projection: str = 'full') -> Optional[Dict[str, Any]]:
         """
         Поиск пользователя по email
         
         Args:
             email (str): Email адрес в нижнем регистре
+            projection (str): Набор колонок из USER_PROJECTIONS ('full' - все)
             
         Returns:
             Optional[Dict]: Данные пользователя или None если не найден
         """
         try:
-            result = self.supabase.table('button_users').select('*').eq('email', email.lower()).execute()
+            result = await self._execute(self.supabase.table('button_users').select(
+                projection_select(USER_PROJECTIONS, projection)
+            ).eq('email', email.lower()))
             
             if result.data:
                 logger.info(f"Пользователь найден по email: {email}")
@@ -41,6 +500,31 @@ class Database:
             logger.error(f"Ошибка при поиске пользователя по email {email}: {e}")
             raise
 
+    async def find_users_by_channel(self, channel_username: str,
+                                    projection: str = 'profile') -> List[Dict[str, Any]]:
+        """
+        Поиск пользователей, указавших канал
+        
+        Args:
+            channel_username (str): Username канала без @ (регистр не важен)
+            projection (str): Набор колонок из USER_PROJECTIONS ('full' - все)
+            
+        Returns:
+            List[Dict]: Найденные пользователи
+        """
+        try:
+            # channel_url хранится как https://t.me/<username>; '_' в LIKE - шаблон, экранируем
+            pattern = f"https://t.me/{channel_username}".replace('_', '\\_')
+            result = await self._execute(self.supabase.table('button_users').select(
+                projection_select(USER_PROJECTIONS, projection)
+            ).ilike('channel_url', pattern))
+            
+            return result.data or []
+                
+        except Exception as e:
+            logger.error(f"Ошибка при поиске пользователей канала @{channel_username}: {e}")
+            raise
+
     async def update_user_telegram_data(self, email: str, telegram_data: Dict[str, Any]) -> bool:
         """
         Обновление Telegram данных пользователя
@@ -62,9 +546,10 @@ class Database:
                 'last_activity': 'now()'
             }
             
-            result = self.supabase.table('button_users').update(update_data).eq('email', email.lower()).execute()
+            result = await self._execute(self.supabase.table('button_users').update(update_data).eq('email', email.lower()))
             
             if result.data:
+                self._cache_user_row(result.data[0])
                 logger.info(f"Telegram данные обновлены для пользователя: {email}")
                 return True
             else:
@@ -75,18 +560,42 @@ class Database:
             logger.error(f"Ошибка при обновлении Telegram данных для {email}: {e}")
             raise
 
-    async def get_user_by_telegram_id(self, telegram_id: int) -> Optional[Dict[str, Any]]:
+    async def get_user_by_telegram_id(self, telegram_id: int, 
+                                      projection: str = 'full') -> Optional[Dict[str, Any]]:
+        """
+        Получение пользователя по Telegram ID (с использованием кэша)
+        
+        Args:
+            telegram_id (int): Telegram ID пользователя
+            projection (str): Набор колонок из USER_PROJECTIONS ('full' - все)
+            
+        Returns:
+            Optional[Dict]: Данные пользователя или None
+        """
+        user_row = self._user_cache.get(telegram_id)
+        if user_row is not None and _has_columns(user_row, projection_columns(USER_PROJECTIONS, projection)):
+            return user_row
+        
+        user_row = await self._fetch_user_by_telegram_id(telegram_id, projection)
+        self._cache_user_row(user_row)
+        return self._user_cache.get(telegram_id) or user_row
+
+    async def _fetch_user_by_telegram_id(self, telegram_id: int, 
+                                         projection: str = 'full') -> Optional[Dict[str, Any]]:
         """
-        Получение пользователя по Telegram ID
+        Чтение пользователя по Telegram ID из базы в обход кэша
         
         Args:
             telegram_id (int): Telegram ID пользователя
+            projection (str): Набор колонок из USER_PROJECTIONS
             
         Returns:
             Optional[Dict]: Данные пользователя или None
         """
         try:
-            result = self.supabase.table('button_users').select('*').eq('telegram_id', telegram_id).execute()
+            result = await self._execute(self.supabase.table('button_users').select(
+                projection_select(USER_PROJECTIONS, projection)
+            ).eq('telegram_id', telegram_id))
             
             if result.data:
                 return result.data[0]
@@ -108,12 +617,13 @@ class Database:
             bool: True если обновление успешно
         """
         try:
-            result = self.supabase.table('button_users').update({
+            result = await self._execute(self.supabase.table('button_users').update({
                 'registration_step': step,
                 'last_activity': 'now()'
-            }).eq('telegram_id', telegram_id).execute()
+            }).eq('telegram_id', telegram_id))
             
             if result.data:
+                self._cache_user_row(result.data[0])
                 logger.info(f"Этап регистрации обновлен для пользователя {telegram_id}: {step}")
                 return True
             return False
@@ -149,9 +659,10 @@ class Database:
             if channel_title:
                 update_data['channel_title'] = channel_title
                 
-            result = self.supabase.table('button_users').update(update_data).eq('telegram_id', telegram_id).execute()
+            result = await self._execute(self.supabase.table('button_users').update(update_data).eq('telegram_id', telegram_id))
             
             if result.data:
+                self._cache_user_row(result.data[0])
                 logger.info(f"Данные канала обновлены для пользователя {telegram_id}")
                 return True
             return False
@@ -180,9 +691,10 @@ class Database:
             if is_admin:
                 update_data['registration_step'] = REGISTRATION_STEPS['COMPLETED']
                 
-            result = self.supabase.table('button_users').update(update_data).eq('telegram_id', telegram_id).execute()
+            result = await self._execute(self.supabase.table('button_users').update(update_data).eq('telegram_id', telegram_id))
             
             if result.data:
+                self._cache_user_row(result.data[0])
                 logger.info(f"Статус администратора обновлен для пользователя {telegram_id}: {is_admin}")
                 return True
             return False
@@ -193,24 +705,162 @@ class Database:
 
     async def update_last_activity(self, telegram_id: int) -> bool:
         """
-        Обновление времени последней активности пользователя
+        Отметка активности пользователя
+        
+        Запись в базу отложенная: активность копится в памяти и сбрасывается
+        flush_activity одним запросом.
         
         Args:
             telegram_id (int): Telegram ID пользователя
             
         Returns:
-            bool: True если обновление успешно
+            bool: True (активность учтена в буфере)
         """
+        self._record_activity(telegram_id)
+        return True
+
+    def _record_activity(self, telegram_id: int):
+        """
+        Учет активности пользователя в буфере
+        
+        Args:
+            telegram_id (int): Telegram ID пользователя
+        """
+        now = datetime.now(timezone.utc)
+        key = (telegram_id, now.date().isoformat())
+        
+        entry = self._activity_buffer.get(key)
+        if entry is None:
+            self._activity_buffer[key] = {
+                'telegram_id': telegram_id,
+                'activity_date': key[1],
+                'events': 1,
+                'first_seen_at': now.isoformat(),
+                'last_seen_at': now.isoformat()
+            }
+        else:
+            entry['events'] += 1
+            entry['last_seen_at'] = now.isoformat()
+
+    async def flush_activity(self) -> int:
+        """
+        Запись накопленной активности в базу одним запросом
+        
+        Returns:
+            int: Количество записанных строк дневной сводки
+        """
+        if not self._activity_buffer:
+            return 0
+        
+        pending = self._activity_buffer
+        self._activity_buffer = {}
+        
         try:
-            result = self.supabase.table('button_users').update({
-                'last_activity': 'now()'
-            }).eq('telegram_id', telegram_id).execute()
+            count = await self._write_activity(list(pending.values()))
+            logger.debug(f"Записана активность пользователей: {count}")
+            return count
+            
+        except Exception as e:
+            logger.error(f"Ошибка при записи активности пользователей: {e}")
+            
+            # Возвращаем данные в буфер, чтобы записать их при следующей попытке
+            for key, entry in pending.items():
+                current = self._activity_buffer.get(key)
+                if current is None:
+                    self._activity_buffer[key] = entry
+                else:
+                    current['events'] += entry['events']
+                    current['first_seen_at'] = entry['first_seen_at']
+            return 0
+
+    async def _write_activity(self, activity: List[Dict[str, Any]]) -> int:
+        """
+        Вызов функции button_flush_activity
+        
+        Args:
+            activity (List[Dict]): Строки дневной сводки активности
             
-            return bool(result.data)
+        Returns:
+            int: Количество записанных строк
+        """
+        result = await self._execute(self.supabase.rpc(
+            'button_flush_activity', {'p_activity': activity}
+        ))
+        return result.data or 0
+
+    def start_activity_flusher(self, interval: float = ACTIVITY_FLUSH_INTERVAL):
+        """
+        Запуск фоновой задачи периодической записи активности
+        
+        Args:
+            interval (float): Период записи в секундах
+        """
+        if self._activity_task is None:
+            self._activity_task = asyncio.create_task(self._activity_flush_loop(interval))
+
+    async def _activity_flush_loop(self, interval: float):
+        """Периодическая запись активности пользователей (до вызова close)"""
+        while not self._activity_stop.is_set():
+            try:
+                await asyncio.wait_for(self._activity_stop.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush_activity()
+
+    async def get_context_snapshot(self, telegram_id: int) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Получение пользователя и его активной сессии за один запрос
+        
+        Заодно отмечает активность пользователя. Если и пользователь, и его
+        сессия уже есть в кэше, запрос в базу не выполняется. Пользователь
+        возвращается в проекции 'profile', сессия - в проекции 'routing'.
+        
+        Args:
+            telegram_id (int): Telegram ID пользователя
+            
+        Returns:
+            Dict: {'user': данные пользователя или None, 'session': активная сессия или None}
+        """
+        self._record_activity(telegram_id)
+        
+        user_row = self._user_cache.get(telegram_id)
+        if user_row is not None and _has_columns(user_row, USER_PROJECTIONS['profile']):
+            session_row = self._get_cached_session(telegram_id, 'routing')
+            if session_row is not _MISSING:
+                return {'user': user_row, 'session': session_row}
+        
+        snapshot = await self._fetch_context_snapshot(telegram_id)
+        self._cache_user_row(snapshot['user'])
+        
+        if snapshot['user']:
+            self._set_current_session(telegram_id, snapshot['session'])
+        
+        return snapshot
+
+    async def _fetch_context_snapshot(self, telegram_id: int) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Вызов функции button_get_context_snapshot
+        
+        Args:
+            telegram_id (int): Telegram ID пользователя
+            
+        Returns:
+            Dict: {'user': данные пользователя или None, 'session': активная сессия или None}
+        """
+        try:
+            result = await self._execute(self.supabase.rpc(
+                'button_get_context_snapshot', {'p_telegram_id': telegram_id, 'p_touch': False}
+            ))
+            
+            data = result.data or {}
+            return {
+                'user': data.get('user'),
+                'session': data.get('session')
+            }
             
         except Exception as e:
-            logger.error(f"Ошибка при обновлении времени активности для пользователя {telegram_id}: {e}")
-            return False
+            logger.error(f"Ошибка при получении контекста пользователя {telegram_id}: {e}")
+            raise
 
     # Методы для работы с сессиями создания постов
     
@@ -229,13 +879,14 @@ class Database:
             # Сначала завершаем все активные сессии пользователя
             await self.cancel_active_sessions(telegram_id)
             
-            result = self.supabase.table('button_post_creation_sessions').insert({
+            result = await self._execute(self.supabase.table('button_post_creation_sessions').insert({
                 'user_id': user_id,
                 'telegram_id': telegram_id,
                 'session_status': 'question_1'
-            }).execute()
+            }))
             
             if result.data:
+                self._cache_session_row(result.data[0])
                 session_id = result.data[0]['id']
                 logger.info(f"Создана новая сессия создания поста {session_id} для пользователя {telegram_id}")
                 return session_id
@@ -245,33 +896,56 @@ class Database:
             logger.error(f"Ошибка при создании сессии поста для пользователя {telegram_id}: {e}")
             return None
 
-    async def get_active_post_session(self, telegram_id: int) -> Optional[Dict[str, Any]]:
+    async def get_active_post_session(self, telegram_id: int, use_cache: bool = True,
+                                      projection: str = 'full') -> Optional[Dict[str, Any]]:
         """
         Получение активной сессии создания поста
         
         Args:
             telegram_id (int): Telegram ID пользователя
+            use_cache (bool): Разрешить ответ из кэша (False - всегда читать из базы)
+            projection (str): Набор колонок из SESSION_PROJECTIONS ('full' - все)
             
         Returns:
             Optional[Dict]: Данные активной сессии или None
         """
+        if use_cache:
+            cached = self._get_cached_session(telegram_id, projection)
+            if cached is not _MISSING:
+                return cached
+        
         try:
-            result = self.supabase.table('button_post_creation_sessions').select('*').eq(
-                'telegram_id', telegram_id
-            ).in_(
-                'session_status', 
-                ['started', 'question_1', 'question_2', 'question_3', 'question_4', 'question_5', 
-                 'collecting_links', 'generating', 'reviewing', 'button_type_selection', 'button_config', 
-                 'button_text_selection', 'final_review']
-            ).order('created_at', desc=True).limit(1).execute()
-            
-            if result.data:
-                return result.data[0]
-            return None
-            
+            session_row = await self._fetch_active_post_session(telegram_id, projection)
         except Exception as e:
             logger.error(f"Ошибка при получении активной сессии для пользователя {telegram_id}: {e}")
             return None
+        
+        self._set_current_session(telegram_id, session_row)
+        return session_row
+
+    async def _fetch_active_post_session(self, telegram_id: int, 
+                                         projection: str = 'full') -> Optional[Dict[str, Any]]:
+        """
+        Чтение активной сессии из базы в обход кэша
+        
+        Args:
+            telegram_id (int): Telegram ID пользователя
+            projection (str): Набор колонок из SESSION_PROJECTIONS
+            
+        Returns:
+            Optional[Dict]: Данные активной сессии или None
+        """
+        result = await self._execute(self.supabase.table('button_post_creation_sessions').select(
+            projection_select(SESSION_PROJECTIONS, projection)
+        ).eq(
+            'telegram_id', telegram_id
+        ).in_(
+            'session_status', ACTIVE_SESSION_STATUSES
+        ).order('created_at', desc=True).limit(1))
+        
+        if result.data:
+            return result.data[0]
+        return None
 
     async def update_session_answer(self, session_id: int, answer_number: int, answer: str) -> bool:
         """
@@ -289,22 +963,15 @@ class Database:
             update_data = {f'answer_{answer_number}': answer}
             
             # Определяем следующий статус
-            if answer_number == 1:
-                update_data['session_status'] = 'question_2'
-            elif answer_number == 2:
-                update_data['session_status'] = 'question_3'
-            elif answer_number == 3:
-                update_data['session_status'] = 'question_4'
-            elif answer_number == 4:
-                update_data['session_status'] = 'question_5'
-            elif answer_number == 5:
-                update_data['session_status'] = 'collecting_links'
-            
-            result = self.supabase.table('button_post_creation_sessions').update(
+            if answer_number in NEXT_STATUS_AFTER_ANSWER:
+                update_data['session_status'] = NEXT_STATUS_AFTER_ANSWER[answer_number]
+            
+            result = await self._execute(self.supabase.table('button_post_creation_sessions').update(
                 update_data
-            ).eq('id', session_id).execute()
+            ).eq('id', session_id))
             
             if result.data:
+                self._cache_session_row(result.data[0])
                 logger.info(f"Обновлен ответ {answer_number} в сессии {session_id}")
                 return True
             return False
@@ -332,11 +999,12 @@ class Database:
             if generated_post:
                 update_data['generated_post'] = generated_post
             
-            result = self.supabase.table('button_post_creation_sessions').update(
+            result = await self._execute(self.supabase.table('button_post_creation_sessions').update(
                 update_data
-            ).eq('id', session_id).execute()
+            ).eq('id', session_id))
             
             if result.data:
+                self._cache_session_row(result.data[0])
                 logger.info(f"Обновлен статус сессии {session_id}: {status}")
                 return True
             return False
@@ -345,6 +1013,96 @@ class Database:
             logger.error(f"Ошибка при обновлении статуса сессии {session_id}: {e}")
             return False
 
+    async def update_session_fields(self, session_id: int, fields: Dict[str, Any],
+                                    expected_status: Optional[str] = None) -> bool:
+        """
+        Обновление произвольных полей сессии одним запросом
+        
+        Args:
+            session_id (int): ID сессии
+            fields (Dict): Колонки и их новые значения (None очищает колонку)
+            expected_status (Optional[str]): Обновить, только если сессия в этом статусе
+            
+        Returns:
+            bool: True если обновление успешно (False - в том числе если статус другой)
+        """
+        if not fields:
+            return True  # Нет данных для обновления
+        
+        try:
+            query = self.supabase.table('button_post_creation_sessions').update(
+                fields
+            ).eq('id', session_id)
+            
+            if expected_status is not None:
+                query = query.eq('session_status', expected_status)
+            
+            result = await self._execute(query)
+            
+            if result.data:
+                self._cache_session_row(result.data[0])
+                logger.info(f"Обновлены поля сессии {session_id}: {', '.join(fields)}")
+                return True
+            
+            if expected_status is not None:
+                logger.info(f"Сессия {session_id} уже не в статусе {expected_status}, обновление пропущено")
+            return False
+            
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении полей сессии {session_id}: {e}")
+            return False
+
+    async def complete_session_generation(self, session_id: int, telegram_id: int,
+                                          generated_post: str) -> Optional[Dict[str, Any]]:
+        """
+        Сохранение сгенерированного поста и перевод сессии в 'reviewing'
+
+        Один условный UPDATE по первичному ключу: поздний ответ n8n для сессии,
+        которая уже не ждет генерации (таймаут, отмена, новая сессия), ничего
+        не перезапишет.
+
+        Args:
+            session_id (int): ID сессии
+            telegram_id (int): Telegram ID владельца сессии
+            generated_post (str): Сгенерированный пост
+
+        Returns:
+            Optional[Dict]: Обновленная сессия или None, если сессия не в статусе 'generating'
+
+        Raises:
+            Exception: Ошибка базы - пост не сохранен, ответ можно обработать повторно
+        """
+        try:
+            result = await self._execute(self.supabase.table('button_post_creation_sessions').update({
+                'session_status': 'reviewing',
+                'generated_post': generated_post
+            }).eq('id', session_id).eq('telegram_id', telegram_id).eq('session_status', 'generating'))
+
+            if result.data:
+                session = result.data[0]
+                self._cache_session_row(session)
+                logger.info(f"Пост сохранен в сессии {session_id}, статус: reviewing")
+                return session
+
+            logger.info(f"Сессия {session_id} пользователя {telegram_id} не ожидает генерации, ответ n8n пропущен")
+            return None
+
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении поста в сессии {session_id}: {e}")
+            raise
+
+    def session_patch(self, session_id: int) -> 'SessionPatch':
+        """
+        Создание накопителя изменений сессии
+        
+        Args:
+            session_id (int): ID сессии
+            
+        Returns:
+            SessionPatch: Накопитель, записывающий все изменения одним UPDATE
+        """
+        return SessionPatch(self, session_id)
+
     async def cancel_active_sessions(self, telegram_id: int) -> bool:
         """
         Отмена всех активных сессий пользователя
@@ -356,14 +1114,15 @@ class Database:
             bool: True если операция успешна
         """
         try:
-            result = self.supabase.table('button_post_creation_sessions').update({
+            result = await self._execute(self.supabase.table('button_post_creation_sessions').update({
                 'session_status': 'cancelled'
             }).eq('telegram_id', telegram_id).in_(
                 'session_status', 
                 ['started', 'question_1', 'question_2', 'question_3', 'question_4', 'question_5',
                  'collecting_links', 'generating', 'reviewing']
-            ).execute()
+            ))
             
+            self._session_cache.invalidate(telegram_id)
             logger.info(f"Отменены активные сессии для пользователя {telegram_id}")
             return True
             
@@ -382,12 +1141,9 @@ class Database:
             Optional[Dict]: Словарь с ответами или None
         """
         try:
-            result = self.supabase.table('button_post_creation_sessions').select(
-                'answer_1, answer_2, answer_3, answer_4, answer_5'
-            ).eq('id', session_id).execute()
+            data = await self.get_active_post_session_by_id(session_id, 'answers')
             
-            if result.data:
-                data = result.data[0]
+            if data:
                 return {
                     'answer_1': data.get('answer_1'),
                     'answer_2': data.get('answer_2'),
@@ -412,24 +1168,12 @@ class Database:
             bool: True если очистка успешна
         """
         try:
-            result = self.supabase.table('button_post_creation_sessions').update({
-                'answer_1': None,
-                'answer_2': None,
-                'answer_3': None,
-                'answer_4': None,
-                'answer_5': None,
-
-                'link_1': None,
-                'link_2': None,
-                'link_3': None,
-                'link_4': None,
-                'link_5': None,
-                'generated_post': None,
-                'session_status': 'question_1',
-                'n8n_webhook_sent_at': None
-            }).eq('id', session_id).execute()
+            result = await self._execute(self.supabase.table('button_post_creation_sessions').update(
+                CLEARED_SESSION_FIELDS
+            ).eq('id', session_id))
             
             if result.data:
+                self._cache_session_row(result.data[0])
                 logger.info(f"Очищены ответы в сессии {session_id}")
                 return True
             return False
@@ -451,12 +1195,9 @@ class Database:
         try:
             import json
             
-            result = self.supabase.table('button_post_creation_sessions').select(
-                'link_1, link_2, link_3, link_4, link_5'
-            ).eq('id', session_id).execute()
+            data = await self.get_active_post_session_by_id(session_id, 'links')
             
-            if result.data:
-                data = result.data[0]
+            if data:
                 links = {}
                 
                 for i in range(1, 6):
@@ -505,11 +1246,12 @@ class Database:
             link_json = json.dumps(link_data, ensure_ascii=False)
             update_data = {f'link_{link_number}': link_json}
             
-            result = self.supabase.table('button_post_creation_sessions').update(
+            result = await self._execute(self.supabase.table('button_post_creation_sessions').update(
                 update_data
-            ).eq('id', session_id).execute()
+            ).eq('id', session_id))
             
             if result.data:
+                self._cache_session_row(result.data[0])
                 logger.info(f"Обновлена ссылка {link_number} в сессии {session_id}")
                 return True
             return False
@@ -518,25 +1260,66 @@ class Database:
             logger.error(f"Ошибка при обновлении ссылки {link_number} в сессии {session_id}: {e}")
             return False
 
-    async def get_expired_generating_sessions(self, timeout_minutes: int = 3) -> List[Dict[str, Any]]:
+    async def mark_session_generating(self, session_id: int) -> bool:
+        """
+        Перевод сессии в статус generating с отметкой времени отправки в n8n
+        
+        По n8n_webhook_sent_at сессию найдет проверка таймаута генерации,
+        в том числе после перезапуска бота.
+        
+        Args:
+            session_id (int): ID сессии
+            
+        Returns:
+            bool: True если обновление успешно
+        """
+        return await self.update_session_fields(session_id, {
+            'session_status': 'generating',
+            'n8n_webhook_sent_at': datetime.now(timezone.utc).isoformat()
+        })
+
+    async def expire_generating_session(self, session_id: int) -> bool:
+        """
+        Сброс сессии с истекшим временем генерации
+        
+        Сессия сбрасывается, только если она все еще в статусе generating:
+        если результат от n8n успел прийти или сессию уже сбросила другая
+        реплика бота, ничего не меняется.
+        
+        Args:
+            session_id (int): ID сессии
+            
+        Returns:
+            bool: True если сессия сброшена этим вызовом
+        """
+        return await self.update_session_fields(
+            session_id, CLEARED_SESSION_FIELDS, expected_status='generating'
+        )
+
+    async def get_expired_generating_sessions(self, timeout_seconds: float,
+                                              limit: int = 100) -> List[Dict[str, Any]]:
         """
         Получение сессий, которые находятся в статусе generating дольше указанного времени
         
+        Запрос использует частичный индекс idx_button_post_sessions_generating.
+        
         Args:
-            timeout_minutes (int): Таймаут в минутах
+            timeout_seconds (float): Таймаут генерации в секундах
+            limit (int): Максимум сессий за один запрос (самые старые)
             
         Returns:
-            List[Dict]: Список просроченных сессий
+            List[Dict]: Список просроченных сессий (проекция 'timeout')
         """
         try:
-            # Вычисляем время таймаута
-            timeout_time = f"NOW() - INTERVAL '{timeout_minutes} minutes'"
+            cutoff = (datetime.now(timezone.utc) - timedelta(seconds=timeout_seconds)).isoformat()
             
-            result = self.supabase.table('button_post_creation_sessions').select('*').eq(
+            result = await self._execute(self.supabase.table('button_post_creation_sessions').select(
+                projection_select(SESSION_PROJECTIONS, 'timeout')
+            ).eq(
                 'session_status', 'generating'
-            ).filter(
-                'n8n_webhook_sent_at', 'lt', f'now() - interval \'{timeout_minutes} minutes\''
-            ).execute()
+            ).lt(
+                'n8n_webhook_sent_at', cutoff
+            ).order('n8n_webhook_sent_at').limit(limit))
             
             return result.data or []
             
@@ -571,11 +1354,12 @@ class Database:
             if not update_data:
                 return True  # Нет данных для обновления
             
-            result = self.supabase.table('button_post_creation_sessions').update(
+            result = await self._execute(self.supabase.table('button_post_creation_sessions').update(
                 update_data
-            ).eq('id', session_id).execute()
+            ).eq('id', session_id))
             
             if result.data:
+                self._cache_session_row(result.data[0])
                 logger.info(f"Обновлены данные кнопки в сессии {session_id}")
                 return True
             return False
@@ -595,12 +1379,9 @@ class Database:
             Dict: Данные кнопки или None
         """
         try:
-            result = self.supabase.table('button_post_creation_sessions').select(
-                'button_type, button_url, button_text'
-            ).eq('id', session_id).execute()
+            data = await self.get_active_post_session_by_id(session_id, 'button')
             
-            if result.data and len(result.data) > 0:
-                data = result.data[0]
+            if data:
                 return {
                     'button_type': data.get('button_type'),
                     'button_url': data.get('button_url'),
@@ -612,29 +1393,66 @@ class Database:
             logger.error(f"Ошибка при получении данных кнопки из сессии {session_id}: {e}")
             return None
 
-    async def get_active_post_session_by_id(self, session_id: int) -> Optional[Dict[str, Any]]:
+    async def get_active_post_session_by_id(self, session_id: int, 
+                                            projection: str = 'full') -> Optional[Dict[str, Any]]:
         """
         Получение сессии по ID
         
         Args:
             session_id (int): ID сессии
+            projection (str): Набор колонок из SESSION_PROJECTIONS ('full' - все)
             
         Returns:
             Dict: Данные сессии или None
         """
+        cached = self._get_cached_session_by_id(session_id, projection)
+        if cached is not None:
+            return cached
+        
         try:
-            result = self.supabase.table('button_post_creation_sessions').select('*').eq(
+            result = await self._execute(self.supabase.table('button_post_creation_sessions').select(
+                projection_select(SESSION_PROJECTIONS, projection)
+            ).eq(
                 'id', session_id
-            ).execute()
+            ))
             
             if result.data and len(result.data) > 0:
-                return result.data[0]
+                session_row = result.data[0]
+                # Дополняем закэшированную строку прочитанными колонками
+                self._cache_session_row(session_row)
+                return session_row
             return None
             
         except Exception as e:
             logger.error(f"Ошибка при получении сессии по ID {session_id}: {e}")
             return None
 
+    async def warm_session_cache(self) -> int:
+        """
+        Загрузка всех активных сессий в кэш одним запросом (при старте бота)
+        
+        Returns:
+            int: Количество загруженных сессий
+        """
+        try:
+            result = await self._execute(self.supabase.table('button_post_creation_sessions').select('*').in_(
+                'session_status', ACTIVE_SESSION_STATUSES
+            ).order('created_at', desc=True).limit(SESSION_CACHE_MAX_SIZE))
+            
+            loaded = 0
+            for session_row in result.data or []:
+                # Строки отсортированы от новых к старым: берем первую сессию пользователя
+                if self._session_cache.get(session_row['telegram_id'], _MISSING) is _MISSING:
+                    self._set_current_session(session_row['telegram_id'], session_row)
+                    loaded += 1
+            
+            logger.info(f"В кэш загружено активных сессий: {loaded}")
+            return loaded
+            
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке активных сессий в кэш: {e}")
+            return 0
+
     async def get_user_post_count(self, telegram_id: int) -> int:
         """
         Получение количества опубликованных постов пользователя
@@ -645,10 +1463,14 @@ class Database:
         Returns:
             int: Количество постов (0 если пользователь не найден)
         """
+        user_row = self._user_cache.get(telegram_id)
+        if user_row is not None and 'post_count' in user_row:
+            return user_row['post_count'] or 0
+        
         try:
-            result = self.supabase.table('button_users').select('post_count').eq(
+            result = await self._execute(self.supabase.table('button_users').select('post_count').eq(
                 'telegram_id', telegram_id
-            ).execute()
+            ))
             
             if result.data and len(result.data) > 0:
                 return result.data[0].get('post_count', 0)
@@ -660,7 +1482,7 @@ class Database:
 
     async def increment_user_post_count(self, telegram_id: int) -> bool:
         """
-        Увеличение счетчика постов пользователя на 1
+        Увеличение счетчика постов пользователя на 1 (без проверки лимита)
         
         Args:
             telegram_id (int): Telegram ID пользователя
@@ -668,27 +1490,84 @@ class Database:
         Returns:
             bool: True если обновление успешно
         """
+        quota = await self.consume_post_quota(telegram_id, max_posts=UNLIMITED_POSTS)
+        return bool(quota and quota['consumed'])
+
+    async def consume_post_quota(self, telegram_id: int, max_posts: int = 3) -> Optional[Dict[str, Any]]:
+        """
+        Атомарное списание одного поста из лимита пользователя
+        
+        Проверка лимита и увеличение счетчика выполняются одним условным
+        UPDATE в базе, поэтому параллельные вызовы не превысят лимит.
+        
+        Args:
+            telegram_id (int): Telegram ID пользователя
+            max_posts (int): Максимальное количество постов (по умолчанию 3)
+            
+        Returns:
+            Optional[Dict]: Результат списания (None - ошибка базы, пост не списан) с полями:
+                - consumed (bool): Списан ли пост (False - лимит исчерпан)
+                - current_count (int): Количество постов после списания
+                - remaining (int): Сколько постов осталось
+                - max_posts (int): Лимит постов
+        """
         try:
-            # Получаем текущее количество постов
-            current_count = await self.get_user_post_count(telegram_id)
+            result = await self._execute(self.supabase.rpc(
+                'button_consume_post_quota', {'p_telegram_id': telegram_id, 'p_max_posts': max_posts}
+            ))
             
-            # Увеличиваем на 1
-            new_count = current_count + 1
+            quota = result.data
+            self._update_cached_post_count(telegram_id, quota['current_count'])
             
-            # Обновляем в базе
-            result = self.supabase.table('button_users').update({
-                'post_count': new_count
-            }).eq('telegram_id', telegram_id).execute()
+            if quota['consumed']:
+                logger.info(f"Счетчик постов увеличен до {quota['current_count']} для пользователя {telegram_id}")
+            else:
+                logger.info(f"Лимит постов исчерпан для пользователя {telegram_id}")
             
-            if result.data:
-                logger.info(f"Счетчик постов увеличен до {new_count} для пользователя {telegram_id}")
-                return True
-            return False
+            return quota
             
         except Exception as e:
-            logger.error(f"Ошибка при увеличении счетчика постов для пользователя {telegram_id}: {e}")
+            logger.error(f"Ошибка при списании лимита постов для пользователя {telegram_id}: {e}")
+            return None
+
+    async def release_post_quota(self, telegram_id: int) -> bool:
+        """
+        Возврат списанного поста в лимит (если публикация не удалась)
+        
+        Args:
+            telegram_id (int): Telegram ID пользователя
+            
+        Returns:
+            bool: True если счетчик уменьшен
+        """
+        try:
+            result = await self._execute(self.supabase.rpc(
+                'button_release_post_quota', {'p_telegram_id': telegram_id}
+            ))
+            
+            if result.data is None:
+                return False
+            
+            self._update_cached_post_count(telegram_id, result.data)
+            logger.info(f"Счетчик постов уменьшен до {result.data} для пользователя {telegram_id}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Ошибка при возврате лимита постов для пользователя {telegram_id}: {e}")
             return False
 
+    def _update_cached_post_count(self, telegram_id: int, post_count: int):
+        """
+        Обновление post_count в закэшированной строке пользователя
+        
+        Args:
+            telegram_id (int): Telegram ID пользователя
+            post_count (int): Новое значение счетчика
+        """
+        user_row = self._user_cache.get(telegram_id)
+        if user_row is not None:
+            self._cache_user_row({**user_row, 'post_count': post_count})
+
     async def check_post_limit(self, telegram_id: int, max_posts: int = 3) -> Dict[str, Any]:
         """
         Проверка лимита постов для пользователя
@@ -723,3 +1602,112 @@ class Database:
                 'remaining': 0,
                 'max_posts': max_posts
             }
+
+class SessionPatch:
+    """
+    Накопитель изменений одной сессии создания поста (unit of work)
+    
+    Обработчик собирает изменения через set()/set_status()/clear_answers(),
+    а flush() записывает их одним UPDATE. При использовании как async context
+    manager запись выполняется при выходе из блока без исключения.
+    """
+    
+    def __init__(self, db: Database, session_id: int):
+        """
+        Инициализация накопителя
+        
+        Args:
+            db (Database): База данных
+            session_id (int): ID сессии
+        """
+        self.db = db
+        self.session_id = session_id
+        self.fields: Dict[str, Any] = {}
+
+    def set(self, **fields) -> 'SessionPatch':
+        """
+        Установка значений полей сессии
+        
+        Args:
+            **fields: Колонки и их новые значения
+            
+        Returns:
+            SessionPatch: Этот же накопитель (для цепочек вызовов)
+        """
+        self.fields.update(fields)
+        return self
+
+    def set_status(self, status: str) -> 'SessionPatch':
+        """
+        Установка статуса сессии
+        
+        Args:
+            status (str): Новый статус
+            
+        Returns:
+            SessionPatch: Этот же накопитель
+        """
+        self.fields['session_status'] = status
+        return self
+
+    def clear_answers(self) -> 'SessionPatch':
+        """
+        Очистка ответов, материалов и поста для перезапуска процесса
+        
+        Returns:
+            SessionPatch: Этот же накопитель
+        """
+        self.fields.update(CLEARED_SESSION_FIELDS)
+        return self
+
+    async def flush(self) -> bool:
+        """
+        Запись накопленных изменений одним запросом
+        
+        Returns:
+            bool: True если запись успешна (или изменений нет)
+        """
+        if not self.fields:
+            return True
+        
+        success = await self.db.update_session_fields(self.session_id, self.fields)
+        if success:
+            self.fields = {}
+        return success
+
+    async def __aenter__(self) -> 'SessionPatch':
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.flush()
+
+def create_database() -> Database:
+    """
+    Создание экземпляра базы данных в соответствии с настройкой DB_BACKEND
+    
+    Returns:
+        Database: Supabase (по умолчанию), asyncpg, SQLite или база в памяти
+    """
+    if USER_LOCK_MODE not in ('local', 'advisory'):
+        raise ValueError(f"Неизвестный USER_LOCK_MODE: {USER_LOCK_MODE}")
+    
+    if USER_LOCK_MODE == 'advisory' and DB_BACKEND != 'asyncpg':
+        raise ValueError("USER_LOCK_MODE=advisory требует DB_BACKEND=asyncpg")
+    
+    if DB_BACKEND == 'asyncpg':
+        from pg_database import PostgresDatabase
+        return PostgresDatabase()
+    
+    if DB_BACKEND == 'sqlite':
+        from local_storage import SQLiteDatabase
+        return SQLiteDatabase()
+    
+    if DB_BACKEND == 'memory':
+        from local_storage import MemoryDatabase
+        return MemoryDatabase()
+    
+    if DB_BACKEND != 'supabase':
+        raise ValueError(f"Неизвестный DB_BACKEND: {DB_BACKEND}")
+    
+    return Database()
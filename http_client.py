@@ -0,0 +1,70 @@
+"""
+Общий HTTP клиент с пулом соединений для n8n, загрузки файлов Telegram и админского бота
+"""
+import logging
+from typing import Optional
+
+import aiohttp
+
+from config import (
+    HTTP_POOL_LIMIT,
+    HTTP_POOL_LIMIT_PER_HOST,
+    HTTP_DNS_CACHE_TTL,
+    HTTP_KEEPALIVE_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPClientManager:
+    """
+    Один aiohttp.ClientSession на все время работы приложения
+
+    Соединения с каждым хостом переиспользуются (keep-alive), а адреса
+    кэшируются, поэтому DNS, TCP и TLS не повторяются на каждый запрос.
+    """
+
+    def __init__(self, limit: int = HTTP_POOL_LIMIT, limit_per_host: int = HTTP_POOL_LIMIT_PER_HOST,
+                 dns_cache_ttl: int = HTTP_DNS_CACHE_TTL, keepalive_timeout: float = HTTP_KEEPALIVE_TIMEOUT):
+        """
+        Инициализация менеджера (сессия создается при первом запросе)
+
+        Args:
+            limit (int): Максимум соединений всего
+            limit_per_host (int): Максимум соединений с одним хостом
+            dns_cache_ttl (int): Время жизни записи DNS кэша в секундах
+            keepalive_timeout (float): Сколько секунд держать простаивающее соединение
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """
+        Общая сессия (создается в текущем event loop при первом обращении)
+
+        Returns:
+            aiohttp.ClientSession: Сессия с пулом соединений
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+            logger.info(
+                f"HTTP клиент создан (соединений: {self.limit}, на хост: {self.limit_per_host})"
+            )
+        return self._session
+
+    async def close(self):
+        """Закрытие сессии и всех соединений пула"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("HTTP клиент закрыт")
+        self._session = None
@@ -0,0 +1,164 @@
+"""
+Отсев повторных доставок обновлений Telegram и ответов n8n
+"""
+import hashlib
+import logging
+from typing import Any, Dict, Hashable
+
+from telegram import Update
+
+from cache import LRUTTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyStore:
+    """
+    Ограниченное по размеру и времени окно уже принятых ключей
+
+    Ключ, пришедший повторно, пока запись о нем не вытеснена и не устарела,
+    считается дубликатом. Хранится в памяти процесса: обновления одного
+    пользователя всегда обрабатывает один процесс, а ответы n8n - один
+    webhook сервер.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        """
+        Инициализация хранилища
+
+        Args:
+            max_size (int): Максимальное количество ключей
+            ttl (float): Сколько секунд помнить ключ
+        """
+        self._seen = LRUTTLCache(max_size, ttl)
+        self.duplicates = 0
+
+    def claim(self, key: Hashable) -> bool:
+        """
+        Отметка ключа как принятого
+
+        Args:
+            key: Ключ доставки
+
+        Returns:
+            bool: True, если ключ встретился впервые (доставку нужно обработать)
+        """
+        if self._seen.get(key) is not None:
+            self.duplicates += 1
+            return False
+
+        self._seen.set(key, True)
+        return True
+
+    def release(self, key: Hashable):
+        """
+        Снятие отметки, чтобы повторная доставка была обработана
+
+        Args:
+            key: Ключ доставки
+        """
+        self._seen.invalidate(key)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Метрики хранилища
+
+        Returns:
+            Dict: Отброшено дубликатов, сколько ключей помнится сейчас и максимум
+        """
+        return {
+            'duplicates': self.duplicates,
+            'size': len(self._seen),
+            'max_size': self._seen.max_size
+        }
+
+
+class UpdateDeduplicator:
+    """
+    Повторные доставки обновлений Telegram: тот же update_id или id нажатия
+    кнопки, а также двойное нажатие - та же кнопка под тем же сообщением
+    в пределах короткого окна
+    """
+
+    def __init__(self, max_size: int, ttl: float, tap_window: float):
+        """
+        Инициализация
+
+        Args:
+            max_size (int): Максимальное количество ключей в каждом окне
+            ttl (float): Сколько секунд помнить update_id и id нажатий
+            tap_window (float): Окно двойного нажатия в секундах (0 - не проверять)
+        """
+        self.deliveries = IdempotencyStore(max_size, ttl)
+        self.taps = IdempotencyStore(max_size, tap_window) if tap_window > 0 else None
+
+    def is_duplicate(self, update: object) -> bool:
+        """
+        Проверка обновления (первое появление запоминается)
+
+        Args:
+            update (object): Обновление
+
+        Returns:
+            bool: True, если обновление нужно отбросить
+        """
+        if not isinstance(update, Update):
+            return False
+
+        if not self.deliveries.claim(('update', update.update_id)):
+            logger.info(f"Повторная доставка обновления {update.update_id} отброшена")
+            return True
+
+        query = update.callback_query
+        if query is None:
+            return False
+
+        if not self.deliveries.claim(('callback', query.id)):
+            logger.info(f"Повторное нажатие {query.id} отброшено")
+            return True
+
+        if self.taps is not None and query.message is not None:
+            tap = (query.message.chat_id, query.message.message_id, query.data)
+            if not self.taps.claim(tap):
+                logger.info(f"Двойное нажатие '{query.data}' пользователем {query.from_user.id} отброшено")
+                return True
+
+        return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Метрики отсева
+
+        Returns:
+            Dict: Метрики окна доставок и окна двойных нажатий
+        """
+        return {
+            'deliveries': self.deliveries.get_stats(),
+            'taps': self.taps.get_stats() if self.taps is not None else None
+        }
+
+
+def n8n_result_key(data: Dict[str, Any]) -> Hashable:
+    """
+    Ключ ответа n8n: (session_id, attempt)
+
+    Если n8n не вернул attempt, попытку обозначает хэш текста поста: повтор
+    того же запроса совпадет, а новая генерация в той же сессии (после
+    отклонения поста) - нет. Ответ старого формата без session_id
+    привязывается к пользователю.
+
+    Args:
+        data (Dict): Данные от n8n
+
+    Returns:
+        Hashable: Ключ ответа
+    """
+    session_id = data.get('session_id')
+    session = f"session:{session_id}" if session_id is not None else f"user:{data.get('telegram_id')}"
+
+    attempt = data.get('attempt')
+    if attempt is None:
+        post = str(data.get('generated_post', ''))
+        attempt = hashlib.blake2b(post.encode(), digest_size=8).hexdigest()
+
+    return (session, str(attempt))
@@ -0,0 +1,579 @@
+"""
+Локальные бэкенды хранения: файл SQLite (режим WAL) и база в памяти процесса
+
+Database строит запросы через API клиента supabase (table(...).select/insert/update,
+фильтры eq/in_/lt, order, limit и rpc). SQLiteClient принимает те же запросы и
+выполняет их на sqlite3 по схеме из schema.sql и миграций, включая функции
+button_get_context_snapshot, button_flush_activity и списание лимита постов.
+Так бот и обработчик вебхуков работают без Supabase: для локального запуска,
+замеров скорости обработчиков и нагрузочных прогонов.
+"""
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from config import SQLITE_PATH
+from database import Database, ACTIVE_SESSION_STATUSES, USER_PROJECTIONS, SESSION_PROJECTIONS
+
+logger = logging.getLogger(__name__)
+
+# Схема из schema.sql и миграций в диалекте SQLite
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS button_users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    email TEXT UNIQUE NOT NULL,
+    telegram_id INTEGER UNIQUE,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    registration_step INTEGER DEFAULT 0,
+    channel_url TEXT,
+    channel_id INTEGER,
+    channel_title TEXT,
+    is_bot_admin INTEGER DEFAULT 0,
+    post_count INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT,
+    updated_at TEXT,
+    last_activity TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_button_users_registration_step ON button_users(registration_step);
+
+CREATE TABLE IF NOT EXISTS button_post_creation_sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL REFERENCES button_users(id) ON DELETE CASCADE,
+    telegram_id INTEGER NOT NULL,
+    session_status TEXT DEFAULT 'started',
+    answer_1 TEXT,
+    answer_2 TEXT,
+    answer_3 TEXT,
+    answer_4 TEXT,
+    answer_5 TEXT,
+    answer_6 TEXT,
+    link_1 TEXT,
+    link_2 TEXT,
+    link_3 TEXT,
+    link_4 TEXT,
+    link_5 TEXT,
+    generated_post TEXT,
+    button_type TEXT,
+    button_url TEXT,
+    button_text TEXT,
+    n8n_webhook_sent_at TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    expires_at TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_button_post_sessions_telegram_id ON button_post_creation_sessions(telegram_id);
+CREATE INDEX IF NOT EXISTS idx_button_post_sessions_status ON button_post_creation_sessions(session_status);
+CREATE INDEX IF NOT EXISTS idx_button_post_sessions_generating
+    ON button_post_creation_sessions(n8n_webhook_sent_at) WHERE session_status = 'generating';
+
+CREATE TABLE IF NOT EXISTS button_user_activity_daily (
+    telegram_id INTEGER NOT NULL,
+    activity_date TEXT NOT NULL,
+    events INTEGER NOT NULL DEFAULT 0,
+    first_seen_at TEXT NOT NULL,
+    last_seen_at TEXT NOT NULL,
+    PRIMARY KEY (telegram_id, activity_date)
+);
+
+-- Раньше 'now()' записывалось как текст: такое значение больше любой даты,
+-- и активность больше не обновлялась. NULL обновит следующая запись активности.
+UPDATE button_users SET last_activity = NULL WHERE last_activity = 'now()';
+"""
+
+# Колонки времени, которые в Postgres заполняются DEFAULT NOW()
+TIMESTAMP_DEFAULTS = {
+    'button_users': ['created_at', 'updated_at', 'last_activity'],
+    'button_post_creation_sessions': ['created_at', 'updated_at']
+}
+
+# Колонки BOOLEAN: SQLite хранит их как 0/1
+BOOLEAN_COLUMNS = {'is_bot_admin'}
+
+FILTER_OPERATORS = {
+    'eq': '=',
+    'neq': '!=',
+    'lt': '<',
+    'lte': '<=',
+    'gt': '>',
+    'gte': '>='
+}
+
+
+def _now() -> str:
+    """Текущее время UTC в формате ISO 8601 (как timestamptz в PostgREST)"""
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _resolve_now(values: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Замена значения 'now()' текущим временем
+
+    Postgres вычисляет строку 'now()' в колонке timestamptz как текущее время;
+    SQLite записал бы ее как текст, который при сравнении со временем в ISO
+    формате всегда больше любой даты.
+
+    Args:
+        values (Dict): Значения колонок
+
+    Returns:
+        Dict: Значения с подставленным временем
+    """
+    if 'now()' not in values.values():
+        return values
+    now = _now()
+    return {name: now if value == 'now()' else value for name, value in values.items()}
+
+
+def _column(name: str) -> str:
+    """
+    Проверка имени колонки перед подстановкой в текст запроса
+
+    Args:
+        name (str): Имя колонки
+
+    Returns:
+        str: То же имя
+    """
+    if not name.isidentifier():
+        raise ValueError(f"Недопустимое имя колонки: {name}")
+    return name
+
+
+def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+    """
+    Преобразование строки sqlite3 в словарь в том же виде, что отдает PostgREST
+
+    Args:
+        row (sqlite3.Row): Строка результата
+
+    Returns:
+        Dict: Данные строки
+    """
+    data = dict(row)
+    for key in BOOLEAN_COLUMNS & data.keys():
+        if data[key] is not None:
+            data[key] = bool(data[key])
+    return data
+
+
+class QueryResult:
+    """Результат запроса с тем же атрибутом data, что у APIResponse supabase"""
+
+    def __init__(self, data: Any):
+        self.data = data
+
+
+class SQLiteQuery:
+    """Запрос к таблице в стиле построителя запросов supabase"""
+
+    def __init__(self, client: 'SQLiteClient', table: str):
+        self._client = client
+        self._table = _column(table)
+        self._action = 'select'
+        self._columns = '*'
+        self._values: Any = None
+        self._where: List[str] = []
+        self._params: List[Any] = []
+        self._order: Optional[str] = None
+        self._limit: Optional[int] = None
+
+    def select(self, columns: str = '*') -> 'SQLiteQuery':
+        self._action = 'select'
+        if columns.strip() != '*':
+            columns = ', '.join(_column(name.strip()) for name in columns.split(','))
+        self._columns = columns
+        return self
+
+    def insert(self, values: Any) -> 'SQLiteQuery':
+        self._action = 'insert'
+        self._values = values if isinstance(values, list) else [values]
+        return self
+
+    def update(self, values: Dict[str, Any]) -> 'SQLiteQuery':
+        self._action = 'update'
+        self._values = values
+        return self
+
+    def filter(self, column: str, operator: str, value: Any) -> 'SQLiteQuery':
+        if operator not in FILTER_OPERATORS:
+            raise ValueError(f"Неподдерживаемый оператор фильтра: {operator}")
+        self._where.append(f"{_column(column)} {FILTER_OPERATORS[operator]} ?")
+        self._params.append(value)
+        return self
+
+    def eq(self, column: str, value: Any) -> 'SQLiteQuery':
+        return self.filter(column, 'eq', value)
+
+    def neq(self, column: str, value: Any) -> 'SQLiteQuery':
+        return self.filter(column, 'neq', value)
+
+    def lt(self, column: str, value: Any) -> 'SQLiteQuery':
+        return self.filter(column, 'lt', value)
+
+    def lte(self, column: str, value: Any) -> 'SQLiteQuery':
+        return self.filter(column, 'lte', value)
+
+    def gt(self, column: str, value: Any) -> 'SQLiteQuery':
+        return self.filter(column, 'gt', value)
+
+    def gte(self, column: str, value: Any) -> 'SQLiteQuery':
+        return self.filter(column, 'gte', value)
+
+    def ilike(self, column: str, pattern: str) -> 'SQLiteQuery':
+        # LIKE в SQLite, как ILIKE в Postgres, не учитывает регистр латиницы
+        self._where.append(f"{_column(column)} LIKE ? ESCAPE '\\'")
+        self._params.append(pattern)
+        return self
+
+    def in_(self, column: str, values: List[Any]) -> 'SQLiteQuery':
+        values = list(values)
+        if not values:
+            self._where.append('0')
+            return self
+        self._where.append(f"{_column(column)} IN ({', '.join('?' for _ in values)})")
+        self._params.extend(values)
+        return self
+
+    def is_(self, column: str, value: Any) -> 'SQLiteQuery':
+        if value in (None, 'null'):
+            self._where.append(f"{_column(column)} IS NULL")
+        else:
+            self._where.append(f"{_column(column)} IS ?")
+            self._params.append(value)
+        return self
+
+    def order(self, column: str, desc: bool = False) -> 'SQLiteQuery':
+        self._order = f"{_column(column)} {'DESC' if desc else 'ASC'}"
+        return self
+
+    def limit(self, count: int) -> 'SQLiteQuery':
+        self._limit = int(count)
+        return self
+
+    def _where_sql(self) -> str:
+        return f" WHERE {' AND '.join(self._where)}" if self._where else ''
+
+    def execute(self) -> QueryResult:
+        """
+        Выполнение запроса
+
+        Returns:
+            QueryResult: Строки результата (для insert/update - измененные строки)
+        """
+        return self._client.run(self._run, write=self._action != 'select')
+
+    def _run(self, conn: sqlite3.Connection) -> QueryResult:
+        if self._action == 'select':
+            sql = f"SELECT {self._columns} FROM {self._table}{self._where_sql()}"
+            if self._order:
+                sql += f" ORDER BY {self._order}"
+            if self._limit is not None:
+                sql += f" LIMIT {self._limit}"
+            rows = conn.execute(sql, self._params).fetchall()
+            return QueryResult([_row_to_dict(row) for row in rows])
+
+        if self._action == 'insert':
+            inserted = []
+            for values in self._values:
+                values = self._with_defaults(_resolve_now(values))
+                columns = ', '.join(_column(name) for name in values)
+                placeholders = ', '.join('?' for _ in values)
+                row = conn.execute(
+                    f"INSERT INTO {self._table} ({columns}) VALUES ({placeholders}) RETURNING *",
+                    list(values.values())
+                ).fetchone()
+                inserted.append(_row_to_dict(row))
+            return QueryResult(inserted)
+
+        values = _resolve_now(dict(self._values))
+        # Аналог триггера update_updated_at_column из schema.sql
+        if self._table in TIMESTAMP_DEFAULTS and 'updated_at' not in values:
+            values['updated_at'] = _now()
+        assignments = ', '.join(f"{_column(name)} = ?" for name in values)
+        rows = conn.execute(
+            f"UPDATE {self._table} SET {assignments}{self._where_sql()} RETURNING *",
+            [*values.values(), *self._params]
+        ).fetchall()
+        return QueryResult([_row_to_dict(row) for row in rows])
+
+    def _with_defaults(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        """Заполнение значений по умолчанию, которые в Postgres вычисляет DEFAULT"""
+        values = dict(values)
+        now = _now()
+        for name in TIMESTAMP_DEFAULTS.get(self._table, []):
+            values.setdefault(name, now)
+        if self._table == 'button_post_creation_sessions':
+            values.setdefault('session_status', 'started')
+            values.setdefault(
+                'expires_at', (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat()
+            )
+        return values
+
+
+class SQLiteRPC:
+    """Вызов функции базы данных в стиле supabase.rpc(...)"""
+
+    def __init__(self, client: 'SQLiteClient', name: str, params: Dict[str, Any]):
+        handler = getattr(client, f"_rpc_{name}", None)
+        if handler is None:
+            raise ValueError(f"Функция {name} не поддерживается локальным хранилищем")
+
+        self._client = client
+        self._handler = handler
+        self._params = params
+
+    def execute(self) -> QueryResult:
+        return self._client.run(lambda conn: QueryResult(self._handler(conn, **self._params)), write=True)
+
+
+class SQLiteClient:
+    """
+    Клиент SQLite с API запросов supabase
+
+    Для файла каждый поток пула запросов Database получает свое соединение:
+    в режиме WAL чтения идут параллельно и не ждут записи. База в памяти
+    (':memory:') живет в одном соединении, доступ к нему сериализуется.
+    """
+
+    def __init__(self, path: str):
+        """
+        Инициализация клиента
+
+        Args:
+            path (str): Путь к файлу базы или ':memory:'
+        """
+        self.path = path
+        self.in_memory = path == ':memory:'
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.RLock()
+
+        with self._lock:
+            self._connection().executescript(SCHEMA_SQL)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Соединение для текущего потока (для базы в памяти - единственное)"""
+        if self.in_memory and self._connections:
+            return self._connections[0]
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA foreign_keys = ON")
+            if not self.in_memory:
+                conn.execute("PRAGMA journal_mode = WAL")
+                conn.execute("PRAGMA synchronous = NORMAL")
+
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def run(self, operation, write: bool = False) -> Any:
+        """
+        Выполнение операции в транзакции
+
+        Args:
+            operation: Функция, принимающая соединение
+            write (bool): Операция изменяет данные (транзакция берет блокировку записи сразу)
+
+        Returns:
+            Any: Результат operation
+        """
+        if self.in_memory:
+            with self._lock:
+                return self._run(operation, write)
+        return self._run(operation, write)
+
+    def _run(self, operation, write: bool) -> Any:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        try:
+            result = operation(conn)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def table(self, name: str) -> SQLiteQuery:
+        return SQLiteQuery(self, name)
+
+    def rpc(self, name: str, params: Optional[Dict[str, Any]] = None) -> SQLiteRPC:
+        return SQLiteRPC(self, name, params or {})
+
+    def close(self):
+        """Закрытие всех соединений"""
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    # Функции базы данных из миграций
+
+    def _rpc_button_get_context_snapshot(self, conn: sqlite3.Connection, p_telegram_id: int,
+                                         p_touch: bool = True) -> Dict[str, Any]:
+        """См. migration_context_projection.sql"""
+        if p_touch:
+            conn.execute(
+                "UPDATE button_users SET last_activity = ? WHERE telegram_id = ?",
+                (_now(), p_telegram_id)
+            )
+
+        user = conn.execute(
+            f"SELECT {', '.join(USER_PROJECTIONS['profile'])} FROM button_users WHERE telegram_id = ?",
+            (p_telegram_id,)
+        ).fetchone()
+        if user is None:
+            return {'user': None, 'session': None}
+
+        session = conn.execute(
+            f"SELECT {', '.join(SESSION_PROJECTIONS['routing'])} FROM button_post_creation_sessions "
+            f"WHERE telegram_id = ? AND session_status IN ({', '.join('?' for _ in ACTIVE_SESSION_STATUSES)}) "
+            f"ORDER BY created_at DESC LIMIT 1",
+            (p_telegram_id, *ACTIVE_SESSION_STATUSES)
+        ).fetchone()
+
+        return {
+            'user': _row_to_dict(user),
+            'session': _row_to_dict(session) if session else None
+        }
+
+    def _rpc_button_flush_activity(self, conn: sqlite3.Connection,
+                                   p_activity: List[Dict[str, Any]]) -> int:
+        """См. migration_activity_rollup.sql"""
+        last_seen: Dict[int, str] = {}
+
+        for item in p_activity:
+            conn.execute(
+                """
+                INSERT INTO button_user_activity_daily
+                    (telegram_id, activity_date, events, first_seen_at, last_seen_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (telegram_id, activity_date) DO UPDATE SET
+                    events = events + excluded.events,
+                    first_seen_at = MIN(first_seen_at, excluded.first_seen_at),
+                    last_seen_at = MAX(last_seen_at, excluded.last_seen_at)
+                """,
+                (item['telegram_id'], item['activity_date'], item['events'],
+                 item['first_seen_at'], item['last_seen_at'])
+            )
+            last_seen[item['telegram_id']] = max(
+                last_seen.get(item['telegram_id'], ''), item['last_seen_at']
+            )
+
+        # last_activity обновляется, только если отстала больше чем на 15 минут
+        for telegram_id, seen_at in last_seen.items():
+            threshold = (datetime.fromisoformat(seen_at) - timedelta(minutes=15)).isoformat()
+            conn.execute(
+                "UPDATE button_users SET last_activity = ? "
+                "WHERE telegram_id = ? AND (last_activity IS NULL OR last_activity < ?)",
+                (seen_at, telegram_id, threshold)
+            )
+
+        return len(p_activity)
+
+    def _rpc_button_consume_post_quota(self, conn: sqlite3.Connection, p_telegram_id: int,
+                                       p_max_posts: int = 3) -> Dict[str, Any]:
+        """См. migration_post_quota.sql"""
+        row = conn.execute(
+            "UPDATE button_users SET post_count = post_count + 1 "
+            "WHERE telegram_id = ? AND post_count < ? RETURNING post_count",
+            (p_telegram_id, p_max_posts)
+        ).fetchone()
+
+        consumed = row is not None
+        if not consumed:
+            row = conn.execute(
+                "SELECT post_count FROM button_users WHERE telegram_id = ?", (p_telegram_id,)
+            ).fetchone()
+        count = row['post_count'] if row else 0
+
+        return {
+            'consumed': consumed,
+            'current_count': count,
+            'remaining': max(0, p_max_posts - count),
+            'max_posts': p_max_posts
+        }
+
+    def _rpc_button_release_post_quota(self, conn: sqlite3.Connection, p_telegram_id: int) -> Optional[int]:
+        """См. migration_post_quota.sql"""
+        row = conn.execute(
+            "UPDATE button_users SET post_count = post_count - 1 "
+            "WHERE telegram_id = ? AND post_count > 0 RETURNING post_count",
+            (p_telegram_id,)
+        ).fetchone()
+        return row['post_count'] if row else None
+
+
+class SQLiteDatabase(Database):
+    """Database поверх локального файла SQLite в режиме WAL"""
+
+    def __init__(self, path: str = SQLITE_PATH):
+        """
+        Инициализация локальной базы
+
+        Args:
+            path (str): Путь к файлу базы (создается вместе со схемой при первом запуске)
+        """
+        super().__init__(client=SQLiteClient(path))
+        logger.info(f"Локальная база SQLite открыта: {path}")
+
+    async def close(self):
+        """Запись накопленной активности и закрытие соединений"""
+        await super().close()
+        self.supabase.close()
+
+    async def add_user(self, email: str, **fields) -> Optional[Dict[str, Any]]:
+        """
+        Добавление пользователя (в Supabase пользователей заводит администратор)
+
+        Args:
+            email (str): Email пользователя
+            **fields: Остальные колонки button_users
+
+        Returns:
+            Optional[Dict]: Созданная строка пользователя
+        """
+        result = await self._execute(self.supabase.table('button_users').insert({
+            'email': email.lower(),
+            **fields
+        }))
+
+        user_row = result.data[0] if result.data else None
+        self._cache_user_row(user_row)
+        return user_row
+
+
+class MemoryDatabase(SQLiteDatabase):
+    """
+    Database в памяти процесса: данные не сохраняются и не видны другим
+    процессам. Для замеров скорости обработчиков и нагрузочных прогонов.
+    """
+
+    def __init__(self):
+        """Инициализация пустой базы в памяти"""
+        super().__init__(':memory:')
+
+    async def _execute(self, query):
+        """
+        Выполнение запроса без переключения в пул потоков
+
+        Запрос к базе в памяти короче, чем передача задачи в поток, поэтому
+        он выполняется прямо в event loop.
+
+        Args:
+            query: Построенный запрос
+
+        Returns:
+            QueryResult: Результат выполнения запроса
+        """
+        return query.execute()
@@ -1,96 +1,66 @@
 """
 Главный файл для запуска Telegram бота и webhook сервера
 """
+import argparse
 import asyncio
 import logging
-import signal
 import sys
 from bot import TelegramBot
-from webhook_server import run_webhook_server
+from config import BOT_WORKERS, UNIFIED_RUNTIME, WEBHOOK_SERVER_HOST, WEBHOOK_SERVER_PORT
+from sharded_runtime import ShardedBotRuntime
 
 logger = logging.getLogger(__name__)
 
 class BotApplication:
-    def __init__(self):
-        """Инициализация приложения"""
+    def __init__(self, unified: bool = False):
+        """
+        Инициализация приложения
+
+        Args:
+            unified (bool): Запустить webhook сервер n8n в том же процессе,
+                что и бот (общие event loop, хранилище и соединения)
+        """
+        self.unified = unified
         self.bot = None
-        self.webhook_runner = None
-        self.running = True
 
     def start(self):
         """Запуск бота"""
         try:
             logger.info("Запуск приложения...")
-            
-            # Создаем и запускаем только бота (БЕЗ webhook сервера)
+
             logger.info("Инициализация Telegram бота...")
             self.bot = TelegramBot()
-            
-            logger.info("Запуск Telegram бота...")
-            logger.info("Приложение запущено успешно")
-            logger.info("Telegram бот: активен")
-            
-            # Запускаем бота напрямую (синхронно)
-            self.bot.run()
-                    
+
+            if self.unified:
+                logger.info(f"Запуск Telegram бота и webhook сервера на {WEBHOOK_SERVER_HOST}:{WEBHOOK_SERVER_PORT}...")
+                asyncio.run(self.bot.run_unified(WEBHOOK_SERVER_HOST, WEBHOOK_SERVER_PORT))
+            else:
+                # Webhook сервер n8n работает отдельным процессом (webhook_server.py)
+                logger.info("Запуск Telegram бота...")
+                self.bot.run()
+
+            logger.info("Приложение остановлено")
+
         except Exception as e:
             logger.error(f"Ошибка при запуске приложения: {e}")
             raise
-    
-    async def _run_webhook_server(self):
-        """Запуск webhook сервера"""
-        self.webhook_runner = await run_webhook_server(port=8080)
-        
-        # Ждем бесконечно, пока сервер работает
-        try:
-            while self.running:
-                await asyncio.sleep(1)
-        except asyncio.CancelledError:
-            logger.info("Webhook сервер получил сигнал остановки")
-            raise
-    
-    async def _run_bot(self):
-        """Запуск Telegram бота"""
-        try:
-            # Используем синхронный метод в отдельном потоке
-            import asyncio
-            import concurrent.futures
-            
-            def run_bot_sync():
-                self.bot.application.run_polling(drop_pending_updates=True)
-            
-            # Запускаем в отдельном thread pool
-            loop = asyncio.get_event_loop()
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                await loop.run_in_executor(executor, run_bot_sync)
-                
-        except Exception as e:
-            logger.error(f"Ошибка в Telegram боте: {e}")
-            raise
 
-    async def stop(self):
-        """Остановка приложения"""
-        logger.info("Остановка приложения...")
-        
-        self.running = False
-        
-        # Останавливаем веб-сервер
-        if self.webhook_runner:
-            await self.webhook_runner.cleanup()
-            logger.info("Webhook сервер остановлен")
-        
-        # Бот остановится автоматически при завершении процесса
-        logger.info("Приложение остановлено")
-
-def setup_signal_handlers(app):
-    """Настройка обработчиков сигналов"""
-    
-    def signal_handler(signum, frame):
-        logger.info(f"Получен сигнал {signum}")
-        asyncio.create_task(app.stop())
-    
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
+def parse_args():
+    """Разбор аргументов командной строки"""
+    parser = argparse.ArgumentParser(description="Telegram бот для создания постов")
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=BOT_WORKERS,
+        help="Количество процессов-обработчиков (по умолчанию BOT_WORKERS)"
+    )
+    parser.add_argument(
+        '--unified',
+        action=argparse.BooleanOptionalAction,
+        default=UNIFIED_RUNTIME,
+        help="Бот и webhook сервер n8n в одном процессе (по умолчанию UNIFIED_RUNTIME)"
+    )
+    return parser.parse_args()
 
 def main():
     """Главная функция"""
@@ -99,11 +69,17 @@ def main():
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
         level=logging.INFO
     )
-    
-    app = BotApplication()
-    
+
+    args = parse_args()
+
     try:
-        # Запускаем синхронно БЕЗ asyncio
+        if args.workers > 1:
+            # Один процесс принимает обновления, обработчики - отдельные процессы
+            logger.info(f"Запуск в режиме нескольких процессов: {args.workers}")
+            ShardedBotRuntime(args.workers).run()
+            return
+
+        app = BotApplication(unified=args.unified)
         app.start()
     except KeyboardInterrupt:
         logger.info("Получен сигнал остановки от пользователя")
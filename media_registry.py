@@ -0,0 +1,188 @@
+"""
+Реестр медиафайлов бота: file_id загруженных в Telegram видео и готовые клавиатуры
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from telegram import InlineKeyboardMarkup, Message
+from telegram.error import BadRequest
+
+from config import MEDIA_REGISTRY_PATH
+
+logger = logging.getLogger(__name__)
+
+# Видео с инструкциями
+CHANNEL_ADMIN_VIDEO = 'assets/channeladmin.mp4'
+PINNED_POST_VIDEO = 'assets/pinned.mp4'
+
+# Ошибки BadRequest, означающие, что сохраненный file_id больше не годится
+# (файл другого бота, удален или устарела ссылка на файл). Остальные ошибки
+# (разметка подписи, удаленное сообщение для ответа) повторятся и при загрузке.
+FILE_ID_ERRORS = (
+    'wrong file identifier', 'wrong remote file identifier', 'wrong file_id',
+    'file reference', 'file_reference'
+)
+
+
+def is_file_id_error(error: BadRequest) -> bool:
+    """
+    Проверка, что Telegram отклонил именно file_id
+
+    Args:
+        error (BadRequest): Ошибка Bot API
+
+    Returns:
+        bool: True, если file_id нужно забыть и загрузить файл заново
+    """
+    message = error.message.lower()
+    return any(marker in message for marker in FILE_ID_ERRORS)
+
+
+class MediaRegistry:
+    """
+    Файл загружается в Telegram один раз, дальше отправляется по file_id
+
+    file_id хранится в JSON вместе с sha256 файла: если файл изменился,
+    он загружается заново. Хэш пересчитывается только при изменении
+    размера или времени модификации файла.
+    """
+
+    def __init__(self, path: str = MEDIA_REGISTRY_PATH):
+        """
+        Инициализация реестра
+
+        Args:
+            path (str): JSON файл с сохраненными file_id
+        """
+        self.path = path
+        self._entries: Dict[str, Dict[str, str]] = self._load()
+        self._digests: Dict[str, Tuple[Tuple[int, int], str]] = {}
+        self._upload_locks: Dict[str, asyncio.Lock] = {}
+        self._missing_logged = set()
+        self._keyboards: Dict[str, InlineKeyboardMarkup] = {}
+
+    def _load(self) -> Dict[str, Dict[str, str]]:
+        """Чтение сохраненных file_id"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as registry_file:
+                return json.load(registry_file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать реестр медиа {self.path}, файлы будут загружены заново: {e}")
+            return {}
+
+    def _save(self):
+        """Сохранение file_id (через временный файл, чтобы не оставить битый JSON)"""
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as registry_file:
+                json.dump(self._entries, registry_file, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить реестр медиа {self.path}: {e}")
+
+    def _digest(self, asset_path: str) -> Optional[str]:
+        """
+        sha256 файла
+
+        Args:
+            asset_path (str): Путь к файлу
+
+        Returns:
+            Optional[str]: Хэш или None, если файла нет
+        """
+        try:
+            stat = os.stat(asset_path)
+        except FileNotFoundError:
+            if asset_path not in self._missing_logged:
+                self._missing_logged.add(asset_path)
+                logger.warning(f"Медиафайл {asset_path} не найден, отправляем только текст")
+            return None
+
+        signature = (stat.st_size, stat.st_mtime_ns)
+        cached = self._digests.get(asset_path)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+        sha256 = hashlib.sha256()
+        with open(asset_path, 'rb') as asset_file:
+            for chunk in iter(lambda: asset_file.read(1024 * 1024), b''):
+                sha256.update(chunk)
+
+        digest = sha256.hexdigest()
+        self._digests[asset_path] = (signature, digest)
+        self._missing_logged.discard(asset_path)
+        return digest
+
+    def _get_file_id(self, asset_path: str, digest: str) -> Optional[str]:
+        entry = self._entries.get(asset_path)
+        if entry and entry.get('sha256') == digest:
+            return entry.get('file_id')
+        return None
+
+    async def send_video(self, send: Callable[..., Awaitable[Message]], asset_path: str,
+                         **kwargs: Any) -> Optional[Message]:
+        """
+        Отправка видео: по file_id, а если его нет - загрузкой файла
+
+        Args:
+            send (Callable): Метод отправки видео (message.reply_video, chat.send_video и т.д.)
+            asset_path (str): Путь к видео
+            **kwargs: Остальные параметры отправки (caption, reply_markup, parse_mode)
+
+        Returns:
+            Optional[Message]: Отправленное сообщение или None, если файла нет
+                (тогда вызывающий отправляет только текст)
+        """
+        digest = self._digest(asset_path)
+        if digest is None:
+            return None
+
+        file_id = self._get_file_id(asset_path, digest)
+        if file_id:
+            try:
+                return await send(video=file_id, **kwargs)
+            except BadRequest as e:
+                if not is_file_id_error(e):
+                    raise
+                # file_id другого бота или удаленный файл - загружаем заново
+                logger.warning(f"file_id для {asset_path} не принят Telegram, загружаем файл заново: {e}")
+                self._entries.pop(asset_path, None)
+
+        lock = self._upload_locks.setdefault(asset_path, asyncio.Lock())
+        async with lock:
+            # Пока ждали, файл мог загрузить параллельный запрос
+            file_id = self._get_file_id(asset_path, digest)
+            if file_id:
+                return await send(video=file_id, **kwargs)
+
+            with open(asset_path, 'rb') as video_file:
+                message = await send(video=video_file, **kwargs)
+
+            if message.video:
+                self._entries[asset_path] = {'sha256': digest, 'file_id': message.video.file_id}
+                self._save()
+                logger.info(f"Видео {asset_path} загружено в Telegram, дальше отправляется по file_id")
+
+        return message
+
+    def keyboard(self, name: str, build: Callable[[], InlineKeyboardMarkup]) -> InlineKeyboardMarkup:
+        """
+        Готовая клавиатура (объекты клавиатур неизменяемы, одну можно отправлять всем)
+
+        Args:
+            name (str): Имя клавиатуры
+            build (Callable): Построение клавиатуры при первом обращении
+
+        Returns:
+            InlineKeyboardMarkup: Клавиатура
+        """
+        markup = self._keyboards.get(name)
+        if markup is None:
+            markup = self._keyboards[name] = build()
+        return markup
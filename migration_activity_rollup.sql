@@ -0,0 +1,63 @@
+-- Миграция: Пакетная запись активности пользователей
+-- Запустить в Supabase SQL Editor
+-- Описание: Бот больше не обновляет button_users.last_activity на каждое сообщение.
+-- Активность копится в памяти и периодически записывается одним вызовом
+-- button_flush_activity в дневную сводную таблицу. Строка button_users
+-- обновляется, только если last_activity отстала больше чем на 15 минут.
+
+CREATE TABLE IF NOT EXISTS button_user_activity_daily (
+    telegram_id BIGINT NOT NULL,
+    activity_date DATE NOT NULL,
+    events INTEGER NOT NULL DEFAULT 0,
+    first_seen_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    last_seen_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    PRIMARY KEY (telegram_id, activity_date)
+);
+
+COMMENT ON TABLE button_user_activity_daily IS 'Дневная сводка активности пользователей бота';
+COMMENT ON COLUMN button_user_activity_daily.events IS 'Количество сообщений и нажатий кнопок за день';
+
+-- p_activity: [{"telegram_id": 1, "activity_date": "2024-01-01", "events": 3,
+--               "first_seen_at": "...", "last_seen_at": "..."}, ...]
+CREATE OR REPLACE FUNCTION button_flush_activity(p_activity JSONB)
+RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    INSERT INTO button_user_activity_daily AS d
+        (telegram_id, activity_date, events, first_seen_at, last_seen_at)
+    SELECT
+        (a->>'telegram_id')::BIGINT,
+        (a->>'activity_date')::DATE,
+        (a->>'events')::INTEGER,
+        (a->>'first_seen_at')::TIMESTAMPTZ,
+        (a->>'last_seen_at')::TIMESTAMPTZ
+    FROM jsonb_array_elements(p_activity) AS a
+    ON CONFLICT (telegram_id, activity_date) DO UPDATE SET
+        events = d.events + EXCLUDED.events,
+        first_seen_at = LEAST(d.first_seen_at, EXCLUDED.first_seen_at),
+        last_seen_at = GREATEST(d.last_seen_at, EXCLUDED.last_seen_at);
+
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+
+    -- last_activity в button_users нужна с точностью до минут: обновляем
+    -- только отставшие строки, чтобы не плодить версии строк и срабатывания триггера
+    UPDATE button_users AS u
+    SET last_activity = v.last_seen_at
+    FROM (
+        SELECT (a->>'telegram_id')::BIGINT AS telegram_id,
+               MAX((a->>'last_seen_at')::TIMESTAMPTZ) AS last_seen_at
+        FROM jsonb_array_elements(p_activity) AS a
+        GROUP BY 1
+    ) AS v
+    WHERE u.telegram_id = v.telegram_id
+      AND (u.last_activity IS NULL OR u.last_activity < v.last_seen_at - INTERVAL '15 minutes');
+
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON FUNCTION button_flush_activity(JSONB) IS 'Пакетная запись активности пользователей в дневную сводку';
+
+-- Проверочный запрос
+-- SELECT * FROM button_user_activity_daily ORDER BY last_seen_at DESC LIMIT 10;
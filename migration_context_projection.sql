@@ -0,0 +1,66 @@
+-- Миграция: Снимок контекста только с нужными колонками
+-- Запустить в Supabase SQL Editor (после migration_context_snapshot.sql)
+-- Описание: button_get_context_snapshot вызывается на каждое сообщение и нажатие
+-- кнопки. Вместо целых строк функция теперь возвращает пользователя в проекции
+-- 'profile' и сессию в проекции 'routing' (см. USER_PROJECTIONS и
+-- SESSION_PROJECTIONS в database.py): ответы, материалы и текст поста бот
+-- дочитывает отдельно, когда они действительно нужны.
+
+CREATE OR REPLACE FUNCTION button_get_context_snapshot(
+    p_telegram_id BIGINT,
+    p_touch BOOLEAN DEFAULT TRUE
+)
+RETURNS JSON AS $$
+DECLARE
+    v_user JSON;
+    v_session JSON;
+BEGIN
+    IF p_touch THEN
+        UPDATE button_users
+        SET last_activity = NOW()
+        WHERE telegram_id = p_telegram_id;
+    END IF;
+
+    SELECT json_build_object(
+        'id', id,
+        'email', email,
+        'telegram_id', telegram_id,
+        'username', username,
+        'first_name', first_name,
+        'last_name', last_name,
+        'registration_step', registration_step,
+        'channel_url', channel_url,
+        'is_bot_admin', is_bot_admin,
+        'post_count', post_count
+    ) INTO v_user
+    FROM button_users
+    WHERE telegram_id = p_telegram_id;
+
+    IF v_user IS NULL THEN
+        RETURN json_build_object('user', NULL, 'session', NULL);
+    END IF;
+
+    SELECT json_build_object(
+        'id', id,
+        'telegram_id', telegram_id,
+        'session_status', session_status,
+        'created_at', created_at
+    ) INTO v_session
+    FROM button_post_creation_sessions
+    WHERE telegram_id = p_telegram_id
+      AND session_status IN (
+          'started', 'question_1', 'question_2', 'question_3', 'question_4', 'question_5',
+          'collecting_links', 'generating', 'reviewing', 'button_type_selection',
+          'button_config', 'button_text_selection', 'final_review'
+      )
+    ORDER BY created_at DESC
+    LIMIT 1;
+
+    RETURN json_build_object('user', v_user, 'session', v_session);
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON FUNCTION button_get_context_snapshot(BIGINT, BOOLEAN) IS 'Пользователь (profile) и его активная сессия (routing) за один запрос';
+
+-- Проверочный запрос
+-- SELECT button_get_context_snapshot(123456789, FALSE);
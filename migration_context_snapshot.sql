@@ -0,0 +1,53 @@
+-- Миграция: Снимок контекста пользователя за один запрос
+-- Запустить в Supabase SQL Editor
+-- Описание: Функция обновляет last_activity и возвращает строку пользователя
+-- вместе с последней активной сессией создания поста. Заменяет три отдельных
+-- запроса (update_last_activity, get_user_by_telegram_id, get_active_post_session)
+-- на каждое входящее сообщение или нажатие кнопки.
+
+CREATE OR REPLACE FUNCTION button_get_context_snapshot(
+    p_telegram_id BIGINT,
+    p_touch BOOLEAN DEFAULT TRUE
+)
+RETURNS JSON AS $$
+DECLARE
+    v_user button_users%ROWTYPE;
+    v_session button_post_creation_sessions%ROWTYPE;
+BEGIN
+    IF p_touch THEN
+        UPDATE button_users
+        SET last_activity = NOW()
+        WHERE telegram_id = p_telegram_id
+        RETURNING * INTO v_user;
+    ELSE
+        SELECT * INTO v_user
+        FROM button_users
+        WHERE telegram_id = p_telegram_id;
+    END IF;
+
+    IF NOT FOUND THEN
+        RETURN json_build_object('user', NULL, 'session', NULL);
+    END IF;
+
+    SELECT * INTO v_session
+    FROM button_post_creation_sessions
+    WHERE telegram_id = p_telegram_id
+      AND session_status IN (
+          'started', 'question_1', 'question_2', 'question_3', 'question_4', 'question_5',
+          'collecting_links', 'generating', 'reviewing', 'button_type_selection',
+          'button_config', 'button_text_selection', 'final_review'
+      )
+    ORDER BY created_at DESC
+    LIMIT 1;
+
+    RETURN json_build_object(
+        'user', row_to_json(v_user),
+        'session', CASE WHEN FOUND THEN row_to_json(v_session) END
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON FUNCTION button_get_context_snapshot(BIGINT, BOOLEAN) IS 'Пользователь и его активная сессия за один запрос (с обновлением last_activity)';
+
+-- Проверочный запрос
+-- SELECT button_get_context_snapshot(123456789);
@@ -0,0 +1,22 @@
+-- Миграция: Индекс для проверки таймаута генерации постов
+-- Запустить в Supabase SQL Editor
+-- Описание: Бот раз в GENERATION_SWEEP_INTERVAL секунд ищет сессии, которые
+-- находятся в статусе generating дольше GENERATION_TIMEOUT, по условию
+-- session_status = 'generating' AND n8n_webhook_sent_at < <время>. Частичный
+-- индекс содержит только такие сессии, поэтому запрос не зависит от общего
+-- числа сессий в таблице.
+
+CREATE INDEX IF NOT EXISTS idx_button_post_sessions_generating
+    ON button_post_creation_sessions (n8n_webhook_sent_at)
+    WHERE session_status = 'generating';
+
+-- Сессии, отправленные в n8n до этой миграции, не имеют отметки времени:
+-- берем время последнего изменения, чтобы проверка таймаута их тоже нашла
+UPDATE button_post_creation_sessions
+SET n8n_webhook_sent_at = updated_at
+WHERE session_status = 'generating'
+  AND n8n_webhook_sent_at IS NULL;
+
+-- Проверочный запрос
+-- EXPLAIN SELECT id FROM button_post_creation_sessions
+-- WHERE session_status = 'generating' AND n8n_webhook_sent_at < NOW() - INTERVAL '3 minutes';
@@ -0,0 +1,63 @@
+-- Миграция: Атомарное списание лимита постов
+-- Запустить в Supabase SQL Editor
+-- Описание: Счетчик post_count увеличивается одним условным UPDATE, который
+-- не даст превысить лимит даже при параллельных публикациях. Функция сразу
+-- возвращает новое значение счетчика и остаток.
+
+-- Списание одного поста из лимита пользователя
+-- Возвращает: {"consumed": bool, "current_count": int, "remaining": int, "max_posts": int}
+CREATE OR REPLACE FUNCTION button_consume_post_quota(
+    p_telegram_id BIGINT,
+    p_max_posts INTEGER DEFAULT 3
+)
+RETURNS JSON AS $$
+DECLARE
+    v_count INTEGER;
+    v_consumed BOOLEAN := TRUE;
+BEGIN
+    UPDATE button_users
+    SET post_count = post_count + 1
+    WHERE telegram_id = p_telegram_id
+      AND post_count < p_max_posts
+    RETURNING post_count INTO v_count;
+
+    IF NOT FOUND THEN
+        -- Лимит исчерпан (или пользователь не найден) - просто читаем текущее значение
+        v_consumed := FALSE;
+        SELECT post_count INTO v_count
+        FROM button_users
+        WHERE telegram_id = p_telegram_id;
+        v_count := COALESCE(v_count, 0);
+    END IF;
+
+    RETURN json_build_object(
+        'consumed', v_consumed,
+        'current_count', v_count,
+        'remaining', GREATEST(0, p_max_posts - v_count),
+        'max_posts', p_max_posts
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Возврат списанного поста (если публикация не удалась)
+-- Возвращает: новое значение post_count
+CREATE OR REPLACE FUNCTION button_release_post_quota(p_telegram_id BIGINT)
+RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    UPDATE button_users
+    SET post_count = post_count - 1
+    WHERE telegram_id = p_telegram_id
+      AND post_count > 0
+    RETURNING post_count INTO v_count;
+
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON FUNCTION button_consume_post_quota(BIGINT, INTEGER) IS 'Атомарное списание поста из лимита пользователя';
+COMMENT ON FUNCTION button_release_post_quota(BIGINT) IS 'Возврат поста в лимит пользователя после неудачной публикации';
+
+-- Проверочный запрос
+-- SELECT button_consume_post_quota(123456789, 3);
@@ -3,15 +3,23 @@
 """
 import logging
 import asyncio
+import time
 from typing import Optional, Dict, Any
 import aiohttp
 from config import N8N_WEBHOOK_URL
+from http_client import HTTPClientManager
 
 logger = logging.getLogger(__name__)
 
 class N8NClient:
-    def __init__(self):
-        """Инициализация клиента n8n"""
+    def __init__(self, http: Optional[HTTPClientManager] = None):
+        """
+        Инициализация клиента n8n
+        
+        Args:
+            http (Optional[HTTPClientManager]): Общий HTTP клиент приложения
+        """
+        self.http = http or HTTPClientManager()
         self.webhook_url = N8N_WEBHOOK_URL
         if not self.webhook_url:
             logger.warning("N8N_WEBHOOK_URL не установлен")
@@ -65,24 +73,27 @@ class N8NClient:
                 "materials": filtered_materials,  # Массив строк "описание + ссылка" (до 5 штук)
                 "request_type": "generate_post",
                 "session_id": session_id,
+                # n8n возвращает attempt в ответе: повторная доставка того же
+                # ответа отбрасывается, а новая генерация в сессии - нет
+                "attempt": time.time_ns() // 1_000_000,
                 "timestamp": asyncio.get_event_loop().time()
             }
 
             timeout = aiohttp.ClientTimeout(total=10)
             
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.post(
-                    self.webhook_url,
-                    json=payload,
-                    headers={'Content-Type': 'application/json'}
-                ) as response:
-                    
-                    if response.status == 200:
-                        logger.info(f"Запрос на генерацию поста отправлен успешно для пользователя {user_data.get('telegram_id')}")
-                        return True
-                    else:
-                        logger.error(f"Ошибка при отправке запроса в n8n: {response.status}")
-                        return False
+            async with self.http.session.post(
+                self.webhook_url,
+                json=payload,
+                headers={'Content-Type': 'application/json'},
+                timeout=timeout
+            ) as response:
+                
+                if response.status == 200:
+                    logger.info(f"Запрос на генерацию поста отправлен успешно для пользователя {user_data.get('telegram_id')}")
+                    return True
+                else:
+                    logger.error(f"Ошибка при отправке запроса в n8n: {response.status}")
+                    return False
 
         except asyncio.TimeoutError:
             logger.error("Таймаут при отправке запроса в n8n")
@@ -118,15 +129,15 @@ class N8NClient:
 
             timeout = aiohttp.ClientTimeout(total=5)
             
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.post(
-                    self.webhook_url,
-                    json=payload,
-                    headers={'Content-Type': 'application/json'}
-                ) as response:
-                    
-                    logger.info(f"Уведомление о таймауте отправлено для пользователя {user_data.get('telegram_id')}")
-                    return response.status == 200
+            async with self.http.session.post(
+                self.webhook_url,
+                json=payload,
+                headers={'Content-Type': 'application/json'},
+                timeout=timeout
+            ) as response:
+                
+                logger.info(f"Уведомление о таймауте отправлено для пользователя {user_data.get('telegram_id')}")
+                return response.status == 200
 
         except Exception as e:
             logger.error(f"Ошибка при отправке уведомления о таймауте: {e}")
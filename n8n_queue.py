@@ -0,0 +1,168 @@
+"""
+Очередь ответов n8n: прием подтверждается сразу, обработка идет в фоне
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List
+
+from webhook_handler import WebhookHandler
+from config import N8N_QUEUE_SIZE, N8N_QUEUE_WORKERS, N8N_QUEUE_MAX_RETRIES, N8N_QUEUE_RETRY_DELAY
+
+logger = logging.getLogger(__name__)
+
+
+class N8NResultQueue:
+    """
+    Ограниченная очередь в памяти процесса и пул обработчиков
+
+    Запрос n8n не ждет обращений к базе и Telegram: ответ ставится в очередь,
+    и n8n сразу получает 202. Если очередь заполнена, n8n получает 503 и
+    может повторить запрос позже. После 202 n8n ответ уже не повторит,
+    поэтому временные ошибки обработки повторяются здесь, с растущей паузой.
+    """
+
+    def __init__(self, handler: WebhookHandler, max_size: int = N8N_QUEUE_SIZE,
+                 workers: int = N8N_QUEUE_WORKERS, max_retries: int = N8N_QUEUE_MAX_RETRIES,
+                 retry_delay: float = N8N_QUEUE_RETRY_DELAY):
+        """
+        Инициализация очереди
+
+        Args:
+            handler (WebhookHandler): Обработчик ответов n8n
+            max_size (int): Максимальная длина очереди
+            workers (int): Количество параллельных обработчиков
+            max_retries (int): Сколько раз повторять обработку после временной ошибки
+            retry_delay (float): Пауза перед первым повтором (дальше удваивается)
+        """
+        self.handler = handler
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._queue: asyncio.Queue = asyncio.Queue(max_size)
+        self._tasks: List[asyncio.Task] = []
+
+        self._accepted = 0
+        self._rejected = 0
+        self._processed = 0
+        self._failed = 0
+        self._retried = 0
+        self._last_lag = 0.0
+        self._max_lag = 0.0
+
+    def start(self):
+        """Запуск обработчиков"""
+        for index in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"n8n-worker-{index}"))
+        logger.info(f"Очередь ответов n8n запущена (обработчиков: {self.workers}, размер: {self._queue.maxsize})")
+
+    async def stop(self, timeout: float = 30):
+        """
+        Остановка: дообработка принятых ответов, затем отмена обработчиков
+
+        Args:
+            timeout (float): Сколько ждать обработки оставшихся ответов
+        """
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не обработано ответов n8n при остановке: {self._queue.qsize()}")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Очередь ответов n8n остановлена")
+
+    def submit(self, data: Dict[str, Any]) -> bool:
+        """
+        Постановка ответа n8n в очередь
+
+        Args:
+            data (Dict): Данные от n8n
+
+        Returns:
+            bool: False, если очередь заполнена
+        """
+        try:
+            self._queue.put_nowait((time.monotonic(), data))
+        except asyncio.QueueFull:
+            self._rejected += 1
+            logger.warning(f"Очередь ответов n8n заполнена ({self._queue.maxsize}), ответ отклонен")
+            return False
+
+        self._accepted += 1
+        return True
+
+    async def _worker(self):
+        """Обработка ответов из очереди"""
+        while True:
+            enqueued_at, data = await self._queue.get()
+            try:
+                lag = time.monotonic() - enqueued_at
+                self._last_lag = lag
+                if lag > self._max_lag:
+                    self._max_lag = lag
+
+                result = await self._handle_with_retries(data)
+                if result.get('status') == 'success':
+                    self._processed += 1
+                else:
+                    self._failed += 1
+                    logger.error(f"Ответ n8n для пользователя {data.get('telegram_id')} не обработан: {result.get('message')}")
+
+            except Exception as e:
+                self._failed += 1
+                logger.error(f"Ошибка при обработке ответа n8n из очереди: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _handle_with_retries(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Обработка ответа с повторами после временных ошибок
+
+        Args:
+            data (Dict): Данные от n8n
+
+        Returns:
+            Dict: Результат последней попытки
+        """
+        delay = self.retry_delay
+        for attempt in range(self.max_retries + 1):
+            try:
+                result = await self.handler.handle_n8n_response(data)
+            except Exception as e:
+                result = {"status": "retry", "message": str(e)}
+
+            if result.get('status') != 'retry' or attempt == self.max_retries:
+                return result
+
+            self._retried += 1
+            logger.warning(f"Временная ошибка при обработке ответа n8n для пользователя "
+                           f"{data.get('telegram_id')}, повтор через {delay} с: {result.get('message')}")
+            await asyncio.sleep(delay)
+            delay *= 2
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Метрики очереди
+
+        Returns:
+            Dict: Глубина и размер очереди, число обработчиков, принято, отклонено
+                (очередь заполнена), обработано, с ошибкой, повторов после временных
+                ошибок и задержка от приема до начала обработки (последняя и
+                максимальная, секунды)
+        """
+        return {
+            'depth': self._queue.qsize(),
+            'max_size': self._queue.maxsize,
+            'workers': self.workers,
+            'accepted': self._accepted,
+            'rejected': self._rejected,
+            'processed': self._processed,
+            'failed': self._failed,
+            'retried': self._retried,
+            'last_lag': round(self._last_lag, 3),
+            'max_lag': round(self._max_lag, 3)
+        }
@@ -0,0 +1,377 @@
+"""
+Бэкенд базы данных с прямым подключением к Postgres через asyncpg
+"""
+import asyncio
+import json
+import logging
+import random
+import time
+from datetime import date, datetime
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable
+
+import asyncpg
+
+from config import (
+    DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, USER_LOCK_MODE, USER_LOCK_POOL_SIZE
+)
+from database import (
+    Database, UserLockTimeout, ACTIVE_SESSION_STATUSES, NEXT_STATUS_AFTER_ANSWER,
+    USER_PROJECTIONS, SESSION_PROJECTIONS, projection_select
+)
+
+logger = logging.getLogger(__name__)
+
+# Тексты запросов неизменны, поэтому asyncpg готовит каждый из них один раз
+# на соединение (prepared statement cache) и дальше только передает параметры
+# Для каждой проекции свой текст запроса
+USER_BY_TELEGRAM_ID_SQL = {
+    projection: (
+        f"SELECT {projection_select(USER_PROJECTIONS, projection)} "
+        f"FROM button_users WHERE telegram_id = $1"
+    )
+    for projection in ['full', *USER_PROJECTIONS]
+}
+
+ACTIVE_SESSION_SQL = {
+    projection: (
+        f"SELECT {projection_select(SESSION_PROJECTIONS, projection)} "
+        f"FROM button_post_creation_sessions "
+        f"WHERE telegram_id = $1 AND session_status = ANY($2::text[]) "
+        f"ORDER BY created_at DESC LIMIT 1"
+    )
+    for projection in ['full', *SESSION_PROJECTIONS]
+}
+
+CONTEXT_SNAPSHOT_SQL = "SELECT button_get_context_snapshot($1, FALSE)"
+
+FLUSH_ACTIVITY_SQL = "SELECT button_flush_activity($1::jsonb)"
+
+# Advisory lock пользователя: ключ из двух int4 - пространство имен бота
+# и хэш telegram_id (совпадение хэшей лишь иногда сериализует двух пользователей)
+USER_LOCK_NAMESPACE = 0x42544E  # 'BTN'
+TRY_USER_LOCK_SQL = "SELECT pg_try_advisory_lock($1, hashtext($2))"
+USER_UNLOCK_SQL = "SELECT pg_advisory_unlock($1, hashtext($2))"
+
+# Пауза между попытками получить advisory lock (растет вдвое до максимума)
+USER_LOCK_RETRY_DELAY = 0.05
+USER_LOCK_MAX_RETRY_DELAY = 1.0
+
+# Отдельный запрос на каждую колонку ответа - имя колонки нельзя передать параметром
+UPDATE_SESSION_ANSWER_SQL = {
+    number: (
+        f"UPDATE button_post_creation_sessions "
+        f"SET answer_{number} = $2, session_status = COALESCE($3, session_status) "
+        f"WHERE id = $1 RETURNING *"
+    )
+    for number in range(1, 7)
+}
+
+COMPLETE_GENERATION_SQL = (
+    "UPDATE button_post_creation_sessions "
+    "SET session_status = 'reviewing', generated_post = $3 "
+    "WHERE id = $1 AND telegram_id = $2 AND session_status = 'generating' "
+    "RETURNING *"
+)
+
+
+def _record_to_dict(record: asyncpg.Record) -> Dict[str, Any]:
+    """
+    Преобразование строки asyncpg в словарь в том же виде, что отдает PostgREST
+
+    Args:
+        record (asyncpg.Record): Строка результата
+
+    Returns:
+        Dict: Данные строки (даты в формате ISO 8601)
+    """
+    data = dict(record)
+    for key, value in data.items():
+        if isinstance(value, (datetime, date)):
+            data[key] = value.isoformat()
+    return data
+
+
+class PostgresDatabase(Database):
+    """
+    Database, в котором запросы горячего пути идут напрямую в Postgres
+    через пул соединений asyncpg. Остальные методы наследуются и работают
+    через Supabase.
+    """
+
+    def __init__(self):
+        """Инициализация бэкенда asyncpg"""
+        super().__init__()
+
+        if not DATABASE_URL:
+            raise ValueError("DATABASE_URL должен быть установлен для DB_BACKEND=asyncpg")
+
+        self._pool: Optional[asyncpg.Pool] = None
+        self._lock_pool: Optional[asyncpg.Pool] = None
+        self._pool_lock = asyncio.Lock()
+
+    async def _get_pool(self) -> asyncpg.Pool:
+        """
+        Получение пула соединений (создается при первом обращении)
+
+        Returns:
+            asyncpg.Pool: Пул соединений с Postgres
+        """
+        if self._pool is None:
+            async with self._pool_lock:
+                if self._pool is None:
+                    self._pool = await asyncpg.create_pool(
+                        DATABASE_URL,
+                        min_size=DB_POOL_MIN_SIZE,
+                        max_size=DB_POOL_MAX_SIZE
+                    )
+                    logger.info("Пул соединений asyncpg создан")
+        return self._pool
+
+    async def _get_lock_pool(self) -> asyncpg.Pool:
+        """
+        Пул соединений для advisory lock (создается при первой блокировке)
+
+        Соединение удерживается все время, пока пользователь заблокирован, поэтому
+        блокировки берут соединения из своего пула: сколько бы их ни было, запросы
+        горячего пути не ждут освобождения соединения в основном пуле.
+
+        Returns:
+            asyncpg.Pool: Пул соединений для блокировок
+        """
+        if self._lock_pool is None:
+            async with self._pool_lock:
+                if self._lock_pool is None:
+                    self._lock_pool = await asyncpg.create_pool(
+                        DATABASE_URL,
+                        min_size=0,
+                        max_size=USER_LOCK_POOL_SIZE
+                    )
+                    logger.info("Пул соединений asyncpg для блокировок пользователей создан")
+        return self._lock_pool
+
+    async def close(self):
+        """Закрытие пула соединений и пула запросов Supabase"""
+        # Сначала последняя запись активности - она идет через пул asyncpg
+        await super().close()
+
+        if self._lock_pool is not None:
+            await self._lock_pool.close()
+            self._lock_pool = None
+
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+            logger.info("Пул соединений asyncpg закрыт")
+
+    async def _acquire_user_lock(self, telegram_id: int,
+                                 deadline: float) -> Tuple[Callable[[], Awaitable[None]], bool]:
+        """
+        Получение блокировки пользователя, общей для всех реплик бота
+
+        Сначала берется блокировка в пределах процесса (чтобы обработчики одного
+        процесса не занимали соединения ожиданием), затем session-level advisory
+        lock на соединении из пула блокировок. Соединение удерживается до
+        освобождения блокировки; при обрыве соединения Postgres снимает ее сам.
+
+        Args:
+            telegram_id (int): Telegram ID пользователя
+            deadline (float): Момент (time.monotonic), после которого ждать нельзя
+
+        Returns:
+            Tuple: Функция освобождения блокировки и признак того, что пришлось ждать
+
+        Raises:
+            UserLockTimeout: Блокировку не удалось получить до deadline
+        """
+        release_local, contended = await super()._acquire_user_lock(telegram_id, deadline)
+        if USER_LOCK_MODE != 'advisory':
+            return release_local, contended
+
+        key = str(telegram_id)
+        connection = None
+
+        try:
+            pool = await self._get_lock_pool()
+            connection = await pool.acquire(timeout=max(0.1, deadline - time.monotonic()))
+            delay = USER_LOCK_RETRY_DELAY
+
+            while not await connection.fetchval(TRY_USER_LOCK_SQL, USER_LOCK_NAMESPACE, key):
+                contended = True
+                if time.monotonic() + delay > deadline:
+                    raise UserLockTimeout(telegram_id)
+
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+                delay = min(delay * 2, USER_LOCK_MAX_RETRY_DELAY)
+
+        except asyncio.TimeoutError:
+            # Свободное соединение в пуле блокировок не появилось до deadline
+            if connection is not None:
+                await pool.release(connection)
+            await release_local()
+            raise UserLockTimeout(telegram_id)
+
+        except BaseException:
+            if connection is not None:
+                await pool.release(connection)
+            await release_local()
+            raise
+
+        async def release():
+            try:
+                await connection.fetchval(USER_UNLOCK_SQL, USER_LOCK_NAMESPACE, key)
+            except Exception as e:
+                logger.error(f"Ошибка при снятии блокировки пользователя {telegram_id}: {e}")
+            finally:
+                await pool.release(connection)
+                await release_local()
+
+        return release, contended
+
+    async def _fetch_user_by_telegram_id(self, telegram_id: int,
+                                         projection: str = 'full') -> Optional[Dict[str, Any]]:
+        """
+        Чтение пользователя по Telegram ID из базы в обход кэша
+
+        Args:
+            telegram_id (int): Telegram ID пользователя
+            projection (str): Набор колонок из USER_PROJECTIONS
+
+        Returns:
+            Optional[Dict]: Данные пользователя или None
+        """
+        try:
+            pool = await self._get_pool()
+            record = await pool.fetchrow(USER_BY_TELEGRAM_ID_SQL[projection], telegram_id)
+
+            if record:
+                return _record_to_dict(record)
+            return None
+
+        except Exception as e:
+            logger.error(f"Ошибка при получении пользователя по telegram_id {telegram_id}: {e}")
+            raise
+
+    async def _write_activity(self, activity: List[Dict[str, Any]]) -> int:
+        """
+        Вызов функции button_flush_activity
+
+        Args:
+            activity (List[Dict]): Строки дневной сводки активности
+
+        Returns:
+            int: Количество записанных строк
+        """
+        pool = await self._get_pool()
+        return await pool.fetchval(FLUSH_ACTIVITY_SQL, json.dumps(activity)) or 0
+
+    async def _fetch_context_snapshot(self, telegram_id: int) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Вызов функции button_get_context_snapshot
+
+        Args:
+            telegram_id (int): Telegram ID пользователя
+
+        Returns:
+            Dict: {'user': данные пользователя или None, 'session': активная сессия или None}
+        """
+        try:
+            pool = await self._get_pool()
+            raw = await pool.fetchval(CONTEXT_SNAPSHOT_SQL, telegram_id)
+
+            # Функция возвращает json, который asyncpg отдает строкой
+            data = json.loads(raw) if raw else {}
+            return {
+                'user': data.get('user'),
+                'session': data.get('session')
+            }
+
+        except Exception as e:
+            logger.error(f"Ошибка при получении контекста пользователя {telegram_id}: {e}")
+            raise
+
+    async def _fetch_active_post_session(self, telegram_id: int,
+                                         projection: str = 'full') -> Optional[Dict[str, Any]]:
+        """
+        Чтение активной сессии из базы в обход кэша
+
+        Args:
+            telegram_id (int): Telegram ID пользователя
+            projection (str): Набор колонок из SESSION_PROJECTIONS
+
+        Returns:
+            Optional[Dict]: Данные активной сессии или None
+        """
+        pool = await self._get_pool()
+        record = await pool.fetchrow(
+            ACTIVE_SESSION_SQL[projection], telegram_id, ACTIVE_SESSION_STATUSES
+        )
+
+        if record:
+            return _record_to_dict(record)
+        return None
+
+    async def update_session_answer(self, session_id: int, answer_number: int, answer: str) -> bool:
+        """
+        Обновление ответа на вопрос в сессии
+
+        Args:
+            session_id (int): ID сессии
+            answer_number (int): Номер вопроса (1, 2, 3, 4, 5)
+            answer (str): Ответ пользователя
+
+        Returns:
+            bool: True если обновление успешно
+        """
+        try:
+            query = UPDATE_SESSION_ANSWER_SQL.get(answer_number)
+            if not query:
+                logger.error(f"Неверный номер вопроса: {answer_number}")
+                return False
+
+            pool = await self._get_pool()
+            record = await pool.fetchrow(
+                query, session_id, answer, NEXT_STATUS_AFTER_ANSWER.get(answer_number)
+            )
+
+            if record:
+                self._cache_session_row(_record_to_dict(record))
+                logger.info(f"Обновлен ответ {answer_number} в сессии {session_id}")
+                return True
+            return False
+
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении ответа {answer_number} в сессии {session_id}: {e}")
+            return False
+
+    async def complete_session_generation(self, session_id: int, telegram_id: int,
+                                          generated_post: str) -> Optional[Dict[str, Any]]:
+        """
+        Сохранение сгенерированного поста и перевод сессии в 'reviewing'
+
+        Args:
+            session_id (int): ID сессии
+            telegram_id (int): Telegram ID владельца сессии
+            generated_post (str): Сгенерированный пост
+
+        Returns:
+            Optional[Dict]: Обновленная сессия или None, если сессия не в статусе 'generating'
+
+        Raises:
+            Exception: Ошибка базы - пост не сохранен, ответ можно обработать повторно
+        """
+        try:
+            pool = await self._get_pool()
+            record = await pool.fetchrow(COMPLETE_GENERATION_SQL, session_id, telegram_id, generated_post)
+
+            if record:
+                session = _record_to_dict(record)
+                self._cache_session_row(session)
+                logger.info(f"Пост сохранен в сессии {session_id}, статус: reviewing")
+                return session
+
+            logger.info(f"Сессия {session_id} пользователя {telegram_id} не ожидает генерации, ответ n8n пропущен")
+            return None
+
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении поста в сессии {session_id}: {e}")
+            raise
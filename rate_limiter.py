@@ -0,0 +1,279 @@
+"""
+Ограничение частоты исходящих вызовов Bot API
+
+Telegram допускает около 30 сообщений в секунду на бота, около одного
+сообщения в секунду в личный чат и около 20 в минуту в группу или канал.
+При превышении приходит RetryAfter, и все обработчики встают на паузу.
+Здесь запросы заранее распределяются по корзинам токенов: общей и по чатам,
+а ожидание общей корзины идет в порядке приоритета.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Callable, Coroutine, Dict, List, Optional
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from config import (
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_PRIVATE_CHAT_RATE,
+    TELEGRAM_GROUP_CHAT_RATE,
+    TELEGRAM_RATE_MAX_RETRIES
+)
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета (меньше - раньше): ответы пользователю, фоновые
+# сообщения бота (таймауты генерации), уведомления администратору
+PRIORITY_USER = 0
+PRIORITY_SYSTEM = 1
+PRIORITY_ADMIN = 2
+
+# Личный чат выдерживает короткую серию сообщений (текст, видео, кнопки подряд)
+PRIVATE_CHAT_BURST = 3
+
+# Сколько хранить корзину чата без запросов (секунды)
+CHAT_BUCKET_IDLE_TTL = 60
+
+# Методы, которые отправляют сообщение в чат (кроме send*): лимиты чата
+# считаются только для них. Остальные вызовы (getChatMember, editMessageText,
+# deleteMessage, answerCallbackQuery) идут только через общую корзину.
+MESSAGE_ENDPOINTS = {'copyMessage', 'copyMessages', 'forwardMessage', 'forwardMessages'}
+
+
+def is_message_endpoint(endpoint: str) -> bool:
+    """
+    Проверка, что метод Bot API отправляет сообщение в чат
+
+    Args:
+        endpoint (str): Имя метода (sendMessage, getChatMember, ...)
+
+    Returns:
+        bool: True для send* (кроме sendChatAction), copy* и forward*
+    """
+    if endpoint.startswith('send'):
+        return endpoint != 'sendChatAction'
+    return endpoint in MESSAGE_ENDPOINTS
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше burst про запас"""
+
+    def __init__(self, rate: float, burst: float):
+        """
+        Инициализация корзины
+
+        Args:
+            rate (float): Токенов в секунду
+            burst (float): Емкость корзины
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_consume(self) -> float:
+        """
+        Взять токен, если он есть
+
+        Returns:
+            float: 0 - токен взят, иначе сколько секунд ждать следующего
+        """
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def reserve(self) -> float:
+        """
+        Зарезервировать токен (в долг, очередь по порядку вызова)
+
+        Returns:
+            float: Сколько секунд ждать до зарезервированного токена
+        """
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class TelegramRateLimiter(BaseRateLimiter[int]):
+    """
+    Общая корзина на бота, корзины по чатам, приоритеты и повтор после RetryAfter
+
+    Подключается к Application через ApplicationBuilder.rate_limiter().
+    Приоритет вызова передается через rate_limit_args (например,
+    bot.send_message(..., rate_limit_args=PRIORITY_SYSTEM)), по умолчанию
+    PRIORITY_USER. Запросы не из PTB (AdminNotifier) используют acquire()
+    и pause() напрямую.
+    """
+
+    def __init__(self, global_rate: float = TELEGRAM_GLOBAL_RATE,
+                 private_chat_rate: float = TELEGRAM_PRIVATE_CHAT_RATE,
+                 group_chat_rate: float = TELEGRAM_GROUP_CHAT_RATE,
+                 max_retries: int = TELEGRAM_RATE_MAX_RETRIES):
+        """
+        Инициализация ограничителя
+
+        Args:
+            global_rate (float): Запросов в секунду на бота
+            private_chat_rate (float): Сообщений в секунду в личный чат
+            group_chat_rate (float): Сообщений в секунду в группу или канал
+            max_retries (int): Сколько раз повторять запрос после RetryAfter
+        """
+        self.private_chat_rate = private_chat_rate
+        self.group_chat_rate = group_chat_rate
+        self.max_retries = max_retries
+
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._waiters: List[list] = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+
+        self._retries = 0
+        self._waits_by_priority: Dict[int, int] = {}
+
+    async def initialize(self) -> None:
+        """Ресурсы не требуются"""
+
+    async def shutdown(self) -> None:
+        """Ресурсы не требуются"""
+
+    def set_global_rate(self, rate: float):
+        """
+        Изменение лимита общей корзины
+
+        Args:
+            rate (float): Запросов в секунду
+        """
+        self._global = TokenBucket(rate, rate)
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 1000:
+                self._drop_idle_buckets()
+            # Отрицательные ID и @username - группы и каналы
+            try:
+                is_group = int(chat_id) < 0
+            except (TypeError, ValueError):
+                is_group = True
+            if is_group:
+                bucket = TokenBucket(self.group_chat_rate, 1)
+            else:
+                bucket = TokenBucket(self.private_chat_rate, PRIVATE_CHAT_BURST)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _drop_idle_buckets(self):
+        now = time.monotonic()
+        idle = [key for key, bucket in self._chats.items() if now - bucket.updated > CHAT_BUCKET_IDLE_TTL]
+        for key in idle:
+            del self._chats[key]
+
+    def _wake_head(self):
+        if self._waiters and not self._waiters[0][2].done():
+            self._waiters[0][2].set_result(None)
+
+    async def _acquire_global(self, priority: int):
+        """Токен общей корзины: первым получает ожидающий с высшим приоритетом"""
+        loop = asyncio.get_running_loop()
+        entry = [priority, next(self._sequence), loop.create_future()]
+        heapq.heappush(self._waiters, entry)
+
+        try:
+            while True:
+                if self._waiters[0] is entry:
+                    delay = max(self._paused_until - time.monotonic(), 0) or self._global.try_consume()
+                    if not delay:
+                        return
+                    await asyncio.sleep(delay)
+                else:
+                    self._waits_by_priority[priority] = self._waits_by_priority.get(priority, 0) + 1
+                    await entry[2]
+                    entry[2] = loop.create_future()
+        finally:
+            if self._waiters[0] is entry:
+                heapq.heappop(self._waiters)
+            else:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            self._wake_head()
+
+    async def acquire(self, chat_id: Optional[Any] = None, priority: int = PRIORITY_USER):
+        """
+        Дождаться разрешения на запрос
+
+        Args:
+            chat_id (Optional[Any]): Чат, в который идет запрос (None - только общая корзина)
+            priority (int): Класс приоритета
+        """
+        if chat_id is not None:
+            delay = self._chat_bucket(chat_id).reserve()
+            if delay:
+                await asyncio.sleep(delay)
+
+        await self._acquire_global(priority)
+
+    def pause(self, retry_after: float):
+        """
+        Приостановить все запросы (Telegram ответил RetryAfter)
+
+        Args:
+            retry_after (float): На сколько секунд
+        """
+        self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        logger.warning(f"Telegram попросил подождать {retry_after} с, исходящие запросы приостановлены")
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Any:
+        """Выполнение запроса Bot API с ограничением частоты"""
+        priority = PRIORITY_USER if rate_limit_args is None else rate_limit_args
+        chat_id = data.get('chat_id')
+        # Корзина чата - только для отправки сообщений
+        bucket_chat_id = chat_id if is_message_endpoint(endpoint) else None
+
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(bucket_chat_id, priority)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self._retries += 1
+                self.pause(e.retry_after)
+                logger.info(f"Повтор {endpoint} для чата {chat_id} после RetryAfter (попытка {attempt + 1})")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Метрики ограничителя
+
+        Returns:
+            Dict: Ожидающих общую корзину, число корзин чатов, пауза (секунды),
+                повторов после RetryAfter и сколько раз запросы каждого
+                приоритета уступали очередь
+        """
+        return {
+            'waiting': len(self._waiters),
+            'chat_buckets': len(self._chats),
+            'paused_for': max(self._paused_until - time.monotonic(), 0.0),
+            'retries': self._retries,
+            'waits_by_priority': dict(self._waits_by_priority)
+        }
@@ -0,0 +1,347 @@
+"""
+Запуск бота в нескольких процессах с распределением обновлений по telegram_id
+
+Один процесс принимает обновления Telegram (webhook или long polling) и
+передает каждое в процесс-обработчик, выбранный по consistent hash от ID
+пользователя. Все обновления пользователя попадают в один процесс, поэтому
+порядок обработки и кэши в памяти процесса остаются корректными.
+"""
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import queue
+import signal
+from typing import Any, Dict, List, Optional
+
+from telegram.error import TelegramError
+
+from config import (
+    BOT_RUN_MODE,
+    TELEGRAM_WEBHOOK_URL,
+    TELEGRAM_WEBHOOK_PATH,
+    TELEGRAM_WEBHOOK_SECRET,
+    TELEGRAM_ALLOWED_UPDATES,
+    BOT_WEBHOOK_HOST,
+    BOT_WEBHOOK_PORT,
+    LOG_LEVEL
+)
+from telegram_transport import create_bot
+
+logger = logging.getLogger(__name__)
+
+# Таймаут long polling распределителя в секундах
+POLLING_TIMEOUT = 30
+# Как часто распределитель проверяет, что процессы-обработчики живы (секунды)
+WORKER_CHECK_INTERVAL = 5
+
+
+class HashRing:
+    """
+    Кольцо consistent hashing с виртуальными узлами
+
+    При изменении числа процессов переезжает только часть пользователей,
+    а не все, как при остатке от деления.
+    """
+
+    def __init__(self, nodes: List[int], replicas: int = 128):
+        """
+        Инициализация кольца
+
+        Args:
+            nodes (List[int]): Номера узлов (процессов)
+            replicas (int): Число виртуальных узлов на каждый узел
+        """
+        self._ring: List[int] = []
+        self._owners: Dict[int, int] = {}
+
+        for node in nodes:
+            for replica in range(replicas):
+                point = self._hash(f"{node}:{replica}")
+                self._owners[point] = node
+                bisect.insort(self._ring, point)
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+    def get_node(self, key: Any) -> int:
+        """
+        Узел, которому принадлежит ключ
+
+        Args:
+            key: Ключ (telegram_id)
+
+        Returns:
+            int: Номер узла
+        """
+        index = bisect.bisect(self._ring, self._hash(str(key))) % len(self._ring)
+        return self._owners[self._ring[index]]
+
+
+def get_update_routing_key(data: Dict[str, Any]) -> Any:
+    """
+    Ключ распределения для обновления в формате Bot API
+
+    Args:
+        data (Dict): Обновление Telegram
+
+    Returns:
+        Any: ID пользователя, иначе ID чата, иначе update_id
+    """
+    for field, payload in data.items():
+        if not isinstance(payload, dict):
+            continue
+
+        sender = payload.get('from') or payload.get('user')
+        if isinstance(sender, dict) and 'id' in sender:
+            return sender['id']
+
+        chat = payload.get('chat') or (payload.get('message') or {}).get('chat')
+        if isinstance(chat, dict) and 'id' in chat:
+            return chat['id']
+
+    return data.get('update_id')
+
+
+def _worker_main(index: int, workers: int, updates_queue: multiprocessing.Queue):
+    """
+    Точка входа процесса-обработчика
+
+    Args:
+        index (int): Номер процесса
+        workers (int): Всего процессов-обработчиков
+        updates_queue (multiprocessing.Queue): Очередь обновлений от распределителя
+    """
+    logging.basicConfig(
+        format=f'%(asctime)s - worker-{index} - %(name)s - %(levelname)s - %(message)s',
+        level=getattr(logging, LOG_LEVEL, logging.INFO)
+    )
+    # Остановкой управляет распределитель (через None в очереди)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    from bot import TelegramBot
+
+    bot = TelegramBot()
+    logger.info(f"Процесс-обработчик {index} запущен")
+    asyncio.run(bot.run_worker(updates_queue, workers))
+    logger.info(f"Процесс-обработчик {index} остановлен")
+
+
+class ShardedBotRuntime:
+    """Распределитель обновлений и N процессов-обработчиков"""
+
+    def __init__(self, workers: int):
+        """
+        Инициализация
+
+        Args:
+            workers (int): Количество процессов-обработчиков
+        """
+        if workers < 1:
+            raise ValueError("Количество процессов должно быть не меньше 1")
+
+        self.workers = workers
+        self.ring = HashRing(list(range(workers)))
+
+        # spawn: процессы не наследуют event loop и соединения родителя
+        self._context = multiprocessing.get_context('spawn')
+        self._queues: List[multiprocessing.Queue] = []
+        self._processes: List[multiprocessing.Process] = []
+        self._dispatched = [0] * workers
+        self._restarts = [0] * workers
+
+    def run(self):
+        """Запуск (блокирует до SIGINT/SIGTERM)"""
+        asyncio.run(self._run())
+
+    def _spawn_worker(self, index: int, updates_queue: multiprocessing.Queue) -> multiprocessing.Process:
+        """
+        Запуск одного процесса-обработчика
+
+        Args:
+            index (int): Номер процесса
+            updates_queue (multiprocessing.Queue): Его очередь обновлений
+
+        Returns:
+            multiprocessing.Process: Запущенный процесс
+        """
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, self.workers, updates_queue),
+            name=f"bot-worker-{index}"
+        )
+        process.start()
+        return process
+
+    def _start_workers(self):
+        """Запуск процессов-обработчиков"""
+        for index in range(self.workers):
+            updates_queue = self._context.Queue()
+            self._queues.append(updates_queue)
+            self._processes.append(self._spawn_worker(index, updates_queue))
+
+        logger.info(f"Запущено процессов-обработчиков: {self.workers}")
+
+    def _ensure_worker(self, index: int):
+        """
+        Перезапуск процесса-обработчика, если он завершился
+
+        Обновления, которые процесс не успел забрать, переносятся в очередь
+        нового процесса. Старую очередь не переиспользуем: процесс мог умереть,
+        держа ее блокировку чтения.
+
+        Args:
+            index (int): Номер процесса
+        """
+        process = self._processes[index]
+        if process.is_alive():
+            return
+
+        old_queue = self._queues[index]
+        new_queue = self._context.Queue()
+        moved = 0
+        while True:
+            try:
+                data = old_queue.get_nowait()
+            except (queue.Empty, OSError, EOFError, ValueError):
+                break
+            if data is not None:
+                new_queue.put(data)
+                moved += 1
+        old_queue.close()
+
+        logger.error(
+            f"Процесс {process.name} завершился (код {process.exitcode}), шард {index} "
+            f"перезапускается; перенесено необработанных обновлений: {moved}"
+        )
+        self._queues[index] = new_queue
+        self._processes[index] = self._spawn_worker(index, new_queue)
+        self._restarts[index] += 1
+
+    async def _watch_workers(self):
+        """Периодическая проверка процессов-обработчиков (и когда обновлений нет)"""
+        while True:
+            await asyncio.sleep(WORKER_CHECK_INTERVAL)
+            for index in range(self.workers):
+                self._ensure_worker(index)
+
+    def _stop_workers(self, timeout: float = 30):
+        """
+        Остановка процессов-обработчиков после обработки уже переданных обновлений
+
+        Args:
+            timeout (float): Сколько ждать завершения каждого процесса
+        """
+        for updates_queue in self._queues:
+            updates_queue.put(None)
+
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"Процесс {process.name} не остановился, завершаем принудительно")
+                process.terminate()
+
+        logger.info(
+            f"Процессы-обработчики остановлены, распределено обновлений: {self._dispatched}, "
+            f"перезапусков: {self._restarts}"
+        )
+
+    async def dispatch(self, data: Dict[str, Any]):
+        """
+        Передача обновления процессу, которому принадлежит пользователь
+
+        Args:
+            data (Dict): Обновление в формате Bot API
+        """
+        node = self.ring.get_node(get_update_routing_key(data))
+        self._ensure_worker(node)
+        self._queues[node].put(data)
+        self._dispatched[node] += 1
+
+    async def _run(self):
+        """Работа распределителя"""
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+
+        self._start_workers()
+        watch_task = asyncio.create_task(self._watch_workers())
+        runner = None
+        polling_task: Optional[asyncio.Task] = None
+
+        try:
+            if BOT_RUN_MODE == 'webhook':
+                runner = await self._start_webhook_ingress()
+            elif BOT_RUN_MODE == 'polling':
+                polling_task = asyncio.create_task(self._poll_updates())
+            else:
+                raise ValueError(f"Неизвестный BOT_RUN_MODE: {BOT_RUN_MODE}")
+
+            await stop_event.wait()
+
+        finally:
+            logger.info("Остановка распределителя...")
+            watch_task.cancel()
+            if runner:
+                await runner.cleanup()
+            if polling_task:
+                polling_task.cancel()
+                try:
+                    await polling_task
+                except asyncio.CancelledError:
+                    pass
+
+            await loop.run_in_executor(None, self._stop_workers)
+
+    async def _start_webhook_ingress(self):
+        """
+        Прием обновлений через webhook Telegram
+
+        Returns:
+            web.AppRunner: Запущенный сервер aiohttp
+        """
+        from webhook_server import run_webhook_server
+
+        if not TELEGRAM_WEBHOOK_URL or not TELEGRAM_WEBHOOK_SECRET:
+            raise ValueError("Для BOT_RUN_MODE=webhook нужны TELEGRAM_WEBHOOK_URL и TELEGRAM_WEBHOOK_SECRET")
+
+        async with create_bot() as bot:
+            await bot.set_webhook(
+                url=TELEGRAM_WEBHOOK_URL,
+                secret_token=TELEGRAM_WEBHOOK_SECRET,
+                allowed_updates=TELEGRAM_ALLOWED_UPDATES,
+                drop_pending_updates=False
+            )
+
+        runner = await run_webhook_server(
+            BOT_WEBHOOK_HOST, BOT_WEBHOOK_PORT, telegram_update_sink=self.dispatch, serve_n8n=False
+        )
+        logger.info(f"Webhook Telegram принимает обновления на {TELEGRAM_WEBHOOK_PATH}")
+        return runner
+
+    async def _poll_updates(self):
+        """Прием обновлений через long polling"""
+        async with create_bot() as bot:
+            await bot.delete_webhook(drop_pending_updates=True)
+            offset = None
+            logger.info("Распределитель получает обновления через long polling")
+
+            while True:
+                try:
+                    updates = await bot.get_updates(
+                        offset=offset,
+                        timeout=POLLING_TIMEOUT,
+                        allowed_updates=TELEGRAM_ALLOWED_UPDATES
+                    )
+                except TelegramError as e:
+                    logger.error(f"Ошибка при получении обновлений: {e}")
+                    await asyncio.sleep(1)
+                    continue
+
+                for update in updates:
+                    offset = update.update_id + 1
+                    await self.dispatch(update.to_dict())
@@ -0,0 +1,640 @@
+"""
+HTML для Telegram: очистка текста от n8n и разбиение длинных сообщений
+"""
+import html
+import logging
+import re
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from telegram import Message
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина текста сообщения после разбора разметки (в единицах UTF-16)
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Поддерживаемые Telegram теги и их каноническое имя
+SUPPORTED_TAGS = {
+    'b': 'b', 'strong': 'b',
+    'i': 'i', 'em': 'i',
+    'u': 'u', 'ins': 'u',
+    's': 's', 'strike': 's', 'del': 's',
+    'tg-spoiler': 'tg-spoiler',
+    'a': 'a',
+    'code': 'code',
+    'pre': 'pre',
+    'blockquote': 'blockquote',
+}
+
+# Неподдерживаемые теги, которые заменяются: (тег Telegram или None,
+# текст вместо открывающего тега, текст после закрывающего)
+REPLACED_TAGS = {
+    'p': (None, '', '\n\n'),
+    'div': (None, '', '\n'),
+    'br': (None, '\n', ''),
+    'hr': (None, '\n', ''),
+    **{f'h{level}': ('b', '', '\n\n') for level in range(1, 7)},
+    **{tag: (None, '', '\n') for tag in ['ul', 'ol', 'li', 'table', 'tr', 'td', 'th', 'thead', 'tbody']},
+}
+
+# Правила для всех известных тегов в одном словаре: один поиск на тег
+_TAG_RULES = {
+    **{tag: (name, '', '') for tag, name in SUPPORTED_TAGS.items()},
+    **REPLACED_TAGS,
+}
+
+_OPEN = {name: f'<{name}>' for name in set(SUPPORTED_TAGS.values())}
+_CLOSE = {name: f'</{name}>' for name in set(SUPPORTED_TAGS.values())}
+
+# Внутри code и pre Telegram не допускает другой разметки (кроме code в pre)
+_VERBATIM_TAGS = ('code', 'pre')
+
+# Теги, атрибуты которых сохраняются
+_ATTRIBUTE_TAGS = ('a', 'code', 'blockquote')
+
+# Разбор тега (содержимое между < и >): (вид, имя тега Telegram, текст рядом
+# с тегом, готовая разметка). Для открывающего тега разметка - сам тег, для
+# закрывающего - закрывающий тег вместе с текстом после него
+_KEEP, _OPEN_TAG, _CLOSE_TAG, _SPAN_CLOSE, _NOT_A_TAG = range(5)
+
+_TAG_BODY_RE = re.compile(r'(/?)([a-zA-Z][a-zA-Z0-9-]*)(.*)', re.DOTALL)
+
+_ATTR_RE = re.compile(r'([a-zA-Z-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+))')
+
+_COMMENT_RE = re.compile(r'<!--.*?-->', re.DOTALL)
+
+# Значение атрибута в кавычках и незакрытая кавычка значения: внутри кавычек
+# < и > - часть значения, а не границы тега
+_QUOTED_VALUE_RE = re.compile(r'=\s*(?:"[^"]*"|\'[^\']*\')')
+_OPEN_QUOTE_RE = re.compile(r'=\s*["\']')
+
+# Дальше этой длины тег с незакрытой кавычкой не читается (кавычка - опечатка)
+MAX_TAG_LENGTH = 4096
+
+# Сущность или одиночные & и > в тексте между тегами
+_TEXT_SPECIAL_RE = re.compile(r'&(?:#[0-9]+|#[xX][0-9a-fA-F]+|[a-zA-Z][a-zA-Z0-9]*);|[&>]')
+
+# То, что в тексте нужно менять: > и & вне сущностей, которые Telegram понимает сам
+_TEXT_UNSAFE_RE = re.compile(r'>|&(?!(?:lt|gt|amp|quot|#[0-9]+|#[xX][0-9a-fA-F]+);)')
+
+_NEWLINES_RE = re.compile(r'\n\n\n+')
+
+# Сущности, которые Telegram понимает сам
+_TELEGRAM_ENTITIES = ('&lt;', '&gt;', '&amp;', '&quot;')
+
+# Текст после очистки: сущность | текст
+_ENTITY_RE = re.compile(r'&[^;&]+;')
+_TEXT_TOKEN_RE = re.compile(r'&[^;&]+;|&|[^&]+')
+
+
+def _open_tag(name: str, attrs: str) -> Optional[str]:
+    """
+    Открывающий тег Telegram с допустимыми атрибутами
+
+    Args:
+        name (str): Каноническое имя тега
+        attrs (str): Атрибуты из исходного тега
+
+    Returns:
+        Optional[str]: Тег или None, если без атрибутов он не имеет смысла (ссылка без href)
+    """
+    values = {
+        match.group(1).lower(): html.unescape(match.group(2) or match.group(3) or match.group(4) or '')
+        for match in _ATTR_RE.finditer(attrs)
+    }
+
+    if name == 'a':
+        href = values.get('href', '').strip()
+        return f'<a href="{html.escape(href)}">' if href else None
+    if name == 'code' and values.get('class', '').startswith('language-'):
+        return f'<code class="{html.escape(values["class"])}">'
+    if name == 'blockquote' and 'expandable' in attrs.lower():
+        return '<blockquote expandable>'
+    return _OPEN[name]
+
+
+def _takes_attributes(body: str) -> bool:
+    """Проверка, что тег - открывающий тег с атрибутами, которые сохраняются (<a href=...>)"""
+    match = _TAG_BODY_RE.match(body)
+    if match is None or match.group(1) or not match.group(3)[:1].isspace():
+        return False
+    rule = _TAG_RULES.get(match.group(2).lower())
+    return rule is not None and rule[0] in _ATTRIBUTE_TAGS
+
+
+def _has_open_quote(body: str) -> bool:
+    """Проверка, что в теге осталось незакрытое значение атрибута в кавычках"""
+    return _OPEN_QUOTE_RE.search(_QUOTED_VALUE_RE.sub('', body)) is not None
+
+
+def _read_quoted_tag(piece: str, pieces: List[str], index: int) -> Optional[Tuple[str, str, int]]:
+    """
+    Чтение тега, в значении атрибута которого есть > или <
+
+    Args:
+        piece (str): Текст после '<', с которого начинается тег
+        pieces (List[str]): Весь текст, разбитый по '<'
+        index (int): Индекс следующего за piece куска
+
+    Returns:
+        Optional[Tuple]: Содержимое тега, текст после него и индекс следующего
+            куска; None, если кавычка так и не закрылась
+    """
+    text = piece
+    start = 0
+    while len(text) <= MAX_TAG_LENGTH:
+        end = text.find('>', start)
+        while end != -1:
+            if not _has_open_quote(text[:end]):
+                return text[:end], text[end + 1:], index
+            end = text.find('>', end + 1)
+
+        if index >= len(pieces):
+            return None
+        start = len(text)
+        text += '<' + pieces[index]
+        index += 1
+    return None
+
+
+def _parse_tag(body: str) -> Tuple[int, Optional[str], str, str]:
+    """
+    Разбор тега по его содержимому между < и >
+
+    Результат не зависит от окружающего текста, поэтому кэшируется в
+    _TAG_CACHE: в ответах LLM одни и те же теги повторяются.
+
+    Args:
+        body (str): Содержимое тега ('b', '/p', 'a href="..."')
+
+    Returns:
+        Tuple: Вид, имя тега Telegram, текст рядом с тегом, готовая разметка
+    """
+    match = _TAG_BODY_RE.fullmatch(body)
+    if match is None:
+        # Не тег ("5 < 7 и 9 > 8") - экранируем как текст
+        return _NOT_A_TAG, None, '', '&lt;' + _escape_text(body).replace('<', '&lt;') + '&gt;'
+
+    closing = bool(match.group(1))
+    tag = match.group(2).lower()
+    attrs = match.group(3).rstrip('/ ')
+
+    if tag == 'span':
+        # <span class="tg-spoiler"> - спойлер, остальные span убираются
+        if closing:
+            return _SPAN_CLOSE, 'tg-spoiler', '', _CLOSE['tg-spoiler']
+        rule = ('tg-spoiler' if 'tg-spoiler' in attrs else None, '', '')
+    else:
+        rule = _TAG_RULES.get(tag, (None, '', ''))
+
+    name, open_text, close_text = rule
+    if name is None:
+        return _KEEP, None, close_text if closing else open_text, ''
+    if closing:
+        return _CLOSE_TAG, name, close_text, _CLOSE[name] + close_text
+
+    if attrs and name in _ATTRIBUTE_TAGS:
+        opening = _open_tag(name, attrs)
+    else:
+        opening = None if name == 'a' else _OPEN[name]
+    if opening is None:
+        return _KEEP, None, open_text, ''
+    return _OPEN_TAG, name, open_text, opening
+
+
+def _escape_special(match: re.Match) -> str:
+    """
+    Сущность HTML или одиночный спецсимвол в виде, который примет Telegram
+
+    Args:
+        match (re.Match): Совпадение _TEXT_SPECIAL_RE
+
+    Returns:
+        str: Поддерживаемая сущность, символ или экранированный текст
+    """
+    token = match.group()
+    escaped = _SPECIAL_CACHE.get(token)
+    if escaped is not None:
+        return escaped
+
+    if token[1] == '#':
+        escaped = token
+    else:
+        char = html.unescape(token)
+        # Неизвестная сущность - экранируем амперсанд
+        escaped = '&amp;' + token[1:] if char == token else html.escape(char, quote=False)
+
+    if len(_SPECIAL_CACHE) < PARSE_CACHE_SIZE:
+        _SPECIAL_CACHE[token] = escaped
+    return escaped
+
+
+def _escape_text(text: str) -> str:
+    """Экранирование текста между тегами (обычно в нем нечего менять)"""
+    if ('&' in text or '>' in text) and _TEXT_UNSAFE_RE.search(text):
+        return _TEXT_SPECIAL_RE.sub(_escape_special, text)
+    return text
+
+
+# Разобранные теги и сущности: в ответах LLM набор тегов небольшой, поэтому
+# кэши просто перестают пополняться, когда заполнятся
+PARSE_CACHE_SIZE = 1024
+
+_SPECIAL_CACHE = {'&': '&amp;', '>': '&gt;', **{entity: entity for entity in _TELEGRAM_ENTITIES}}
+
+_TAG_CACHE = {
+    body: _parse_tag(body)
+    for tag in _TAG_RULES
+    for body in (tag, f'/{tag}', f'{tag}/', f'{tag} /')
+}
+
+# Частые теги без атрибутов, которые разбираются прямо в цикле
+# sanitize_telegram_html: содержимое -> (вид, имя тега Telegram, разметка).
+# Для блочных тегов разметка - текст на их месте
+_FAST_TAGS = {
+    body: (kind, name, markup if kind != _KEEP else extra)
+    for body, (kind, name, extra, markup) in _TAG_CACHE.items()
+    if kind == _KEEP or not extra
+}
+
+
+def sanitize_telegram_html(text: str) -> str:
+    """
+    Очистка HTML для parse_mode='HTML' за один проход
+
+    Поддерживаемые Telegram теги остаются (синонимы приводятся к одному
+    имени), заголовки становятся жирным текстом, блочные теги - переносами
+    строк, остальные теги убираются с сохранением содержимого. Теги
+    балансируются: лишние закрывающие отбрасываются, незакрытые закрываются,
+    при неправильной вложенности внутренние теги закрываются и открываются
+    заново. Одиночные <, > и & экранируются, больше двух переносов строки
+    подряд не остается, пробелы по краям убираются.
+
+    Текст режется по '<' (str.split), дальше каждый фрагмент - это тег до
+    '>' и текст после него. Частые теги без атрибутов заменяются поиском в
+    словаре, поэтому Python работает только на разметке, а не на каждом
+    символе, и строка собирается один раз.
+
+    Args:
+        text (str): HTML текст от n8n
+
+    Returns:
+        str: Текст, который Telegram примет с parse_mode='HTML'
+    """
+    if '<!--' in text:
+        text = _COMMENT_RE.sub('', text)
+
+    pieces = text.split('<')
+    out: List[str] = [_escape_text(pieces[0])]
+    append = out.append
+    fast_tag = _FAST_TAGS.get
+    # Открытые теги: имена и открывающие теги (с атрибутами)
+    names: List[str] = []
+    openings: List[str] = []
+
+    index = 1
+    while index < len(pieces):
+        piece = pieces[index]
+        index += 1
+        body, closed, rest = piece.partition('>')
+        rule = fast_tag(body) if closed else None
+
+        if (rule is None and ('"' in body or "'" in body)
+                and _has_open_quote(body) and _takes_attributes(body)):
+            # > или < внутри кавычек атрибута: тег продолжается дальше
+            quoted = _read_quoted_tag(piece, pieces, index)
+            if quoted is not None:
+                body, rest, index = quoted
+                closed = '>'
+
+        if not closed:
+            # Нет '>' - одиночный '<'
+            append('&lt;')
+            rest = body
+        else:
+            if rule is None:
+                append(_apply_tag(body, names, openings))
+            else:
+                kind, name, markup = rule
+                if kind == _KEEP:
+                    # Блочный тег, который просто заменяется
+                    if markup:
+                        append(markup)
+                elif kind == _CLOSE_TAG and names and names[-1] == name:
+                    # Закрывающий тег к последнему открытому
+                    names.pop()
+                    openings.pop()
+                    append(markup)
+                elif kind == _OPEN_TAG and not names:
+                    # Открывающий тег вне других тегов
+                    names.append(name)
+                    openings.append(markup)
+                    append(markup)
+                else:
+                    append(_apply_tag(body, names, openings))
+
+        if rest:
+            append(_escape_text(rest) if '&' in rest or '>' in rest else rest)
+
+    result = ''.join(out)
+    if '\n\n\n' in result:
+        result = _NEWLINES_RE.sub('\n\n', result)
+    result = result.strip()
+
+    # Незакрытые теги закрываем; пустые, открытые в самом конце, убираем
+    for name, opening in zip(reversed(names), reversed(openings)):
+        if result.endswith(opening):
+            result = result[:-len(opening)].rstrip()
+        else:
+            result += _CLOSE[name]
+    return result
+
+
+def _apply_tag(body: str, names: List[str], openings: List[str]) -> str:
+    """
+    Общий случай обработки тега: атрибуты, вложенность, неправильный порядок закрытия
+
+    Args:
+        body (str): Содержимое тега между < и >
+        names (List[str]): Имена открытых тегов (изменяется)
+        openings (List[str]): Открывающие теги (изменяется)
+
+    Returns:
+        str: Разметка на месте тега
+    """
+    info = _TAG_CACHE.get(body)
+    if info is None:
+        info = _parse_tag(body)
+        if len(_TAG_CACHE) < PARSE_CACHE_SIZE:
+            _TAG_CACHE[body] = info
+            if info[0] == _KEEP or (info[0] in (_OPEN_TAG, _CLOSE_TAG) and not info[2]):
+                _FAST_TAGS[body] = (info[0], info[1], info[3] if info[0] != _KEEP else info[2])
+    kind, name, extra, markup = info
+
+    if kind == _KEEP or kind == _NOT_A_TAG:
+        return markup or extra
+
+    if kind == _OPEN_TAG:
+        if names and ((names[-1] in _VERBATIM_TAGS and not (name == 'code' and names[-1] == 'pre'))
+                      or (name == 'a' and 'a' in names)):
+            return extra
+        names.append(name)
+        openings.append(markup)
+        return extra + markup
+
+    if names and names[-1] == name:
+        names.pop()
+        openings.pop()
+        return markup
+    if name in names:
+        return _reopen_after_close(names, openings, name) + extra
+    return extra
+
+
+def _reopen_after_close(names: List[str], openings: List[str], name: str) -> str:
+    """
+    Закрытие тега при неправильной вложенности (<b><i>...</b>)
+
+    Внутренние теги закрываются и открываются заново после закрываемого.
+
+    Args:
+        names (List[str]): Имена открытых тегов (изменяется)
+        openings (List[str]): Открывающие теги (изменяется)
+        name (str): Закрываемый тег
+
+    Returns:
+        str: Разметка закрытия
+    """
+    index = len(names) - 1 - names[::-1].index(name)
+    inner_names = names[index + 1:]
+    inner_openings = openings[index + 1:]
+    del names[index:], openings[index:]
+    names.extend(inner_names)
+    openings.extend(inner_openings)
+    return (
+        ''.join(_CLOSE[inner] for inner in reversed(inner_names)) + _CLOSE[name]
+        + ''.join(inner_openings)
+    )
+
+
+def _utf16_len(text: str) -> int:
+    """Длина текста в единицах UTF-16 (так длину считает Telegram)"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _utf16_prefix(text: str, units: int) -> int:
+    """
+    Сколько символов текста помещается в заданное число единиц UTF-16
+
+    Args:
+        text (str): Текст
+        units (int): Доступная длина
+
+    Returns:
+        int: Количество символов (суррогатная пара не разрывается)
+    """
+    if _utf16_len(text) == len(text):
+        return min(units, len(text))
+
+    # Каждый символ занимает хотя бы одну единицу: ответ не больше units
+    low, high = 0, min(units, len(text))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if _utf16_len(text[:middle]) <= units:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _visible_len(text: str, measure: Callable[[str], int]) -> int:
+    """
+    Видимая длина текста между тегами: сущность считается одним символом
+
+    Args:
+        text (str): Текст после очистки
+        measure (Callable): Функция длины (len или _utf16_len)
+
+    Returns:
+        int: Длина
+    """
+    if '&' in text:
+        return measure(text) - sum(len(entity) - 1 for entity in _ENTITY_RE.findall(text))
+    return measure(text)
+
+
+def _find_cut(window: str) -> int:
+    """
+    Место разреза текста: конец абзаца, строки или слова
+
+    Args:
+        window (str): Часть текста, которая помещается в сообщение (плюс один символ)
+
+    Returns:
+        int: Позиция разреза (0 или -1, если разрезать негде)
+    """
+    best = -1
+    for separator in ('\n\n', '\n', ' '):
+        cut = window.rfind(separator)
+        # Более крупный разделитель берем, если он не слишком далеко от конца
+        if cut > len(window) // 2:
+            return cut
+        best = max(best, cut)
+    return best
+
+
+def split_telegram_html(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """
+    Разбиение очищенного HTML на сообщения не длиннее лимита Telegram
+
+    Текст режется по абзацу, строке или пробелу (в крайнем случае посреди
+    слова). Теги, открытые на месте разреза, закрываются в конце сообщения
+    и открываются заново в начале следующего. Длина считается по видимому
+    тексту, как в Telegram: теги не учитываются, сущность - один символ.
+
+    Args:
+        text (str): HTML после sanitize_telegram_html
+        limit (int): Максимальная длина сообщения
+
+    Returns:
+        List[str]: Части сообщения (одна, если текст помещается)
+    """
+    # Разметка не короче видимого текста: короткое сообщение не разбираем
+    if _utf16_len(text) <= limit:
+        return [text]
+
+    # Без символов вне BMP длина в UTF-16 совпадает с длиной строки
+    measure = len if _utf16_len(text) == len(text) else _utf16_len
+
+    messages: List[str] = []
+    parts: List[str] = []
+    # Открытые теги: (имя, открывающий тег, индекс в parts)
+    stack: List[Tuple[str, str, int]] = []
+    used = 0
+    last_visible = -1
+
+    def finish_message():
+        nonlocal parts, used, last_visible
+        # Теги, открытые после последнего текста, переходят в следующее сообщение целиком
+        empty = {index for _, _, index in stack if index > last_visible}
+        body = ''.join(part for index, part in enumerate(parts) if index not in empty).rstrip()
+        closing = ''.join(f'</{name}>' for name, _, index in reversed(stack) if index not in empty)
+        messages.append(body + closing)
+
+        parts = []
+        for position, (name, opening, _) in enumerate(stack):
+            stack[position] = (name, opening, len(parts))
+            parts.append(opening)
+        used = 0
+        last_visible = -1
+
+    def append_text(chunk: str, visible: int):
+        nonlocal used, last_visible
+        parts.append(chunk)
+        used += visible
+        last_visible = len(parts) - 1
+
+    def add_text(chunk: str):
+        if not used:
+            chunk = chunk.lstrip()
+            if not chunk:
+                return
+        visible = _visible_len(chunk, measure)
+        if used + visible <= limit:
+            append_text(chunk, visible)
+            return
+
+        # Текст не помещается: режем его, сущности не разрываем
+        for token in _TEXT_TOKEN_RE.findall(chunk):
+            if token[0] == '&' and token[-1] == ';':
+                if used + 1 > limit:
+                    finish_message()
+                append_text(token, 1)
+                continue
+
+            while measure(token) > limit - used:
+                fits = _utf16_prefix(token, limit - used)
+                cut = _find_cut(token[:fits + 1])
+                if cut <= 0:
+                    if used:
+                        # Разрыв на границе предыдущего фрагмента
+                        finish_message()
+                        token = token.lstrip()
+                        continue
+                    cut = fits
+                append_text(token[:cut], measure(token[:cut]))
+                finish_message()
+                token = token[cut:].lstrip()
+
+            if token and not used:
+                token = token.lstrip()
+            if token:
+                append_text(token, measure(token))
+
+    pieces = text.split('<')
+    if pieces[0]:
+        add_text(pieces[0])
+
+    for piece in pieces[1:]:
+        body, closed, rest = piece.partition('>')
+        if not closed or not body:
+            # Не тег ('<' без '>' или '<>'): на входе без очистки такое бывает
+            add_text('<' + piece)
+            continue
+        tag = f'<{body}>'
+        if body[0] == '/':
+            if stack and stack[-1][0] == body[1:]:
+                stack.pop()
+        else:
+            stack.append((body.partition(' ')[0], tag, len(parts)))
+        parts.append(tag)
+
+        if rest:
+            visible = measure(rest) if '&' not in rest else _visible_len(rest, measure)
+            if used and used + visible <= limit:
+                # Частый случай: текст целиком помещается в текущее сообщение
+                parts.append(rest)
+                used += visible
+                last_visible = len(parts) - 1
+            else:
+                add_text(rest)
+
+    if used or not messages:
+        finish_message()
+
+    return messages
+
+
+async def send_html_message(send: Callable[..., Awaitable[Message]], text: str,
+                            reply_markup: Any = None, start_chunk: int = 0,
+                            on_chunk_sent: Optional[Callable[[int], Any]] = None,
+                            **kwargs: Any) -> Optional[Message]:
+    """
+    Отправка HTML текста одним или несколькими сообщениями
+
+    Args:
+        send (Callable): Метод отправки (bot.send_message, message.reply_text)
+        text (str): Очищенный HTML
+        reply_markup: Клавиатура (прикрепляется к последнему сообщению)
+        start_chunk (int): С какой части начинать (повтор после ошибки не
+            отправляет уже доставленные части второй раз)
+        on_chunk_sent (Optional[Callable]): Вызывается после каждой отправленной
+            части с количеством уже отправленных частей
+        **kwargs: Остальные параметры отправки (chat_id, disable_web_page_preview)
+
+    Returns:
+        Optional[Message]: Последнее отправленное сообщение (None, если все части
+        уже были отправлены раньше)
+    """
+    chunks = split_telegram_html(text)
+    if len(chunks) > 1:
+        logger.info(f"Сообщение длиннее {TELEGRAM_MESSAGE_LIMIT} символов, отправляем частями: {len(chunks)}")
+
+    message = None
+    for index in range(start_chunk, len(chunks)):
+        last = index == len(chunks) - 1
+        message = await send(text=chunks[index], parse_mode='HTML',
+                             reply_markup=reply_markup if last else None, **kwargs)
+        if on_chunk_sent is not None:
+            on_chunk_sent(index + 1)
+    return message
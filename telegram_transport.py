@@ -0,0 +1,202 @@
+"""
+Транспорт Bot API: пулы соединений к Telegram с метриками ожидания
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from telegram.error import TimedOut
+from telegram.ext import ExtBot
+from telegram.request import HTTPXRequest, RequestData
+
+from rate_limiter import TelegramRateLimiter
+from config import (
+    TELEGRAM_BOT_TOKEN,
+    TELEGRAM_POOL_SIZE,
+    TELEGRAM_POOL_TIMEOUT,
+    TELEGRAM_CONNECT_TIMEOUT,
+    TELEGRAM_READ_TIMEOUT,
+    TELEGRAM_WRITE_TIMEOUT,
+    TELEGRAM_HTTP_VERSION
+)
+
+logger = logging.getLogger(__name__)
+
+# getUpdates - один длинный запрос за раз, ему хватает одного соединения
+GET_UPDATES_POOL_SIZE = 1
+
+
+class InstrumentedHTTPXRequest(HTTPXRequest):
+    """
+    HTTPXRequest с учетом ожидания свободного соединения
+
+    Одновременных запросов не больше размера пула: лишние ждут здесь, в
+    семафоре, а не внутри httpx, поэтому время ожидания можно измерить.
+    Ожидание дольше pool_timeout заканчивается TimedOut, как в HTTPXRequest.
+    """
+
+    def __init__(self, name: str, connection_pool_size: int, pool_timeout: Optional[float] = 1.0, **kwargs):
+        """
+        Инициализация транспорта
+
+        Args:
+            name (str): Имя пула для логов и метрик
+            connection_pool_size (int): Размер пула соединений
+            pool_timeout (Optional[float]): Сколько ждать свободное соединение (None - без ограничения)
+            **kwargs: Остальные параметры HTTPXRequest (таймауты, http_version)
+        """
+        super().__init__(connection_pool_size=connection_pool_size, pool_timeout=pool_timeout, **kwargs)
+        self.name = name
+        self.pool_size = connection_pool_size
+        self._default_pool_timeout = pool_timeout
+        self._slots = asyncio.Semaphore(connection_pool_size)
+
+        self._requests = 0
+        self._in_flight = 0
+        self._max_in_flight = 0
+        self._waited = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._pool_timeouts = 0
+        self._errors = 0
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=HTTPXRequest.DEFAULT_NONE,
+        write_timeout=HTTPXRequest.DEFAULT_NONE,
+        connect_timeout=HTTPXRequest.DEFAULT_NONE,
+        pool_timeout=HTTPXRequest.DEFAULT_NONE,
+    ) -> Tuple[int, bytes]:
+        """Выполнение запроса после получения слота в пуле"""
+        # Значения по умолчанию PTB передает объектами DefaultValue
+        if pool_timeout is not None and not isinstance(pool_timeout, (int, float)):
+            pool_timeout = self._default_pool_timeout
+
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), pool_timeout)
+        except asyncio.TimeoutError:
+            self._pool_timeouts += 1
+            logger.warning(f"Пул Telegram '{self.name}' занят дольше {pool_timeout} с, запрос не отправлен")
+            raise TimedOut(
+                f"Pool timeout: все {self.pool_size} соединений пула '{self.name}' заняты"
+            ) from None
+
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            self._waited += 1
+            self._wait_total += waited
+            if waited > self._wait_max:
+                self._wait_max = waited
+
+        self._requests += 1
+        self._in_flight += 1
+        if self._in_flight > self._max_in_flight:
+            self._max_in_flight = self._in_flight
+
+        try:
+            return await super().do_request(
+                url,
+                method,
+                request_data=request_data,
+                read_timeout=read_timeout,
+                write_timeout=write_timeout,
+                connect_timeout=connect_timeout,
+                pool_timeout=pool_timeout,
+            )
+        except Exception:
+            self._errors += 1
+            raise
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Метрики пула
+
+        Returns:
+            Dict: Размер пула, запросов всего и сейчас, максимум одновременных,
+                сколько запросов ждали соединение, среднее и максимальное ожидание
+                (секунды), отказы по pool_timeout и ошибки
+        """
+        return {
+            'name': self.name,
+            'pool_size': self.pool_size,
+            'requests': self._requests,
+            'in_flight': self._in_flight,
+            'max_in_flight': self._max_in_flight,
+            'waited': self._waited,
+            'wait_avg': self._wait_total / self._waited if self._waited else 0.0,
+            'wait_max': self._wait_max,
+            'pool_timeouts': self._pool_timeouts,
+            'errors': self._errors
+        }
+
+
+def create_bot_request(name: str = 'bot') -> InstrumentedHTTPXRequest:
+    """
+    Транспорт для исходящих вызовов Bot API (send_message, send_video и т.д.)
+
+    Args:
+        name (str): Имя пула для логов и метрик
+
+    Returns:
+        InstrumentedHTTPXRequest: Транспорт с настройками из конфигурации
+    """
+    return InstrumentedHTTPXRequest(
+        name,
+        connection_pool_size=TELEGRAM_POOL_SIZE,
+        pool_timeout=TELEGRAM_POOL_TIMEOUT,
+        connect_timeout=TELEGRAM_CONNECT_TIMEOUT,
+        read_timeout=TELEGRAM_READ_TIMEOUT,
+        write_timeout=TELEGRAM_WRITE_TIMEOUT,
+        http_version=TELEGRAM_HTTP_VERSION
+    )
+
+
+def create_updates_request() -> InstrumentedHTTPXRequest:
+    """
+    Отдельный транспорт для getUpdates
+
+    Длинный запрос getUpdates не занимает соединения исходящих вызовов.
+    Read timeout для него PTB выставляет сам по таймауту long polling.
+
+    Returns:
+        InstrumentedHTTPXRequest: Транспорт с одним соединением
+    """
+    return InstrumentedHTTPXRequest(
+        'get_updates',
+        connection_pool_size=GET_UPDATES_POOL_SIZE,
+        pool_timeout=TELEGRAM_POOL_TIMEOUT,
+        connect_timeout=TELEGRAM_CONNECT_TIMEOUT,
+        read_timeout=TELEGRAM_READ_TIMEOUT,
+        write_timeout=TELEGRAM_WRITE_TIMEOUT,
+        http_version=TELEGRAM_HTTP_VERSION
+    )
+
+
+def create_bot(request: Optional[InstrumentedHTTPXRequest] = None,
+               get_updates_request: Optional[InstrumentedHTTPXRequest] = None,
+               rate_limiter: Optional[TelegramRateLimiter] = None) -> ExtBot:
+    """
+    Bot с настроенными транспортами и ограничителем частоты
+
+    Args:
+        request (Optional[InstrumentedHTTPXRequest]): Транспорт исходящих вызовов
+        get_updates_request (Optional[InstrumentedHTTPXRequest]): Транспорт getUpdates
+        rate_limiter (Optional[TelegramRateLimiter]): Ограничитель частоты вызовов
+
+    Returns:
+        ExtBot: Клиент Bot API
+    """
+    return ExtBot(
+        token=TELEGRAM_BOT_TOKEN,
+        request=request or create_bot_request(),
+        get_updates_request=get_updates_request or create_updates_request(),
+        rate_limiter=rate_limiter or TelegramRateLimiter()
+    )
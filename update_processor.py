@@ -0,0 +1,167 @@
+"""
+Параллельная обработка обновлений Telegram с сохранением порядка для каждого пользователя
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from idempotency import UpdateDeduplicator
+
+logger = logging.getLogger(__name__)
+
+# Семафор базового класса ограничивает обновления, которые ждут в очередях
+# пользователей; сколько обрабатывается одновременно, ограничивают свои слоты
+MAX_PENDING_UPDATES = 10000
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обновления разных пользователей обрабатываются параллельно (не больше
+    max_concurrent_updates одновременно), а обновления одного пользователя -
+    строго по очереди, в порядке поступления.
+
+    Долгий вызов Whisper или n8n у одного пользователя не задерживает
+    остальных, а сообщения и нажатия кнопок одного пользователя не гоняются
+    друг с другом за состояние сессии.
+    """
+
+    def __init__(self, max_concurrent_updates: int,
+                 deduplicator: Optional[UpdateDeduplicator] = None):
+        """
+        Инициализация обработчика
+
+        Args:
+            max_concurrent_updates (int): Максимум одновременно обрабатываемых обновлений
+            deduplicator (Optional[UpdateDeduplicator]): Отсев повторных доставок
+                (проверяется при поступлении, до очереди пользователя)
+        """
+        # Базовый семафор не должен срабатывать раньше слотов: обновление
+        # сначала ждет очереди пользователя и только потом занимает слот
+        super().__init__(max(max_concurrent_updates, MAX_PENDING_UPDATES))
+        self.slots = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self.deduplicator = deduplicator
+
+        # Очередь пользователя - это ожидающие его блокировку задачи.
+        # _key_depth: сколько обновлений пользователя ждет или обрабатывается.
+        self._key_locks: Dict[Hashable, asyncio.Lock] = {}
+        self._key_depth: Dict[Hashable, int] = {}
+
+        self._in_flight = 0
+        self._processed = 0
+        self._max_key_depth = 0
+
+    @staticmethod
+    def get_update_key(update: object) -> Optional[Hashable]:
+        """
+        Ключ, по которому обновления выстраиваются в очередь
+
+        Args:
+            update (object): Обновление
+
+        Returns:
+            Optional[Hashable]: Telegram ID пользователя (или чата), None - без очереди
+        """
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """
+        Обработка обновления: сначала очередь пользователя, затем слот
+
+        Обновление сначала дожидается своей очереди и только потом занимает
+        слот - иначе пачка сообщений одного пользователя заняла бы все слоты
+        ожиданием собственной блокировки.
+
+        Args:
+            update (object): Обновление
+            coroutine (Awaitable): Корутина обработки обновления
+        """
+        # Дубликат отбрасывается до обращений к базе и Bot API. Окно двойного
+        # нажатия отсчитывается от поступления, а не от конца обработки
+        # предыдущего обновления пользователя
+        if self.deduplicator is not None and self.deduplicator.is_duplicate(update):
+            coroutine.close()
+            return
+
+        key = self.get_update_key(update)
+
+        if key is None:
+            async with self._slots:
+                await self._run(coroutine)
+            return
+
+        lock = self._key_locks.get(key)
+        if lock is None:
+            lock = self._key_locks[key] = asyncio.Lock()
+
+        depth = self._key_depth.get(key, 0) + 1
+        self._key_depth[key] = depth
+        if depth > self._max_key_depth:
+            self._max_key_depth = depth
+
+        try:
+            async with lock:
+                async with self._slots:
+                    await self._run(coroutine)
+        finally:
+            depth = self._key_depth[key] - 1
+            if depth:
+                self._key_depth[key] = depth
+            else:
+                # Никто больше не ждет эту блокировку - освобождаем память
+                del self._key_depth[key]
+                del self._key_locks[key]
+
+    async def _run(self, coroutine: Awaitable[Any]) -> None:
+        """
+        Выполнение обработки обновления (слот уже занят)
+
+        Args:
+            coroutine (Awaitable): Корутина обработки обновления
+        """
+        self._in_flight += 1
+        try:
+            await coroutine
+        finally:
+            self._in_flight -= 1
+            self._processed += 1
+
+    async def initialize(self) -> None:
+        """Ресурсы не требуются"""
+
+    async def shutdown(self) -> None:
+        """Ресурсы не требуются"""
+
+    def get_stats(self, top: int = 10) -> Dict[str, Any]:
+        """
+        Метрики очередей обработки
+
+        Args:
+            top (int): Сколько самых длинных очередей вернуть
+
+        Returns:
+            Dict: Отсев дубликатов, обрабатывается сейчас, обработано всего, в очередях (ожидают или
+                обрабатываются), число очередей, максимальная глубина очереди за все
+                время и самые длинные очереди по ключу
+        """
+        pending = sum(self._key_depth.values())
+        longest = sorted(self._key_depth.items(), key=lambda item: item[1], reverse=True)[:top]
+
+        return {
+            'duplicates': self.deduplicator.get_stats() if self.deduplicator is not None else None,
+            'max_concurrent_updates': self.slots,
+            'in_flight': self._in_flight,
+            'processed': self._processed,
+            'pending': pending,
+            'active_keys': len(self._key_depth),
+            'max_key_depth': self._max_key_depth,
+            'depth_by_key': dict(longest)
+        }
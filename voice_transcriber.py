@@ -5,15 +5,21 @@ import os
 import logging
 import tempfile
 from typing import Optional
-import aiohttp
 from openai import AsyncOpenAI
 from config import OPENAI_API_KEY
+from http_client import HTTPClientManager
 
 logger = logging.getLogger(__name__)
 
 class VoiceTranscriber:
-    def __init__(self):
-        """Инициализация транскрибера"""
+    def __init__(self, http: Optional[HTTPClientManager] = None):
+        """
+        Инициализация транскрибера
+        
+        Args:
+            http (Optional[HTTPClientManager]): Общий HTTP клиент приложения
+        """
+        self.http = http or HTTPClientManager()
         if not OPENAI_API_KEY:
             logger.warning("OPENAI_API_KEY не установлен - транскрибация недоступна")
             self.client = None
@@ -130,16 +136,15 @@ class VoiceTranscriber:
             
             logger.info(f"Загружаем файл по URL: {download_url}")
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(download_url) as response:
-                    if response.status == 200:
-                        data = await response.read()
-                        logger.info(f"Загружен голосовой файл: {len(data)} байт")
-                        return data
-                    else:
-                        logger.error(f"Ошибка загрузки файла: HTTP {response.status}")
-                        logger.error(f"URL: {download_url}")
-                        return None
+            async with self.http.session.get(download_url) as response:
+                if response.status == 200:
+                    data = await response.read()
+                    logger.info(f"Загружен голосовой файл: {len(data)} байт")
+                    return data
+                else:
+                    logger.error(f"Ошибка загрузки файла: HTTP {response.status}")
+                    logger.error(f"URL: {download_url}")
+                    return None
 
         except Exception as e:
             logger.error(f"Ошибка при загрузке голосового файла: {e}")
@@ -2,29 +2,62 @@
 Обработчик webhook от n8n для получения сгенерированных постов
 """
 import logging
-import re
-from typing import Dict, Any, Optional
+from typing import Any, Callable, Dict, Optional
 from telegram import Bot
-from database import Database
-from config import TELEGRAM_BOT_TOKEN, MESSAGES
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+from database import Database, create_database
+from telegram_transport import create_bot
+from telegram_html import sanitize_telegram_html, send_html_message
+from config import MESSAGES
 
 logger = logging.getLogger(__name__)
 
+# Отметка в данных ответа n8n: пост уже сохранен, осталось отправить его на проверку
+REVIEW_PENDING = '_review_pending'
+# Сколько частей длинного поста уже доставлено (повтор продолжает со следующей)
+REVIEW_SENT_CHUNKS = '_review_sent_chunks'
+
 class WebhookHandler:
-    def __init__(self):
-        """Инициализация обработчика webhook"""
-        self.db = Database()
-        self.bot = Bot(token=TELEGRAM_BOT_TOKEN)
+    def __init__(self, db: Optional[Database] = None, bot: Optional[Bot] = None):
+        """
+        Инициализация обработчика webhook
+        
+        Args:
+            db (Optional[Database]): Хранилище (по умолчанию - по настройке DB_BACKEND)
+            bot (Optional[Bot]): Клиент Bot API (например, бот приложения, чтобы
+                использовать его пул соединений). По умолчанию создается свой
+                с транспортом из telegram_transport
+        """
+        # Закрываем при остановке только то, что создали сами
+        self._owns_db = db is None
+        self._owns_bot = bot is None
+        
+        self.db = db or create_database()
+        self.bot = bot or create_bot()
+
+    async def close(self):
+        """Освобождение собственных соединений (общие с ботом не трогаем)"""
+        if self._owns_bot:
+            # Bot не инициализируется (get_me не нужен), закрываем пул соединений напрямую
+            await self.bot.request.shutdown()
+        if self._owns_db:
+            await self.db.close()
 
     async def handle_n8n_response(self, data: Dict[str, Any]) -> Dict[str, str]:
         """
         Обработка ответа от n8n с сгенерированным постом
         
+        Временные ошибки (база, сеть до Telegram) возвращают статус 'retry':
+        тот же ответ можно обработать повторно. Если пост уже сохранен,
+        в data отмечается REVIEW_PENDING, и повтор только отправляет его
+        на проверку, начиная с первой недоставленной части (REVIEW_SENT_CHUNKS).
+        Отказ Telegram (BadRequest, Forbidden) повтором не исправить - это ошибка.
+        
         Args:
             data (Dict): Данные от n8n
             
         Returns:
-            Dict: Ответ для n8n
+            Dict: Результат: status 'success', 'error' или 'retry' и message
         """
         try:
             # Извлекаем данные из запроса
@@ -35,29 +68,54 @@ class WebhookHandler:
                 logger.error(f"Неполные данные от n8n: {data}")
                 return {"status": "error", "message": "Missing required fields"}
             
-            # Очищаем HTML от неподдерживаемых тегов
-            cleaned_post = self._clean_html_for_telegram(generated_post)
-            
-            # Находим активную сессию пользователя
-            session = await self.db.get_active_post_session(telegram_id)
-            
-            if not session or session['session_status'] != 'generating':
-                logger.error(f"Активная сессия не найдена для пользователя {telegram_id}")
-                return {"status": "error", "message": "Active session not found"}
-            
-            # Обновляем сессию с очищенным постом
-            success = await self.db.update_session_status(
-                session['id'], 
-                'reviewing', 
-                cleaned_post
-            )
-            
-            if not success:
-                logger.error(f"Ошибка при обновлении сессии {session['id']}")
-                return {"status": "error", "message": "Failed to update session"}
+            try:
+                telegram_id = int(telegram_id)
+                session_id = int(data['session_id']) if data.get('session_id') is not None else None
+            except (TypeError, ValueError):
+                logger.error(f"Некорректные идентификаторы в ответе n8n: {data}")
+                return {"status": "error", "message": "Invalid telegram_id or session_id"}
+            
+            # Оставляем только поддерживаемые Telegram теги и балансируем их
+            cleaned_post = sanitize_telegram_html(generated_post)
+            
+            if not data.get(REVIEW_PENDING):
+                if session_id is None:
+                    # Старый формат ответа без session_id: ищем сессию по пользователю
+                    # (в обход кэша: статус сессии меняет процесс бота)
+                    session = await self.db.get_active_post_session(
+                        telegram_id, use_cache=False, projection='routing'
+                    )
+                    if not session:
+                        logger.error(f"Активная сессия не найдена для пользователя {telegram_id}")
+                        return {"status": "error", "message": "Active session not found"}
+                    session_id = session['id']
+                
+                # Пост сохраняется, только если сессия все еще ждет генерации
+                try:
+                    session = await self.db.complete_session_generation(session_id, telegram_id, cleaned_post)
+                except Exception as e:
+                    return {"status": "retry", "message": f"Database error: {e}"}
+                
+                if not session:
+                    logger.error(f"Сессия {session_id} пользователя {telegram_id} не ожидает генерации")
+                    return {"status": "error", "message": "Session is not awaiting generation"}
+                
+                data[REVIEW_PENDING] = True
             
             # Отправляем очищенный пост на проверку пользователю
-            await self._send_post_for_review(telegram_id, cleaned_post)
+            def chunk_sent(sent_chunks: int):
+                data[REVIEW_SENT_CHUNKS] = sent_chunks
+            
+            try:
+                await self._send_post_for_review(
+                    telegram_id, cleaned_post,
+                    start_chunk=data.get(REVIEW_SENT_CHUNKS, 0), on_chunk_sent=chunk_sent
+                )
+            except (BadRequest, Forbidden) as e:
+                # BadRequest - подкласс NetworkError, поэтому проверяется раньше
+                return {"status": "error", "message": f"Telegram rejected the post: {e}"}
+            except (NetworkError, RetryAfter) as e:
+                return {"status": "retry", "message": f"Telegram is unavailable: {e}"}
             
             logger.info(f"Пост успешно отправлен на проверку пользователю {telegram_id}")
             return {"status": "success", "message": "Post sent for review"}
@@ -66,13 +124,17 @@ class WebhookHandler:
             logger.error(f"Ошибка при обработке ответа от n8n: {e}")
             return {"status": "error", "message": str(e)}
 
-    async def _send_post_for_review(self, telegram_id: int, generated_post: str):
+    async def _send_post_for_review(self, telegram_id: int, generated_post: str,
+                                    start_chunk: int = 0,
+                                    on_chunk_sent: Optional[Callable[[int], Any]] = None):
         """
         Отправка сгенерированного поста пользователю на проверку
         
         Args:
             telegram_id (int): Telegram ID пользователя
             generated_post (str): Сгенерированный пост
+            start_chunk (int): С какой части длинного поста начинать
+            on_chunk_sent (Optional[Callable]): Вызывается с количеством отправленных частей
         """
         try:
             from telegram import InlineKeyboardButton, InlineKeyboardMarkup
@@ -89,81 +151,17 @@ class WebhookHandler:
             # Форматируем сообщение с постом
             review_message = MESSAGES['post_review'].format(post_content=generated_post)
             
-            # Отправляем пост на проверку
-            await self.bot.send_message(
-                chat_id=telegram_id,
-                text=review_message,
+            # Отправляем пост на проверку (длинный пост - несколькими сообщениями)
+            await send_html_message(
+                self.bot.send_message,
+                review_message,
                 reply_markup=reply_markup,
-                parse_mode='HTML',
+                start_chunk=start_chunk,
+                on_chunk_sent=on_chunk_sent,
+                chat_id=telegram_id,
                 disable_web_page_preview=True
             )
             
         except Exception as e:
             logger.error(f"Ошибка при отправке поста на проверку пользователю {telegram_id}: {e}")
             raise
-
-    def _clean_html_for_telegram(self, html_text: str) -> str:
-        """
-        Очистка HTML от неподдерживаемых Telegram тегов
-        
-        Args:
-            html_text (str): HTML текст от N8N
-            
-        Returns:
-            str: Очищенный текст с поддерживаемыми тегами
-        """
-        try:
-            # Заменяем неподдерживаемые теги на поддерживаемые или убираем их
-            
-            # <p> заменяем на двойной перенос строки
-            html_text = re.sub(r'<p[^>]*>', '', html_text)
-            html_text = re.sub(r'</p>', '\n\n', html_text)
-            
-            # <br> и <br/> заменяем на \n
-            html_text = re.sub(r'<br\s*/?>', '\n', html_text)
-            
-            # <div> убираем, оставляем содержимое
-            html_text = re.sub(r'<div[^>]*>', '', html_text)
-            html_text = re.sub(r'</div>', '\n', html_text)
-            
-            # <span> убираем, оставляем содержимое  
-            html_text = re.sub(r'<span[^>]*>', '', html_text)
-            html_text = re.sub(r'</span>', '', html_text)
-            
-            # <h1>, <h2>, <h3> заменяем на жирный текст
-            html_text = re.sub(r'<h[1-6][^>]*>', '<b>', html_text)
-            html_text = re.sub(r'</h[1-6]>', '</b>\n\n', html_text)
-            
-            # Убираем остальные неподдерживаемые теги (сохраняем содержимое)
-            unsupported_tags = ['ul', 'ol', 'li', 'table', 'tr', 'td', 'th', 'thead', 'tbody']
-            for tag in unsupported_tags:
-                html_text = re.sub(f'<{tag}[^>]*>', '', html_text)
-                html_text = re.sub(f'</{tag}>', '\n', html_text)
-            
-            # Убираем множественные переносы строк
-            html_text = re.sub(r'\n{3,}', '\n\n', html_text)
-            
-            # Убираем пробелы в начале и конце
-            html_text = html_text.strip()
-            
-            logger.info(f"HTML очищен от неподдерживаемых тегов")
-            return html_text
-            
-        except Exception as e:
-            logger.error(f"Ошибка при очистке HTML: {e}")
-            # В случае ошибки возвращаем исходный текст
-            return html_text
-
-# Функция для использования в веб-сервере (например, FastAPI или Flask)
-async def process_n8n_webhook(request_data: Dict[str, Any]) -> Dict[str, str]:
-    """
-    Функция для обработки webhook от n8n
-    
-    Args:
-        request_data (Dict): Данные от n8n
-        
-    Returns:
-        Dict: Ответ для n8n
-    """
-    handler = WebhookHandler()
-    return await handler.handle_n8n_response(request_data)
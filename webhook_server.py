@@ -1,14 +1,38 @@
 """
-Простой веб-сервер для обработки webhook от n8n
+Простой веб-сервер для обработки webhook от n8n и обновлений Telegram
 """
+import hmac
 import logging
 import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
 from aiohttp import web, ClientError
 import json
-from webhook_handler import process_n8n_webhook
+from config import (
+    TELEGRAM_WEBHOOK_PATH,
+    TELEGRAM_WEBHOOK_SECRET,
+    TELEGRAM_ALLOWED_UPDATES,
+    N8N_DEDUP_TTL,
+    N8N_DEDUP_SIZE
+)
+from webhook_handler import WebhookHandler
+from n8n_queue import N8NResultQueue
+from idempotency import IdempotencyStore, n8n_result_key
 
 logger = logging.getLogger(__name__)
 
+# Получатель обновлений Telegram: очередь приложения бота или распределитель по процессам
+TelegramUpdateSink = Callable[[Dict[str, Any]], Awaitable[None]]
+TELEGRAM_UPDATE_SINK = web.AppKey('telegram_update_sink', TelegramUpdateSink)
+
+# Обработчик ответов n8n: один на все время работы приложения
+N8N_HANDLER = web.AppKey('n8n_handler', WebhookHandler)
+N8N_QUEUE = web.AppKey('n8n_queue', N8NResultQueue)
+# Уже принятые ответы n8n: повторная доставка не попадает в очередь
+N8N_DEDUP = web.AppKey('n8n_dedup', IdempotencyStore)
+
+# Через сколько секунд n8n стоит повторить запрос, если очередь заполнена
+N8N_RETRY_AFTER = 5
+
 async def handle_n8n_webhook(request):
     """Обработчик webhook от n8n"""
     try:
@@ -16,10 +40,31 @@ async def handle_n8n_webhook(request):
         data = await request.json()
         logger.info(f"Получен webhook от n8n: {data}")
         
-        # Обрабатываем webhook
-        response = await process_n8n_webhook(data)
+        if not isinstance(data, dict) or not data.get('telegram_id') or not data.get('generated_post'):
+            logger.error(f"Неполные данные от n8n: {data}")
+            return web.json_response(
+                {"status": "error", "message": "Missing required fields"},
+                status=400
+            )
         
-        return web.json_response(response)
+        # Повтор уже принятого ответа подтверждаем, но не обрабатываем
+        # (иначе пользователь получил бы пост на проверку второй раз)
+        result_key = n8n_result_key(data)
+        if not request.app[N8N_DEDUP].claim(result_key):
+            logger.info(f"Повторный ответ n8n {result_key} отброшен")
+            return web.json_response({"status": "duplicate"})
+        
+        # Обработка (база, отправка поста в Telegram) идет в фоне, n8n не ждет
+        if not request.app[N8N_QUEUE].submit(data):
+            # Ответ не принят - повтор от n8n должен пройти
+            request.app[N8N_DEDUP].release(result_key)
+            return web.json_response(
+                {"status": "error", "message": "Queue is full"},
+                status=503,
+                headers={'Retry-After': str(N8N_RETRY_AFTER)}
+            )
+        
+        return web.json_response({"status": "accepted"}, status=202)
         
     except json.JSONDecodeError:
         logger.error("Некорректный JSON в webhook от n8n")
@@ -34,23 +79,100 @@ async def handle_n8n_webhook(request):
             status=500
         )
 
+async def handle_telegram_update(request):
+    """Обработчик обновлений Telegram (режим BOT_RUN_MODE=webhook)"""
+    secret = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not hmac.compare_digest(secret, TELEGRAM_WEBHOOK_SECRET or ''):
+        logger.warning("Обновление Telegram с неверным секретом отклонено")
+        return web.Response(status=403)
+    
+    try:
+        data = await request.json()
+    except json.JSONDecodeError:
+        logger.error("Некорректный JSON в обновлении Telegram")
+        return web.Response(status=400)
+    
+    # Telegram присылает только разрешенные типы, но после смены настройки
+    # старый webhook может еще доставить лишнее - такие обновления пропускаем
+    if not any(update_type in data for update_type in TELEGRAM_ALLOWED_UPDATES):
+        logger.debug(f"Пропущено обновление Telegram {data.get('update_id')}: тип не разрешен")
+        return web.Response()
+    
+    await request.app[TELEGRAM_UPDATE_SINK](data)
+    
+    # Отвечаем сразу: обработка идет в приложении бота, а повтор доставки
+    # Telegram делает только при ошибке ответа
+    return web.Response()
+
 async def health_check(request):
-    """Проверка здоровья сервера"""
-    return web.json_response({"status": "ok", "service": "telegram-bot-webhook"})
+    """Проверка здоровья сервера (и состояние очереди и отсева повторных ответов n8n)"""
+    status = {
+        "status": "ok",
+        "service": "telegram-bot-webhook"
+    }
+    if N8N_QUEUE in request.app:
+        status["n8n_queue"] = request.app[N8N_QUEUE].get_stats()
+        status["n8n_dedup"] = request.app[N8N_DEDUP].get_stats()
+    return web.json_response(status)
+
+async def _n8n_handler_context(app: web.Application):
+    """
+    Обработчик и очередь ответов n8n на время работы приложения
+    
+    Хранилище и клиент Bot API создаются один раз при запуске (если их не
+    передал процесс бота) и закрываются при остановке сервера, после
+    обработки уже принятых ответов.
+    """
+    if N8N_HANDLER not in app:
+        app[N8N_HANDLER] = WebhookHandler()
+    
+    app[N8N_QUEUE] = N8NResultQueue(app[N8N_HANDLER])
+    app[N8N_DEDUP] = IdempotencyStore(N8N_DEDUP_SIZE, N8N_DEDUP_TTL)
+    app[N8N_QUEUE].start()
+    
+    yield
+    
+    await app[N8N_QUEUE].stop()
+    await app[N8N_HANDLER].close()
 
-def create_app():
-    """Создание приложения aiohttp"""
+def create_app(telegram_update_sink: Optional[TelegramUpdateSink] = None,
+               n8n_handler: Optional[WebhookHandler] = None,
+               serve_n8n: bool = True):
+    """
+    Создание приложения aiohttp
+    
+    Args:
+        telegram_update_sink (Optional[Callable]): Получатель обновлений Telegram. Если
+            передан, добавляется маршрут приема обновлений (TELEGRAM_WEBHOOK_PATH)
+        n8n_handler (Optional[WebhookHandler]): Обработчик ответов n8n с общими
+            с ботом хранилищем и клиентом Bot API. Если не передан, создается
+            свой при запуске приложения
+        serve_n8n (bool): Принимать ли ответы n8n (/webhook/n8n). Сервер, который
+            только принимает обновления Telegram, не создает ни обработчика, ни
+            очереди n8n
+    """
     app = web.Application()
     
-    # Добавляем маршруты
-    app.router.add_post('/webhook/n8n', handle_n8n_webhook)
+    if serve_n8n:
+        if n8n_handler is not None:
+            app[N8N_HANDLER] = n8n_handler
+        app.cleanup_ctx.append(_n8n_handler_context)
+        app.router.add_post('/webhook/n8n', handle_n8n_webhook)
+    
     app.router.add_get('/health', health_check)
     
+    if telegram_update_sink is not None:
+        app[TELEGRAM_UPDATE_SINK] = telegram_update_sink
+        app.router.add_post(TELEGRAM_WEBHOOK_PATH, handle_telegram_update)
+    
     return app
 
-async def run_webhook_server(host='0.0.0.0', port=8080):
+async def run_webhook_server(host='0.0.0.0', port=8080,
+                             telegram_update_sink: Optional[TelegramUpdateSink] = None,
+                             n8n_handler: Optional[WebhookHandler] = None,
+                             serve_n8n: bool = True):
     """Запуск веб-сервера для webhook"""
-    app = create_app()
+    app = create_app(telegram_update_sink, n8n_handler, serve_n8n)
     
     logger.info(f"Запуск webhook сервера на {host}:{port}")
     